@@ -0,0 +1,299 @@
+"""Installed applications, listed once per process and matched by name through a trigram index.
+
+The catalog keeps the entries of the application directories and only lists them again when a
+directory modification time changes. Metadata (.desktop files, Info.plist) is parsed once per
+entry and modification time. Fuzzy lookups score the names that share trigrams with the query
+instead of comparing the query with every installed application.
+
+    cd openaci && python -m agent.AppCatalog --apps 2000 --queries 2000
+"""
+import argparse
+import configparser
+import difflib
+import os
+import plistlib
+import re
+import shlex
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+# Field codes of a .desktop Exec line (%f, %U, ...) that the launcher fills in
+FIELD_CODE = re.compile(r'\s*%[a-zA-Z]')
+
+
+def normalize(name):
+    '''Lowercase name without the bundle suffix and separators, the form names are matched in'''
+    name = name.lower()
+    for suffix in ('.app', '.desktop'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return ' '.join(re.split(r'[\s._-]+', name)).strip()
+
+
+def trigrams(text):
+    '''Trigrams of the padded text, so short names and word starts still share some'''
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class App:
+    '''One installed application.
+
+    Attributes:
+        name: entry name as listed to the planner, e.g. Safari.app or org.gnome.Nautilus
+        display_name: name shown to the user, from the metadata when it has one
+        command: argv launching the application, None when it is opened by name
+        identifier: bundle identifier on macOS, None elsewhere
+        hidden: the entry asks not to be shown in menus
+    '''
+    def __init__(self, name, display_name=None, command=None, identifier=None, hidden=False):
+        self.name = name
+        self.display_name = display_name or normalize(name)
+        self.command = command
+        self.identifier = identifier
+        self.hidden = hidden
+
+    def __repr__(self):
+        return f"App({self.name!r}, display_name={self.display_name!r})"
+
+
+def parse_desktop_file(path, name):
+    '''App of a freedesktop .desktop entry'''
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        parser.read(path, encoding='utf-8')
+        entry = parser['Desktop Entry']
+    except (configparser.Error, KeyError, UnicodeDecodeError):
+        return App(name)
+    command = None
+    if entry.get('Exec'):
+        try:
+            command = shlex.split(FIELD_CODE.sub('', entry['Exec']))
+        except ValueError:
+            pass
+    hidden = entry.get('NoDisplay', 'false') == 'true' or entry.get('Hidden', 'false') == 'true'
+    return App(name, entry.get('Name'), command, hidden=hidden)
+
+
+def parse_info_plist(path, name):
+    '''App of a macOS bundle, from Contents/Info.plist'''
+    try:
+        with open(os.path.join(path, 'Contents', 'Info.plist'), 'rb') as plist_file:
+            info = plistlib.load(plist_file)
+    except (OSError, plistlib.InvalidFileException, ValueError):
+        return App(name)
+    display_name = info.get('CFBundleDisplayName') or info.get('CFBundleName')
+    return App(name, display_name if isinstance(display_name, str) else None,
+               identifier=info.get('CFBundleIdentifier'))
+
+
+class AppCatalog:
+    '''Applications of a set of directories, shared by every GroundingAgent of the process.
+
+    Args:
+        directories: directories to list, in order
+        suffix: extension of the application entries, .app or .desktop
+        parse: parse(path, name) -> App, None to use the entry name only
+        strip_suffix: list the entries without the suffix
+        check_interval: seconds between checks of the directory modification times
+    '''
+    def __init__(self, directories, suffix, parse=None, strip_suffix=False, check_interval=1.):
+        self.directories = list(directories)
+        self.suffix = suffix
+        self.parse = parse
+        self.strip_suffix = strip_suffix
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.mtimes = None
+        self.checked = 0.
+        # path -> (mtime, App), parsed metadata survives reloads of the directory
+        self.parsed = {}
+        self.apps = []
+        self.by_name = {}
+        self.keys = []
+        self.key_grams = np.zeros(0, dtype=np.int32)
+        self.postings = {}
+        self.stats = {'loads': 0, 'parsed': 0, 'lookups': 0, 'exact': 0}
+
+    def directory_mtimes(self):
+        mtimes = []
+        for directory in self.directories:
+            try:
+                mtimes.append(os.stat(directory).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def refresh(self, force=False):
+        '''List the directories again if one of them changed, returns True if the catalog was reloaded'''
+        now = time.monotonic()
+        if not force and self.mtimes is not None and now - self.checked < self.check_interval:
+            return False
+        with self.lock:
+            self.checked = now
+            mtimes = self.directory_mtimes()
+            if not force and mtimes == self.mtimes:
+                return False
+            self.load()
+            self.mtimes = mtimes
+            return True
+
+    def load(self):
+        apps = []
+        parsed = {}
+        for directory in self.directories:
+            try:
+                entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                name = entry.name[:-len(self.suffix)] if self.strip_suffix else entry.name
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except OSError:
+                    continue
+                cached = self.parsed.get(entry.path)
+                if cached is not None and cached[0] == mtime:
+                    app = cached[1]
+                else:
+                    app = self.parse(entry.path, name) if self.parse is not None else App(name)
+                    self.stats['parsed'] += 1
+                parsed[entry.path] = (mtime, app)
+                apps.append(app)
+        self.parsed = parsed
+        self.index(apps)
+        self.stats['loads'] += 1
+
+    def index(self, apps):
+        '''Build the exact and trigram lookups over the entry and display names'''
+        # NoDisplay and Hidden entries are helpers and URL handlers, not applications to open
+        apps = [app for app in apps if not app.hidden]
+        by_name = {}
+        keys = []
+        postings = defaultdict(list)
+        for app in apps:
+            # The first directory wins, like the launcher search order
+            by_name.setdefault(app.name, app)
+            for key in {normalize(app.name), normalize(app.display_name)}:
+                by_name.setdefault(key, app)
+                grams = trigrams(key)
+                for gram in grams:
+                    postings[gram].append(len(keys))
+                keys.append((key, app, len(grams)))
+        self.key_grams = np.array([grams for _, _, grams in keys], dtype=np.int32)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.apps, self.by_name, self.keys = apps, by_name, keys
+
+    @property
+    def names(self):
+        '''Entry names of the installed applications, the list given to the planner'''
+        self.refresh()
+        return [app.name for app in self.apps]
+
+    def get(self, name):
+        '''App with exactly this entry or normalized name, None if there is none'''
+        self.refresh()
+        return self.by_name.get(name) or self.by_name.get(normalize(name))
+
+    def match(self, query, cutoff=0.6, candidates=8):
+        '''Installed App whose name is closest to the query, None if none is at least cutoff similar.
+
+        Similarity is the difflib ratio of the normalized names, the ratio get_close_matches used,
+        but only computed for the names sharing the most trigrams with the query.
+        '''
+        self.refresh()
+        self.stats['lookups'] += 1
+        app = self.by_name.get(query) or self.by_name.get(normalize(query))
+        if app is not None:
+            self.stats['exact'] += 1
+            return app
+
+        query = normalize(query)
+        query_grams = trigrams(query)
+        hits = [self.postings[gram] for gram in query_grams if gram in self.postings]
+        if not hits:
+            return None
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.keys))
+        # Dice coefficient of the trigram sets ranks the candidates
+        dice = 2 * shared / (len(query_grams) + self.key_grams)
+        ranked = np.argpartition(-dice, candidates)[:candidates] if len(dice) > candidates else np.arange(len(dice))
+        ranked = ranked[np.argsort(-dice[ranked], kind='stable')]
+
+        best, best_ratio = None, cutoff
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(query)
+        for key_id in ranked:
+            if not shared[key_id]:
+                break
+            key, app, _ = self.keys[key_id]
+            matcher.set_seq1(key)
+            if matcher.real_quick_ratio() >= best_ratio and matcher.quick_ratio() >= best_ratio:
+                ratio = matcher.ratio()
+                if ratio >= best_ratio and (best is None or ratio > best_ratio):
+                    best, best_ratio = app, ratio
+        return best
+
+
+def synthetic_apps(directory, apps, seed=0):
+    '''Write apps .desktop files with made-up names into directory'''
+    import random
+
+    rng = random.Random(seed)
+    words = ["text", "image", "music", "video", "office", "mail", "chat", "terminal", "files", "calendar",
+             "notes", "photo", "draw", "code", "web", "disk", "system", "monitor", "player", "studio"]
+    for i in range(apps):
+        name = " ".join(rng.sample(words, 2)).title() + f" {i}"
+        with open(os.path.join(directory, f"org.example.App{i}.desktop"), "w") as desktop_file:
+            desktop_file.write(f"[Desktop Entry]\nType=Application\nName={name}\nExec=app{i} %U\n")
+
+
+def main():
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Benchmark catalog lookups against listing and difflib per call")
+    parser.add_argument("--apps", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic_apps(directory, args.apps)
+        catalog = AppCatalog([directory], ".desktop", parse_desktop_file, strip_suffix=True)
+
+        start = time.perf_counter()
+        catalog.refresh()
+        print(f"first load: {(time.perf_counter() - start) * 1000:.1f} ms for {args.apps} entries")
+        start = time.perf_counter()
+        catalog.refresh(force=True)
+        print(f"reload with parsed metadata cached: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        # Misspelled display names and entry names
+        queries = []
+        for i, app in enumerate(catalog.apps[:args.queries]):
+            name = app.display_name if i % 2 else app.name
+            position = len(name) // 2
+            queries.append(name[:position] + name[position + 1:])
+
+        start = time.perf_counter()
+        found = [catalog.match(query) for query in queries]
+        indexed = (time.perf_counter() - start) / len(queries)
+
+        start = time.perf_counter()
+        listed = []
+        for query in queries:
+            names = [entry[:-len(".desktop")] for entry in os.listdir(directory) if entry.endswith(".desktop")]
+            listed.append(difflib.get_close_matches(query, names, n=1, cutoff=0.6))
+        linear = (time.perf_counter() - start) / len(queries)
+
+        hits = sum(app is not None and app.name == expected.name for app, expected in zip(found, catalog.apps))
+        print(f"match: {indexed * 1e6:.0f} us per query, {hits}/{len(queries)} found the misspelled app; "
+              f"listdir + get_close_matches: {linear * 1e6:.0f} us per query")
+        print(f"stats: {catalog.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import numpy as np
+
+# OCR boxes compared against the tree per block, bounds the IoU matrix to BLOCK_SIZE x len(tree)
+BLOCK_SIZE = 256
+
+
+def box_iou(boxes1, boxes2):
+    '''(N, M) intersection over union of x1, y1, x2, y2 boxes, 0 where both boxes are empty'''
+    boxes1 = np.asarray(boxes1, dtype=np.float32).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float32).reshape(-1, 4)
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    size = np.clip(bottom_right - top_left, 0, None)
+    intersection = size[..., 0] * size[..., 1]
+    union = area1[:, None] + area2[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def new_ocr_boxes(tree_boxes, ocr_boxes, iou_threshold=0.1, index=None):
+    '''Mask of the OCR boxes that overlap no tree box by iou_threshold or more, all of them for an empty tree.
+
+    With a SpatialIndex over the tree boxes each OCR box is only compared to the boxes near it.
+    '''
+    tree_boxes = np.asarray(tree_boxes, dtype=np.float32).reshape(-1, 4)
+    ocr_boxes = np.asarray(ocr_boxes, dtype=np.float32).reshape(-1, 4)
+    if index is not None:
+        return np.array([len(index.overlapping(box, iou_threshold)) == 0 for box in ocr_boxes], dtype=bool)
+    if len(tree_boxes) == 0:
+        return np.ones(len(ocr_boxes), dtype=bool)
+    mask = np.empty(len(ocr_boxes), dtype=bool)
+    for start in range(0, len(ocr_boxes), BLOCK_SIZE):
+        block = ocr_boxes[start:start + BLOCK_SIZE]
+        mask[start:start + BLOCK_SIZE] = box_iou(block, tree_boxes).max(axis=1) < iou_threshold
+    return mask
@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import re
+
+from agent.RateLimiter import IMAGE_TOKENS
+from agent.TreeBudget import count_tokens
+
+logger = logging.getLogger("openaci.agent")
+
+# Labels of the tree in a planning observation, a whole tree or the changes since the last one (see TreeDelta)
+TREE_LABEL = "Accessibility Tree"
+TREE_DELTA_LABEL = "Accessibility Tree Changes (elements not listed are unchanged and keep their ids)"
+
+# The tree is always the last part of a planning observation, optionally followed by a period
+TREE_PATTERN = re.compile(
+    f"(?:{re.escape(TREE_DELTA_LABEL)}|{re.escape(TREE_LABEL)}): " + r"(?!\[)(.*?)(\.?)$", re.DOTALL)
+
+
+def summarize_tree(tree):
+    '''Short stand-in for an old tree, the digest tells the model whether the screen changed between turns'''
+    rows = max(len(tree.strip().split("\n")) - 1, 0)  # minus the header
+    digest = hashlib.sha1(tree.encode('utf-8')).hexdigest()[:8]
+    return f"[{rows} elements omitted, tree {digest}]"
+
+
+def strip_tree(text):
+    '''Replace the accessibility tree in a message text with its summary, None if there is none'''
+    match = TREE_PATTERN.search(text)
+    if match is None:
+        return None
+    return text[:match.start(1)] + summarize_tree(match.group(1)) + match.group(2)
+
+
+def message_tokens(message, encoding_name="o200k_base"):
+    content = message["content"]
+    if isinstance(content, str):
+        return count_tokens(content, encoding_name) + 4
+    tokens = 4  # role and separators
+    for part in content:
+        if part.get("type") == "text":
+            tokens += count_tokens(part["text"], encoding_name)
+        elif part.get("type") == "image_url":
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+class ContextWindow:
+    '''Pack an agent's message history under a token budget.
+
+    Trees in all but the last keep_full_trees observations are replaced with a one-line summary,
+    plans and feedback are kept. If the history is still over max_tokens, the oldest turns are
+    dropped. Pinned messages (system prompt and task context) and the latest turn are never touched.
+
+    Stripping is done in place and once per message, so a packed history keeps its prefix from
+    turn to turn and stays cacheable by the provider.
+
+    Args:
+        max_tokens: budget for the whole prompt
+        keep_full_trees: number of latest observations whose trees are kept
+    '''
+    def __init__(self, max_tokens, keep_full_trees=1, encoding_name="o200k_base"):
+        self.max_tokens = max_tokens
+        self.keep_full_trees = keep_full_trees
+        self.encoding_name = encoding_name
+        # Token counts by message id, messages are only ever replaced, not edited
+        self.token_counts = {}
+
+    def tokens(self, message):
+        key = id(message)
+        cached = self.token_counts.get(key)
+        if cached is None or cached[0] is not message:
+            cached = self.token_counts[key] = (message, message_tokens(message, self.encoding_name))
+        return cached[1]
+
+    def strip_old_trees(self, messages, first):
+        '''Summarize the trees of user messages older than the latest keep_full_trees observations'''
+        with_tree = [i for i in range(first, len(messages))
+                     if messages[i]["role"] == "user" and self.tree_part(messages[i]) is not None]
+        stripped = 0
+        for i in with_tree[:max(len(with_tree) - self.keep_full_trees, 0)]:
+            message = messages[i]
+            part_index = self.tree_part(message)
+            content = list(message["content"])
+            content[part_index] = dict(content[part_index], text=strip_tree(content[part_index]["text"]))
+            messages[i] = dict(message, content=content)
+            stripped += 1
+        return stripped
+
+    @staticmethod
+    def tree_part(message):
+        content = message["content"]
+        if isinstance(content, str):
+            return None
+        for i, part in enumerate(content):
+            if part.get("type") == "text" and TREE_PATTERN.search(part["text"]):
+                return i
+        return None
+
+    def pack(self, messages, num_pinned=1):
+        '''Strip old trees and drop the oldest turns until messages fit, returns the prompt tokens'''
+        stripped = self.strip_old_trees(messages, num_pinned)
+
+        # The latest turn starts at the last user message with a tree, or is just the last message
+        latest = len(messages) - 1
+        for i in range(len(messages) - 1, num_pinned - 1, -1):
+            if messages[i]["role"] == "user" and self.tree_part(messages[i]) is not None:
+                latest = i
+                break
+
+        total = sum(self.tokens(message) for message in messages)
+        dropped = 0
+        while total > self.max_tokens and latest > num_pinned:
+            # Drop a whole turn: the observation and everything up to the next observation
+            end = num_pinned + 1
+            while end < latest and not (messages[end]["role"] == "user" and self.tree_part(messages[end]) is not None):
+                end += 1
+            for message in messages[num_pinned:end]:
+                total -= self.tokens(message)
+            del messages[num_pinned:end]
+            latest -= end - num_pinned
+            dropped += end - num_pinned
+
+        # Forget counts of messages that left the history
+        live = {id(message) for message in messages}
+        self.token_counts = {key: value for key, value in self.token_counts.items() if key in live}
+
+        if stripped or dropped:
+            logger.info("CONTEXT: stripped %d trees, dropped %d messages, %d prompt tokens", stripped, dropped, total)
+        if total > self.max_tokens:
+            logger.warning("CONTEXT: latest turn alone needs %d tokens, over the budget of %d", total, self.max_tokens)
+        return total
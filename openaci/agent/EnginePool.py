@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from agent.MultimodalEngine import LMMEngine
+
+logger = logging.getLogger("openaci.agent")
+
+
+class Deployment:
+    '''Load and health of one engine in a pool, with a circuit breaker.
+
+    After failure_threshold consecutive failures the breaker opens and the deployment gets no
+    traffic for cooldown seconds. Then one trial call is let through (half-open): success closes the
+    breaker, failure opens it again for twice as long, up to max_cooldown.
+    '''
+    def __init__(self, engine, failure_threshold=3, cooldown=10., max_cooldown=300.):
+        self.engine = engine
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.
+        self.trial_in_flight = False
+        self.latency = None  # exponentially weighted moving average of successful calls
+        self.lock = threading.Lock()
+
+    @property
+    def name(self):
+        return getattr(self.engine, 'azure_endpoint', None) or getattr(self.engine, 'base_url', None) or self.engine.model
+
+    def available(self, now):
+        if self.consecutive_failures < self.failure_threshold:
+            return True
+        # Breaker open, allow a single trial once the cooldown is over
+        return now >= self.open_until and not self.trial_in_flight
+
+    def acquire(self):
+        with self.lock:
+            if self.consecutive_failures >= self.failure_threshold:
+                self.trial_in_flight = True
+            self.in_flight += 1
+
+    def release(self, latency=None, failed=False):
+        with self.lock:
+            self.in_flight -= 1
+            self.trial_in_flight = False
+            if failed:
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.failure_threshold:
+                    if self.consecutive_failures > self.failure_threshold:
+                        self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                    self.open_until = time.monotonic() + self.cooldown
+                    logger.warning("Circuit breaker open for %s for %.0fs", self.name, self.cooldown)
+            else:
+                self.consecutive_failures = 0
+                self.cooldown = self.base_cooldown
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+    def load(self):
+        # Unknown latency counts as average so new deployments get traffic
+        return (self.in_flight + 1) * (self.latency or 1.)
+
+
+class LMMEnginePool(LMMEngine):
+    '''Route calls over several deployments of the same model.
+
+    Each call goes to the least loaded healthy deployment and fails over to the next one on errors.
+    When a call is still running after the hedge_percentile latency of recent calls, a duplicate is
+    sent to another deployment and the first answer wins.
+
+    Args:
+        engines: the deployments, e.g. LMMEngineAzureOpenAI in several regions
+        hedge_percentile: latency percentile after which a hedged request is sent, None disables hedging
+        hedge_after: hedging delay in seconds until enough latencies are known
+        min_samples: latencies needed before the percentile is used
+        failure_threshold, cooldown: circuit breaker settings, see Deployment
+    '''
+    def __init__(self, engines, hedge_percentile=0.95, hedge_after=10., min_samples=20, failure_threshold=3,
+                 cooldown=10., max_workers=None):
+        if not engines:
+            raise ValueError("LMMEnginePool needs at least one engine")
+        self.deployments = [Deployment(engine, failure_threshold, cooldown) for engine in engines]
+        self.model = engines[0].model
+        self.hedge_percentile = hedge_percentile
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=200)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or 4 * len(engines))
+        self.lock = threading.Lock()
+        self._tags = {}
+
+    @property
+    def tags(self):
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = tags
+        for deployment in self.deployments:
+            deployment.engine.tags = tags
+
+    @property
+    def cost(self):
+        return sum(deployment.engine.cost for deployment in self.deployments)
+
+    def hedge_delay(self):
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return self.hedge_after
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(self.hedge_percentile * len(latencies)))]
+
+    def pick(self, exclude=()):
+        '''Least loaded available deployment, falling back to the one whose breaker closes first'''
+        now = time.monotonic()
+        candidates = [d for d in self.deployments if d not in exclude]
+        if not candidates:
+            return None
+        available = [d for d in candidates if d.available(now)]
+        if available:
+            return min(available, key=Deployment.load)
+        return min(candidates, key=lambda d: d.open_until)
+
+    def call(self, deployment, messages, temperature, max_new_tokens, **kwargs):
+        '''One attempt on one deployment, without the engine's own backoff so failures surface quickly'''
+        deployment.acquire()
+        start = time.perf_counter()
+        try:
+            response = deployment.engine.complete(messages, temperature, max_new_tokens, **kwargs)
+        except Exception:
+            deployment.release(failed=True)
+            raise
+        latency = time.perf_counter() - start
+        deployment.release(latency)
+        with self.lock:
+            self.latencies.append(latency)
+        return response, deployment.engine.last_usage
+
+    def generate(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Generate the next message on the best deployment, failing over and hedging as needed'''
+        tried = []
+        pending = {}
+        last_error = None
+        while True:
+            if not pending:
+                deployment = self.pick(exclude=tried)
+                if deployment is None:
+                    raise last_error
+                tried.append(deployment)
+                pending[self.executor.submit(self.call, deployment, messages, temperature, max_new_tokens, **kwargs)] = deployment
+
+            hedge = self.hedge_percentile is not None and len(pending) == 1 and len(tried) < len(self.deployments)
+            done, _ = wait(list(pending), timeout=self.hedge_delay() if hedge else None, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Slow call, race a duplicate against it on another deployment
+                deployment = self.pick(exclude=tried)
+                tried.append(deployment)
+                logger.info("Hedging request to %s", deployment.name)
+                pending[self.executor.submit(self.call, deployment, messages, temperature, max_new_tokens, **kwargs)] = deployment
+                continue
+
+            for future in done:
+                deployment = pending.pop(future)
+                try:
+                    response, self.last_usage = future.result()
+                    return response
+                except Exception as e:
+                    logger.warning("Deployment %s failed: %s", deployment.name, e)
+                    last_error = e
+
+    def generate_stream(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Stream from the best deployment, failing over while nothing has been yielded yet'''
+        tried = []
+        last_error = None
+        while True:
+            deployment = self.pick(exclude=tried)
+            if deployment is None:
+                raise last_error
+            tried.append(deployment)
+            deployment.acquire()
+            start = time.perf_counter()
+            started = False
+            try:
+                for chunk in deployment.engine.complete_stream(messages, temperature, max_new_tokens, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                deployment.release(failed=True)
+                if started:
+                    raise
+                logger.warning("Deployment %s failed: %s", deployment.name, e)
+                last_error = e
+                continue
+            except GeneratorExit:
+                deployment.release(time.perf_counter() - start)
+                raise
+            deployment.release(time.perf_counter() - start)
+            self.last_usage = deployment.engine.last_usage
+            return
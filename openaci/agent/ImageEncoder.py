@@ -0,0 +1,119 @@
+import base64
+import hashlib
+import math
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+MIME_TYPES = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+
+def sniff_format(data):
+    '''Return the image format of encoded bytes from their magic number, or None'''
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'PNG'
+    if data[:3] == b'\xff\xd8\xff':
+        return 'JPEG'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+class ImageEncoder:
+    '''Encode images for the API: downscale to a pixel budget, compress, and cache the payloads.
+
+    Args:
+        format: "JPEG", "WEBP" or "PNG", or None to keep already encoded images as they are
+        quality: JPEG/WebP quality
+        max_pixels: downscale images with more pixels than this, None keeps the full resolution
+        detail: the "detail" hint sent with the image_url
+        cache_size: number of encoded payloads to keep, keyed by a hash of the input
+        png_compress_level: zlib level for PNG output, lower is faster
+    '''
+    def __init__(self, format=None, quality=85, max_pixels=None, detail='high', cache_size=8, png_compress_level=1):
+        if format is not None and format.upper() not in MIME_TYPES:
+            raise ValueError("format must be one of " + ", ".join(MIME_TYPES))
+        self.format = format.upper() if format else None
+        self.quality = quality
+        self.max_pixels = max_pixels
+        self.detail = detail
+        self.cache_size = cache_size
+        self.png_compress_level = png_compress_level
+        self.cache = OrderedDict()
+
+    @staticmethod
+    def fingerprint(image_content):
+        if isinstance(image_content, Image.Image):
+            digest = hashlib.blake2b(image_content.tobytes(), digest_size=16)
+            digest.update(f"{image_content.mode}{image_content.size}".encode())
+            return digest.digest()
+        return hashlib.blake2b(image_content, digest_size=16).digest()
+
+    def cached(self, key, encode):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        value = self.cache[key] = encode()
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return value
+
+    def convert(self, image_content):
+        '''Encode bytes or a PIL image to the target format, returns (format, bytes)'''
+        if not isinstance(image_content, Image.Image):
+            source_format = sniff_format(image_content)
+            # Already in the requested format and within budget, send it untouched
+            if source_format and (self.format is None or self.format == source_format) and self.max_pixels is None:
+                return source_format, bytes(image_content)
+            image = Image.open(BytesIO(image_content))
+            target_format = self.format or source_format or 'PNG'
+        else:
+            image = image_content
+            target_format = self.format or 'PNG'
+
+        width, height = image.size
+        if self.max_pixels and width * height > self.max_pixels:
+            scale = math.sqrt(self.max_pixels / (width * height))
+            image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.BILINEAR)
+
+        if target_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        buffered = BytesIO()
+        if target_format == 'PNG':
+            image.save(buffered, format='PNG', compress_level=self.png_compress_level)
+        else:
+            image.save(buffered, format=target_format, quality=self.quality)
+        return target_format, buffered.getvalue()
+
+    @staticmethod
+    def load(image_content):
+        '''Bytes of an image path, other inputs are returned as they are'''
+        if isinstance(image_content, str):
+            with open(image_content, "rb") as image_file:
+                return image_file.read()
+        return image_content
+
+    def encode_bytes(self, image_content):
+        '''Return (format, bytes) for a path, encoded bytes or a PIL image, reusing recent encodings'''
+        image_content = self.load(image_content)
+        return self.cached((self.fingerprint(image_content), 'bytes'), lambda: self.convert(image_content))
+
+    def encode(self, image_content):
+        '''Return (mime_type, base64 string), reusing the payload if the same image was encoded recently'''
+        image_content = self.load(image_content)
+
+        def encode():
+            image_format, data = self.encode_bytes(image_content)
+            return MIME_TYPES[image_format], base64.b64encode(data).decode('ascii')
+        return self.cached((self.fingerprint(image_content), 'base64'), encode)
+
+    def image_url(self, image_content):
+        '''Message content entry for an image'''
+        mime_type, base64_image = self.encode(image_content)
+        return {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}", "detail": self.detail}}
@@ -0,0 +1,261 @@
+"""OpenAI-compatible stand-in server for offline load tests of the agent loop.
+
+Serves /v1/chat/completions with scripted completions and injects latency, token rates and
+429/5xx errors. Point an engine at it with engine_type "local" or base_url.
+
+    python openaci/agent/LocalServer.py --port 8000 --latency 0.5 --tokens-per-second 60 --error-rate-429 0.05
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSES = [
+    "(Previous action verification)\nThe previous action was successful.\n\n"
+    "(End-to-end Planning)\nClick the first element.\n\n"
+    "(Next Action)\nClick the first element.\n\n"
+    "(Grounded Action)\n```python\nagent.click(0)\n```",
+]
+
+
+def count_tokens(text):
+    # Same estimate as the rate limiter, the stand-in does not need a real tokenizer
+    return len(text) // 4 + 1
+
+
+def load_responses(path):
+    '''Read scripted completions from a JSONL file of {"content": ...} records or plain strings'''
+    responses = []
+    with open(path, encoding='utf-8') as responses_file:
+        for line in responses_file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            responses.append(record['content'] if isinstance(record, dict) else record)
+    return responses
+
+
+class ScriptedCompletionServer(ThreadingHTTPServer):
+    '''HTTP server returning scripted chat completions.
+
+    Args:
+        address: (host, port) to listen on, port 0 picks a free port
+        responses: completions returned in turn, cycling when exhausted
+        latency: seconds before the first token
+        jitter: uniform random extra latency in seconds
+        tokens_per_second: generation speed, None returns the whole completion at once
+        error_rate_429: fraction of requests answered with 429 Too Many Requests
+        error_rate_5xx: fraction of requests answered with 500 or 503
+        retry_after: Retry-After header sent with 429s
+        seed: seed for the injected randomness
+    '''
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 8000), responses=None, latency=0., jitter=0., tokens_per_second=None,
+                 error_rate_429=0., error_rate_5xx=0., retry_after=1, seed=None):
+        super().__init__(address, CompletionHandler)
+        self.responses = itertools.cycle(responses or DEFAULT_RESPONSES)
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'completions': 0, 'errors_429': 0, 'errors_5xx': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def next_outcome(self):
+        '''Decide the fate of a request: (status, content)'''
+        with self.lock:
+            self.stats['requests'] += 1
+            draw = self.random.random()
+            if draw < self.error_rate_429:
+                self.stats['errors_429'] += 1
+                return 429, None
+            if draw < self.error_rate_429 + self.error_rate_5xx:
+                self.stats['errors_5xx'] += 1
+                return self.random.choice([500, 503]), None
+            self.stats['completions'] += 1
+            return 200, next(self.responses)
+
+    def delay(self):
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0.
+        return self.latency + extra
+
+    def track(self, delta):
+        with self.lock:
+            self.stats['in_flight'] += delta
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+
+    def start_in_thread(self):
+        '''Serve from a daemon thread, returns the thread'''
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('/stats', '/v1/stats'):
+            with self.server.lock:
+                self.send_json(200, dict(self.server.stats))
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        self.server.track(1)
+        try:
+            status, content = self.server.next_outcome()
+            time.sleep(self.server.delay())
+            if status == 429:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                               headers={"Retry-After": str(self.server.retry_after)})
+            elif status != 200:
+                self.send_json(status, {"error": {"message": "Injected server error", "type": "server_error"}})
+            elif request.get("stream"):
+                self.stream_completion(request, content)
+            else:
+                if self.server.tokens_per_second:
+                    time.sleep(count_tokens(content) / self.server.tokens_per_second)
+                self.send_json(200, self.completion(request, content))
+        finally:
+            self.server.track(-1)
+
+    def usage(self, request, content):
+        prompt = json.dumps(request.get("messages", []))
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = count_tokens(content)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    def completion(self, request, content):
+        return {
+            "id": "chatcmpl-" + uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "scripted"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": self.usage(request, content),
+        }
+
+    def stream_completion(self, request, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+        created = int(time.time())
+        model = request.get("model", "scripted")
+
+        def send_event(payload):
+            self.wfile.write(b"data: " + json.dumps(payload).encode('utf-8') + b"\n\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        # Roughly one token per four characters
+        pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+        try:
+            send_event(chunk({"role": "assistant", "content": ""}))
+            for piece in pieces:
+                if self.server.tokens_per_second:
+                    time.sleep(1. / self.server.tokens_per_second)
+                send_event(chunk({"content": piece}))
+            send_event(chunk({}, finish_reason="stop"))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                send_event({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                            "model": model, "choices": [], "usage": self.usage(request, content)})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in server with scripted responses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--responses", help="JSONL file of scripted completions")
+    parser.add_argument("--latency", type=float, default=0., help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0., help="random extra latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=None)
+    parser.add_argument("--error-rate-429", type=float, default=0.)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = ScriptedCompletionServer(
+        (args.host, args.port),
+        responses=load_responses(args.responses) if args.responses else None,
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    print(f"Serving scripted completions on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
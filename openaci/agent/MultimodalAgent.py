@@ -2,8 +2,10 @@
 # Date: 2021-09-15
 # License: Apache 2.0
 
-from agent.MultimodalEngine import LMMEngineOpenAI, LMMEngineAzureOpenAI
-import base64
+from agent.MultimodalEngine import LMMEngineOpenAI, LMMEngineAzureOpenAI, LMMEngineLocal
+from agent.ResponseCache import LMMEngineCached, ResponseCache
+from agent.ImageEncoder import ImageEncoder
+from agent.EnginePool import LMMEnginePool
 import re 
 
 # TODO: Import only if module exists, else ignore
@@ -15,23 +17,52 @@ import re
 #     IMAGE_PLACEHOLDER,
 # )
 
+POOL_OPTIONS = ('hedge_percentile', 'hedge_after', 'min_samples', 'failure_threshold', 'cooldown', 'max_workers')
+
+
+def create_engine(engine_params):
+    '''Build the engine described by engine_params.
+
+    engine_type 'pool' takes a list of engine_params under 'deployments' and spreads calls over them,
+    see LMMEnginePool for the other options.
+    '''
+    engine_type = engine_params.get('engine_type')
+    if engine_type == 'openai':
+        engine = LMMEngineOpenAI(**engine_params)
+    elif engine_type == 'azure':
+        engine = LMMEngineAzureOpenAI(**engine_params)
+    elif engine_type == 'local':
+        engine = LMMEngineLocal(**engine_params)
+    elif engine_type == 'pool':
+        engine = LMMEnginePool([create_engine(params) for params in engine_params['deployments']],
+                               **{name: engine_params[name] for name in POOL_OPTIONS if name in engine_params})
+    else:
+        raise ValueError("engine_type must be one of 'openai', 'azure', 'local' or 'pool'")
+
+    # Optional on-disk response cache, e.g. for replaying task suites at temperature 0
+    if engine_params.get('cache_path'):
+        cache = ResponseCache(engine_params['cache_path'],
+                              max_size_bytes=engine_params.get('cache_max_size_bytes', 512 * 1024 * 1024))
+        engine = LMMEngineCached(engine, cache)
+    return engine
+
+
 class LMMAgent:
-    def __init__(self, engine_params=None, system_prompt=None, engine=None):
+    def __init__(self, engine_params=None, system_prompt=None, engine=None, image_encoder=None):
         if engine is None:
             if engine_params is not None:
-                engine_type = engine_params.get('engine_type')
-                if engine_type == 'openai':
-                    self.engine = LMMEngineOpenAI(**engine_params)
-                elif engine_type == 'azure':
-                    self.engine = LMMEngineAzureOpenAI(**engine_params)
-                else:
-                    raise ValueError("engine_type must be either 'openai' or 'azure'")
+                self.engine = create_engine(engine_params)
             else:
                 raise ValueError("engine_params must be provided")
         else:
             self.engine = engine
 
+        # Images are sent in their own format unless an encoder with compression/downscaling is given
+        self.image_encoder = image_encoder if image_encoder is not None else ImageEncoder()
+
         self.messages = []  # Empty messages
+        # Messages at the start of the history that are never flushed: the system prompt and the task context
+        self.num_pinned_messages = 1
 
         if system_prompt:
             self.add_system_prompt(system_prompt)
@@ -39,15 +70,12 @@ class LMMAgent:
             self.add_system_prompt("You are a helpful assistant.")
     
     def encode_image(self, image_content):
-        # if image_content is a path to an image file, check type of the image_content to verify
-        if isinstance(image_content, str):
-            with open(image_content, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
-        else:
-            return base64.b64encode(image_content).decode('utf-8')
+        # image_content can be a path to an image file, encoded image bytes or a PIL image
+        return self.image_encoder.encode(image_content)[1]
     
     def reset(self,):
         self.messages = [{"role": "system", "content": [{"type": "text", "text": self.system_prompt}]}]
+        self.num_pinned_messages = 1
 
     def add_system_prompt(self, system_prompt):
         self.system_prompt = system_prompt
@@ -56,7 +84,16 @@ class LMMAgent:
         else:
             self.messages.append({"role": "system", "content": [{"type": "text", "text": self.system_prompt}]})
 
-    
+
+    def add_task_context(self, task_context):
+        '''Pin per-task data right after the system prompt, so the system prompt stays identical across tasks'''
+        message = {"role": "system", "content": [{"type": "text", "text": task_context}]}
+        if self.num_pinned_messages > 1:
+            self.messages[1] = message
+        else:
+            self.messages.insert(1, message)
+            self.num_pinned_messages = 2
+
     def remove_message_at(self, index):
         '''Remove a message at a given index'''
         if index < len(self.messages):
@@ -65,7 +102,7 @@ class LMMAgent:
     def add_message(self, text_content, image_content=None, role=None):
         '''Add a new message to the list of messages'''
         # For API-style inference from OpenAI and AzureOpenAI 
-        if isinstance(self.engine, (LMMEngineOpenAI, LMMEngineAzureOpenAI)):
+        if isinstance(self.engine, (LMMEngineOpenAI, LMMEngineAzureOpenAI, LMMEngineCached, LMMEnginePool)):
             # infer role from previous message
             if self.messages[-1]["role"] == "system":
                 role = "user"
@@ -75,9 +112,8 @@ class LMMAgent:
                 role = "user"
 
             message = {"role": role, "content": [{"type": "text", "text": text_content}]}
-            if image_content:
-                base64_image = self.encode_image(image_content)
-                message["content"].append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": "high"}})
+            if image_content is not None:
+                message["content"].append(self.image_encoder.image_url(image_content))
 
             self.messages.append(message)
     
@@ -90,3 +126,22 @@ class LMMAgent:
             
         return self.engine.generate(messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs)
 
+    def get_response_stream(self, user_message=None, messages=None, temperature=0., max_new_tokens=None, **kwargs):
+        '''Generate the next response based on previous messages, yielding text as it arrives'''
+        if messages is None:
+            messages = self.messages
+        if user_message:
+            messages.append({"role": "user", "content": [{"type": "text", "text": user_message}]})
+
+        yield from self.engine.generate_stream(messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs)
+
+    async def aget_response(self, user_message=None, image=None, messages=None, temperature=0., max_new_tokens=None, **kwargs):
+        '''Generate the next response based on previous messages without blocking the event loop'''
+        if messages is None:
+            messages = self.messages
+        if user_message:
+            messages.append({"role": "user", "content": [{"type": "text", "text": user_message}]})
+
+        return await self.engine.agenerate(messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs)
+
+
@@ -2,7 +2,13 @@
 # Date: 2021-09-15
 # License: Apache 2.0
 
+import hashlib
 import os
+import time
+import asyncio
+from abc import ABC, abstractmethod
+import threading
+import weakref
 import backoff
 import openai
 from openai import (
@@ -10,12 +16,17 @@ from openai import (
     APIError,
     RateLimitError,
     AzureOpenAI,
+    AsyncAzureOpenAI,
+    AsyncOpenAI,
     OpenAI
 )
 import requests
 from PIL import Image
 from io import BytesIO
 
+from agent.RateLimiter import RateLimiter, estimate_tokens
+from agent.Telemetry import compute_cost, default_telemetry
+
 
 def image_parser(args):
     out = args.image_file.split(args.sep)
@@ -38,11 +49,224 @@ def load_images(image_files):
         out.append(image)
     return out
 
-class LMMEngine:
-    pass
+# Clients are shared between engines that talk to the same endpoint with the same key,
+# so every LMMAgent in a process reuses one HTTP connection pool per deployment.
+_client_lock = threading.Lock()
+_clients = {}
+# Async clients hold connections bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _client_key(client_class, client_kwargs):
+    return (client_class.__name__,) + tuple(sorted(client_kwargs.items()))
+
+
+def shared_client(client_class, **client_kwargs):
+    '''Return the process-wide client for (client_class, endpoint, key), creating it on first use'''
+    key = _client_key(client_class, client_kwargs)
+    with _client_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = client_class(**client_kwargs)
+    return client
+
+
+def shared_async_client(client_class, **client_kwargs):
+    '''Return the async client for (client_class, endpoint, key) on the running event loop'''
+    loop = asyncio.get_running_loop()
+    key = _client_key(client_class, client_kwargs)
+    with _client_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None:
+            client = loop_clients[key] = client_class(**client_kwargs)
+    return client
+
+
+def usage_from_completion(usage):
+    '''Token counts of a completion, including prompt tokens served from the provider's prompt cache'''
+    if usage is None:
+        return None
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': usage.prompt_tokens,
+        'completion_tokens': usage.completion_tokens,
+        'cached_tokens': (getattr(details, 'cached_tokens', None) or 0) if details is not None else 0,
+    }
+
+
+def stream_completion(client, on_usage=None, **create_kwargs):
+    '''Yield the text deltas of a streamed chat completion, closing the connection when the caller stops early'''
+    stream = client.chat.completions.create(stream=True, **create_kwargs)
+    try:
+        for chunk in stream:
+            if on_usage is not None and getattr(chunk, 'usage', None) is not None:
+                on_usage(usage_from_completion(chunk.usage))
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+
+
+def count_retry(details):
+    '''backoff handler, the retries are reported with the next call record'''
+    details['args'][0].retries += 1
+
+
+class LMMEngine(ABC):
+    # Token usage of the most recent call, see usage_from_completion
+    last_usage = None
+    # Shared by every engine using the same deployment, None when rate_limit is not set
+    rate_limiter = None
+    # Where call records go, tags (e.g. role and turn) are attached to every record
+    telemetry = default_telemetry
+    tags = None
+    # (input, cached input, output) USD per million tokens, looked up from the model name if None
+    pricing = None
+    # Total cost in USD of the calls made through this engine
+    cost = 0.
+    # Retries since the last recorded call
+    retries = 0
+
+    def set_usage(self, usage):
+        self.last_usage = usage
+
+    def setup_rate_limiter(self, deployment, rate_limit=-1, tokens_per_minute=None):
+        if rate_limit != -1 or tokens_per_minute:
+            self.rate_limiter = RateLimiter.shared(
+                deployment,
+                requests_per_minute=None if rate_limit == -1 else rate_limit,
+                tokens_per_minute=tokens_per_minute)
+
+    def reserve_request(self, messages, max_new_tokens=None):
+        '''Seconds to wait for this request's rate limit slot, and the tokens reserved for it'''
+        if self.rate_limiter is None:
+            return 0., 0
+        tokens = estimate_tokens(messages, max_new_tokens or 4096)
+        return self.rate_limiter.reserve(tokens), tokens
+
+    def wait_for_rate_limit(self, messages, max_new_tokens=None):
+        delay, tokens = self.reserve_request(messages, max_new_tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return tokens
+
+    async def await_rate_limit(self, messages, max_new_tokens=None):
+        delay, tokens = self.reserve_request(messages, max_new_tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return tokens
+
+    def settle_rate_limit(self, reserved_tokens):
+        '''Return the reserved tokens the last call did not use'''
+        if self.rate_limiter is not None and self.last_usage:
+            self.rate_limiter.settle(
+                reserved_tokens, self.last_usage['prompt_tokens'] + self.last_usage['completion_tokens'])
+
+    def record_call(self, start, ttft=None, error=None, stream=False):
+        '''Add the cost of the last call and send its record to telemetry'''
+        usage = self.last_usage or {}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+        cached_tokens = usage.get('cached_tokens', 0)
+        cost = compute_cost(self.model, prompt_tokens, completion_tokens, cached_tokens, self.pricing)
+        self.cost += cost
+        tags = self.tags or {}
+        self.telemetry.record(
+            model=self.model,
+            role=tags.get('role'),
+            turn=tags.get('turn'),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            latency=time.perf_counter() - start,
+            ttft=ttft,
+            retries=self.retries,
+            cost=cost,
+            error=error,
+            stream=stream,
+        )
+        self.retries = 0
+
+    def completion_kwargs(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        return dict(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_new_tokens if max_new_tokens else 4096,
+            temperature=temperature,
+            **kwargs,
+        )
+
+    def complete(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Chat completion through llm_client with rate limiting and telemetry'''
+        reserved_tokens = self.wait_for_rate_limit(messages, max_new_tokens)
+        start = time.perf_counter()
+        try:
+            completion = self.llm_client.chat.completions.create(
+                **self.completion_kwargs(messages, temperature, max_new_tokens, **kwargs))
+        except Exception as e:
+            self.set_usage(None)
+            self.record_call(start, error=type(e).__name__)
+            raise
+        self.set_usage(usage_from_completion(completion.usage))
+        self.settle_rate_limit(reserved_tokens)
+        self.record_call(start)
+        return completion.choices[0].message.content
+
+    async def acomplete(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Chat completion through async_llm_client with rate limiting and telemetry'''
+        reserved_tokens = await self.await_rate_limit(messages, max_new_tokens)
+        start = time.perf_counter()
+        try:
+            completion = await self.async_llm_client.chat.completions.create(
+                **self.completion_kwargs(messages, temperature, max_new_tokens, **kwargs))
+        except Exception as e:
+            self.set_usage(None)
+            self.record_call(start, error=type(e).__name__)
+            raise
+        self.set_usage(usage_from_completion(completion.usage))
+        self.settle_rate_limit(reserved_tokens)
+        self.record_call(start)
+        return completion.choices[0].message.content
+
+    def complete_stream(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Streamed chat completion through llm_client with rate limiting and telemetry'''
+        reserved_tokens = self.wait_for_rate_limit(messages, max_new_tokens)
+        self.set_usage(None)
+        start = time.perf_counter()
+        ttft = None
+        error = None
+        try:
+            for chunk in stream_completion(
+                    self.llm_client, on_usage=self.set_usage,
+                    **self.completion_kwargs(messages, temperature, max_new_tokens, **kwargs)):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                yield chunk
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # Also runs when the caller cancels the stream
+            self.record_call(start, ttft=ttft, error=error, stream=True)
+        self.settle_rate_limit(reserved_tokens)
+
+    @abstractmethod
+    def generate(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Generate the next message based on previous messages'''
+
+    def generate_stream(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Yield the next message in pieces as it is generated'''
+        yield self.generate(messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs)
+
+    async def agenerate(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Generate the next message without blocking the event loop'''
+        return await asyncio.to_thread(
+            self.generate, messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs)
+
 
 class LMMEngineOpenAI(LMMEngine):
-    def __init__(self, api_key=None, model=None, rate_limit=-1, **kwargs):
+    def __init__(self, api_key=None, model=None, rate_limit=-1, tokens_per_minute=None, telemetry=None, pricing=None, base_url=None, **kwargs):
         assert model is not None, "model must be provided"
         self.model = model
 
@@ -51,25 +275,44 @@ class LMMEngineOpenAI(LMMEngine):
             raise ValueError("An API Key needs to be provided in either the api_key parameter or as an environment variable named OPENAI_API_KEY")
         
         self.api_key = api_key
-        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
 
-        self.llm_client = OpenAI(api_key=self.api_key)
+        # base_url points the engine at any OpenAI-compatible server, e.g. agent/LocalServer.py
+        self.base_url = base_url
+        self.client_kwargs = {'api_key': self.api_key}
+        if base_url:
+            self.client_kwargs['base_url'] = base_url
+        self.llm_client = shared_client(OpenAI, **self.client_kwargs)
+        # Limits are per key, only a digest of it is kept in the limiter state
+        key_digest = hashlib.sha256(self.api_key.encode('utf-8')).hexdigest()[:16]
+        self.setup_rate_limiter(f"openai|{base_url}|{self.model}|{key_digest}", rate_limit, tokens_per_minute)
+
+        if telemetry is not None:
+            self.telemetry = telemetry
+        self.pricing = pricing
+        self.tags = {}
+
+    @property
+    def async_llm_client(self):
+        return shared_async_client(AsyncOpenAI, **self.client_kwargs)
 
-    @backoff.on_exception(backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60)
+    @backoff.on_exception(backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60, on_backoff=count_retry)
     def generate(self, messages, temperature=0., max_new_tokens=None, **kwargs):
         '''Generate the next message based on previous messages'''
-        return self.llm_client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            max_tokens=max_new_tokens if max_new_tokens else 4096,
-            temperature=temperature,
-            **kwargs,
-        ).choices[0].message.content
+        return self.complete(messages, temperature, max_new_tokens, **kwargs)
+
+    def generate_stream(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Generate the next message based on previous messages, yielding text as it arrives'''
+        yield from self.complete_stream(
+            messages, temperature, max_new_tokens, stream_options={"include_usage": True}, **kwargs)
 
+    @backoff.on_exception(backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60, on_backoff=count_retry)
+    async def agenerate(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Generate the next message based on previous messages without blocking the event loop'''
+        return await self.acomplete(messages, temperature, max_new_tokens, **kwargs)
 
 
 class LMMEngineAzureOpenAI(LMMEngine):
-    def __init__(self, api_key=None, azure_endpoint=None, model=None, api_version=None, rate_limit=-1, **kwargs):
+    def __init__(self, api_key=None, azure_endpoint=None, model=None, api_version=None, rate_limit=-1, tokens_per_minute=None, telemetry=None, pricing=None, **kwargs):
         assert model is not None, "model must be provided"
         self.model = model
 
@@ -87,22 +330,42 @@ class LMMEngineAzureOpenAI(LMMEngine):
             raise ValueError("An Azure API endpoint needs to be provided in either the azure_endpoint parameter or as an environment variable named AZURE_OPENAI_API_BASE")
         
         self.azure_endpoint = azure_endpoint
-        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
 
-        self.llm_client = AzureOpenAI(azure_endpoint=self.azure_endpoint, api_key=self.api_key, api_version=self.api_version)
+        self.client_kwargs = {'azure_endpoint': self.azure_endpoint, 'api_key': self.api_key, 'api_version': self.api_version}
+        self.llm_client = shared_client(AzureOpenAI, **self.client_kwargs)
+        self.setup_rate_limiter(f"azure|{self.azure_endpoint}|{self.model}", rate_limit, tokens_per_minute)
+
+        if telemetry is not None:
+            self.telemetry = telemetry
+        # Azure deployments can have any name, pass pricing if the model cannot be looked up
+        self.pricing = pricing
+        self.tags = {}
         self.cost = 0.
 
+    @property
+    def async_llm_client(self):
+        return shared_async_client(AsyncAzureOpenAI, **self.client_kwargs)
+
     # @backoff.on_exception(backoff.expo, (APIConnectionError, APIError, RateLimitError), max_tries=10)
     def generate(self, messages, temperature=0., max_new_tokens=None, **kwargs):
         '''Generate the next message based on previous messages'''
-        completion = self.llm_client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            max_tokens=max_new_tokens if max_new_tokens else 4096,
-            temperature=temperature,
-            **kwargs,
-        )
-        total_tokens = completion.usage.total_tokens
-        self.cost +=  0.02 * ((total_tokens+500) / 1000)
-        return completion.choices[0].message.content
-    
+        return self.complete(messages, temperature, max_new_tokens, **kwargs)
+
+    def generate_stream(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Generate the next message based on previous messages, yielding text as it arrives'''
+        # The usage chunk needs api_version 2024-09-01-preview or later, older versions reject stream_options
+        # and their streamed calls are recorded without token usage
+        if self.api_version[:10] >= "2024-09-01":
+            kwargs.setdefault('stream_options', {"include_usage": True})
+        yield from self.complete_stream(messages, temperature, max_new_tokens, **kwargs)
+
+    async def agenerate(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        '''Generate the next message based on previous messages without blocking the event loop'''
+        return await self.acomplete(messages, temperature, max_new_tokens, **kwargs)
+
+
+class LMMEngineLocal(LMMEngineOpenAI):
+    '''OpenAI engine pointed at the local stand-in server in agent/LocalServer.py'''
+    def __init__(self, api_key=None, model="scripted", base_url=None, **kwargs):
+        base_url = base_url or os.getenv("OPENACI_LOCAL_SERVER", "http://127.0.0.1:8000/v1")
+        super().__init__(api_key=api_key or "local", model=model, base_url=base_url, **kwargs)
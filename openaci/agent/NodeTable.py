@@ -0,0 +1,104 @@
+import numpy as np
+
+
+class NodeTable:
+    '''Columnar snapshot of the elements of one observation.
+
+    Boxes are float32 arrays, roles are codes into a small role table and titles and texts are
+    indices into one shared string table, so thousands of elements cost a few arrays instead of a
+    dict or a remote proxy each. The table is filled once per observation and read by
+    linearization, OCR merging and the action methods. Indexing returns the familiar node dict
+    ({'position', 'size', 'role', 'title', 'text'}), or None for ids without an element.
+    '''
+    def __init__(self, x, y, w, h, role, title, text, roles, strings, valid=None):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.role = role
+        self.title = title
+        self.text = text
+        self.roles = roles
+        self.strings = strings
+        self.valid = valid if valid is not None else np.ones(len(x), dtype=bool)
+
+    @classmethod
+    def from_rows(cls, rows, roles=None, strings=None):
+        '''Build a table from (x, y, w, h, role, title, text) rows, extending the given role and string tables'''
+        roles = list(roles or [])
+        strings = list(strings or [])
+        role_codes = {role: code for code, role in enumerate(roles)}
+        string_codes = {string: code for code, string in enumerate(strings)}
+
+        def intern(value, table, codes):
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(table)
+                table.append(value)
+            return code
+
+        boxes = []
+        codes = []
+        for x, y, w, h, role, title, text in rows:
+            boxes.append((x, y, w, h))
+            codes.append((intern(role, roles, role_codes),
+                          intern(title, strings, string_codes),
+                          intern(text, strings, string_codes)))
+        boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        codes = np.array(codes, dtype=np.int32).reshape(-1, 3)
+        return cls(boxes[:, 0].copy(), boxes[:, 1].copy(), boxes[:, 2].copy(), boxes[:, 3].copy(),
+                   codes[:, 0].astype(np.uint16), codes[:, 1].copy(), codes[:, 2].copy(), roles, strings)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if not self.valid[index]:
+            return None
+        return {'position': (float(self.x[index]), float(self.y[index])),
+                'size': (float(self.w[index]), float(self.h[index])),
+                'role': self.roles[self.role[index]],
+                'title': self.strings[self.title[index]],
+                'text': self.strings[self.text[index]]}
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def rows(self):
+        '''(role, title, text) of every valid element, in order'''
+        for index in np.flatnonzero(self.valid):
+            yield self.roles[self.role[index]], self.strings[self.title[index]], self.strings[self.text[index]]
+
+    def boxes(self):
+        '''(n, 4) array of x1, y1, x2, y2'''
+        return np.stack([self.x, self.y, self.x + self.w, self.y + self.h], axis=1)
+
+    def center(self, index):
+        return float(self.x[index] + self.w[index] // 2), float(self.y[index] + self.h[index] // 2)
+
+    def extend(self, rows):
+        '''New table with the rows appended, e.g. elements found by OCR'''
+        added = NodeTable.from_rows(rows, self.roles, self.strings)
+        return NodeTable(*(np.concatenate([getattr(self, name), getattr(added, name)])
+                           for name in ('x', 'y', 'w', 'h', 'role', 'title', 'text')),
+                         added.roles, added.strings, np.concatenate([self.valid, added.valid]))
+
+    def remap(self, ids):
+        '''Table indexed by new ids, ids[i] is the new id of element i, ids without an element are invalid'''
+        ids = np.asarray(ids, dtype=np.int64)
+        size = int(ids.max()) + 1 if len(ids) else 0
+        columns = []
+        for name in ('x', 'y', 'w', 'h', 'role', 'title', 'text'):
+            column = getattr(self, name)
+            remapped = np.zeros(size, dtype=column.dtype)
+            remapped[ids] = column[:len(ids)]
+            columns.append(remapped)
+        valid = np.zeros(size, dtype=bool)
+        valid[ids] = self.valid[:len(ids)]
+        return NodeTable(*columns, self.roles, self.strings, valid)
+
+    @property
+    def nbytes(self):
+        return (sum(getattr(self, name).nbytes for name in ('x', 'y', 'w', 'h', 'role', 'title', 'text', 'valid'))
+                + sum(len(string) for string in self.strings))
@@ -0,0 +1,119 @@
+"""Client for the OCR service behind OCR_SERVER_ADDRESS.
+
+One keep-alive session is shared by every request and each request has a deadline. OCR can run
+on a worker thread while the accessibility tree is read.
+"""
+import base64
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OcrTimeout(Exception):
+    '''The OCR service did not answer before the deadline'''
+
+
+class OcrClient:
+    '''Pooled OCR client returning [(index, text, {'left', 'top', 'right', 'bottom'})] per screenshot.
+
+    Args:
+        url: OCR endpoint, defaults to the OCR_SERVER_ADDRESS environment variable
+        timeout: seconds allowed per screenshot, connecting, uploading and reading included
+        connect_timeout: seconds allowed to open a connection
+        retries: extra attempts on connection errors and 502/503/504, while the deadline allows
+        pool_size: keep-alive connections kept open to the service
+        binary: upload the image as the raw request body instead of base64 in JSON
+        image_format: re-encode the screenshot as "JPEG" or "WEBP" before upload, None sends it as is
+        quality: JPEG/WebP quality of the re-encoded upload
+        max_workers: threads for submit
+    '''
+    def __init__(self, url=None, timeout=10., connect_timeout=2., retries=1, pool_size=4, binary=False,
+                 image_format=None, quality=90, max_workers=2):
+        self.url = url
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.binary = binary
+        self.encoder = None
+        if image_format is not None:
+            from agent.ImageEncoder import ImageEncoder
+            self.encoder = ImageEncoder(format=image_format, quality=quality, cache_size=1)
+        self.max_workers = max_workers
+        self.session = None
+        self.executor = None
+
+    def get_session(self):
+        if self.session is None:
+            # Imported here, requests is only needed once OCR runs
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.session = session
+        return self.session
+
+    def get_url(self):
+        url = self.url or os.environ.get("OCR_SERVER_ADDRESS", "")
+        if url == "":
+            raise Exception("OCR SERVER ADDRESS NOT SET")
+        return url
+
+    def payload(self, screenshot):
+        '''Request keyword arguments for the screenshot bytes'''
+        if self.encoder is not None:
+            image_format, screenshot = self.encoder.encode_bytes(screenshot)
+        else:
+            image_format = None
+        if self.binary:
+            content_type = "image/" + (image_format or "png").lower()
+            return {'data': bytes(screenshot), 'headers': {"Content-Type": content_type}}
+        return {'json': {"img_bytes": base64.b64encode(screenshot).decode("utf-8")}}
+
+    def recognize(self, screenshot, timeout=None):
+        '''OCR results of the screenshot bytes, raises OcrTimeout past the deadline'''
+        import requests
+
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        url = self.get_url()
+        payload = self.payload(screenshot)
+        session = self.get_session()
+        for attempt in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise OcrTimeout(f"OCR did not finish within {timeout or self.timeout:.1f}s")
+            try:
+                response = session.post(url, timeout=(min(self.connect_timeout, remaining), remaining), **payload)
+            except requests.Timeout as e:
+                raise OcrTimeout(str(e)) from e
+            except requests.ConnectionError:
+                if attempt == self.retries:
+                    raise
+                continue
+
+            if response.status_code == 200:
+                return response.json()["results"]
+            if response.status_code in (502, 503, 504) and attempt < self.retries:
+                continue
+            raise Exception(f"OCR request failed with status code {response.status_code}")
+
+    def submit(self, screenshot, timeout=None):
+        '''Start OCR on a worker thread, returns a Future of the results'''
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ocr")
+        return self.executor.submit(self.recognize, screenshot, timeout)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+# Shared by every GroundingAgent, the agent creates a new one each turn
+default_client = OcrClient()
@@ -0,0 +1,220 @@
+"""Stand-in OCR server for offline benchmarks of the OCR client.
+
+Accepts the base64 JSON payload of the real service or a raw image body and answers with
+synthetic text boxes after an injected latency.
+
+    python openaci/agent/OcrServer.py --port 8001 --latency 0.05
+    cd openaci && python -m agent.OcrServer --benchmark --requests 200 --latency 0.005
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import threading
+import time
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInOcrServer(ThreadingHTTPServer):
+    '''HTTP server returning synthetic OCR results.
+
+    Args:
+        address: (host, port) to listen on, port 0 picks a free port
+        latency: seconds spent per request
+        seconds_per_megapixel: extra seconds per million pixels of the image, OCR cost grows with the area
+        jitter: uniform random extra latency in seconds
+        boxes: number of text boxes per screenshot
+        error_rate_5xx: fraction of requests answered with 503
+        seed: seed for the injected randomness
+    '''
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 8001), latency=0., seconds_per_megapixel=0., jitter=0., boxes=20,
+                 error_rate_5xx=0., seed=None):
+        super().__init__(address, OcrHandler)
+        self.latency = latency
+        self.seconds_per_megapixel = seconds_per_megapixel
+        self.jitter = jitter
+        self.boxes = boxes
+        self.error_rate_5xx = error_rate_5xx
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections': 0, 'bytes_received': 0, 'errors_5xx': 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/ocr"
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def delay(self, pixels):
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0.
+            failed = self.random.random() < self.error_rate_5xx
+        return self.latency + self.seconds_per_megapixel * pixels / 1e6 + extra, failed
+
+    def results(self, image, width, height):
+        '''Random boxes inside the image, the same for the same image bytes'''
+        rng = random.Random(len(image))
+        results = []
+        for i in range(self.boxes):
+            left, top = rng.randrange(0, max(width - 20, 1)), rng.randrange(0, max(height - 10, 1))
+            box = {'left': left, 'top': top, 'right': min(left + rng.randrange(20, 200), width),
+                   'bottom': min(top + rng.randrange(10, 30), height)}
+            results.append([i, f"text {i}", box])
+        return results
+
+    def start_in_thread(self):
+        '''Serve from a daemon thread, returns the thread'''
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def image_size(image):
+    '''(width, height) from the image header, a full HD screen for unreadable payloads'''
+    try:
+        from PIL import Image
+        return Image.open(BytesIO(image)).size
+    except Exception:
+        return 1920, 1080
+
+
+class OcrHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, Nagle would hold the body for the delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        self.server.count('requests')
+        self.server.count('bytes_received', length)
+        if self.headers.get("Content-Type", "").startswith("image/"):
+            image = body
+        else:
+            image = base64.b64decode(json.loads(body or b"{}").get("img_bytes", ""))
+
+        width, height = image_size(image)
+        latency, failed = self.server.delay(width * height)
+        time.sleep(latency)
+        try:
+            if failed:
+                self.server.count('errors_5xx')
+                self.send_json(503, {"error": "Injected server error"})
+            else:
+                self.send_json(200, {"results": self.server.results(image, width, height)})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the deadline
+            pass
+
+
+def benchmark(args):
+    import requests
+    from concurrent.futures import wait
+    from agent.OcrClient import OcrClient, OcrTimeout
+
+    server = StandInOcrServer(("127.0.0.1", 0), latency=args.latency, seconds_per_megapixel=args.seconds_per_megapixel,
+                              boxes=args.boxes)
+    server.start_in_thread()
+    screenshot = os.urandom(args.image_kb * 1024)
+
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        requests.post(server.url, json={"img_bytes": base64.b64encode(screenshot).decode("utf-8")})
+    fresh = time.perf_counter() - start
+    print(f"fresh connection per request: {args.requests / fresh:.0f} req/s, {server.stats['connections']} connections")
+
+    for name, binary in (("pooled, base64 JSON", False), ("pooled, binary upload", True)):
+        client = OcrClient(server.url, binary=binary)
+        connections, received = server.stats['connections'], server.stats['bytes_received']
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            client.recognize(screenshot)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {args.requests / elapsed:.0f} req/s, {server.stats['connections'] - connections} connections, "
+              f"{(server.stats['bytes_received'] - received) / args.requests / 1024:.0f} KiB per request")
+        client.close()
+
+    client = OcrClient(server.url, binary=True, pool_size=args.workers, max_workers=args.workers)
+    start = time.perf_counter()
+    wait([client.submit(screenshot) for _ in range(args.requests)])
+    elapsed = time.perf_counter() - start
+    print(f"pooled, {args.workers} concurrent: {args.requests / elapsed:.0f} req/s")
+    client.close()
+
+    server.latency = args.timeout * 3
+    client = OcrClient(server.url, timeout=args.timeout, binary=True)
+    start = time.perf_counter()
+    try:
+        client.recognize(screenshot)
+        print("deadline: the request unexpectedly finished")
+    except OcrTimeout:
+        print(f"deadline: gave up after {time.perf_counter() - start:.2f}s with a {args.timeout:.2f}s timeout "
+              f"against a {server.latency:.2f}s server")
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in OCR server with synthetic results")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0., help="seconds per request")
+    parser.add_argument("--seconds-per-megapixel", type=float, default=0., help="extra latency per million pixels")
+    parser.add_argument("--jitter", type=float, default=0., help="random extra latency in seconds")
+    parser.add_argument("--boxes", type=int, default=20, help="text boxes per screenshot")
+    parser.add_argument("--error-rate-5xx", type=float, default=0.)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--benchmark", action="store_true", help="benchmark the OCR client against a local server")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--image-kb", type=int, default=512, help="size of the uploaded screenshot")
+    parser.add_argument("--timeout", type=float, default=0.2, help="deadline for the timeout check")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args)
+        return
+
+    server = StandInOcrServer(
+        (args.host, args.port),
+        latency=args.latency,
+        seconds_per_megapixel=args.seconds_per_megapixel,
+        jitter=args.jitter,
+        boxes=args.boxes,
+        error_rate_5xx=args.error_rate_5xx,
+        seed=args.seed,
+    )
+    print(f"Serving synthetic OCR on {server.url}, set OCR_SERVER_ADDRESS to it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
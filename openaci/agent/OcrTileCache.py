@@ -0,0 +1,213 @@
+"""OCR per screen tile, cached by the tile contents.
+
+The screenshot is cut into a fixed grid of tiles that overlap by a margin. Each tile is
+fingerprinted and OCR only runs on tiles whose fingerprint was not seen before. Results are
+kept in tile coordinates and shifted back into screenshot coordinates. When a dialog opens over
+a static screen, only the tiles under the dialog go to the OCR service.
+
+    cd openaci && python -m agent.OcrTileCache --turns 20 --seconds-per-megapixel 0.3
+"""
+import argparse
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Relative, so the exception is the one of the OcrClient the caller imported, agent or openaci.agent
+from .OcrClient import OcrTimeout
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def fingerprint(pixels):
+    '''64-bit hash of a pixel array, xxh3 if installed, else CRC32 and Adler-32 which zlib computes at memory speed'''
+    data = np.ascontiguousarray(pixels)
+    if xxhash is not None:
+        return xxhash.xxh3_64_digest(data)
+    return zlib.crc32(data).to_bytes(4, 'little') + zlib.adler32(data).to_bytes(4, 'little')
+
+
+def tile_grid(width, height, tile_width, tile_height):
+    '''(left, top, right, bottom) of the core of every tile, row by row'''
+    return [(left, top, min(left + tile_width, width), min(top + tile_height, height))
+            for top in range(0, height, tile_height)
+            for left in range(0, width, tile_width)]
+
+
+class TileOcrCache:
+    '''Drop-in for OcrClient that only sends changed tiles to the OCR service.
+
+    A text box belongs to the tile its center falls in, the margin lets a tile see the text
+    that crosses its border. Tiles are wide and short because text lines run horizontally.
+
+    Args:
+        client: OcrClient that recognizes the tiles
+        tile_width, tile_height: size of the tile cores in screenshot pixels
+        margin: pixels of the neighbouring tiles sent along with every tile
+        cache_size: number of tile results to keep
+        max_workers: threads for submit
+    '''
+    def __init__(self, client, tile_width=1024, tile_height=256, margin=32, cache_size=512, max_workers=1):
+        self.client = client
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.margin = margin
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.max_workers = max_workers
+        self.executor = None
+        self.stats = {'tiles': 0, 'hits': 0, 'misses': 0}
+
+    def lookup(self, key):
+        results = self.cache.get(key)
+        if results is not None:
+            self.cache.move_to_end(key)
+        return results
+
+    def store(self, key, results):
+        self.cache[key] = results
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    @staticmethod
+    def encode(pixels):
+        buffered = BytesIO()
+        Image.fromarray(pixels).save(buffered, format='PNG', compress_level=1)
+        return buffered.getvalue()
+
+    def recognize(self, screenshot, timeout=None):
+        '''OCR results of the screenshot bytes or PIL image, in the format of OcrClient.recognize'''
+        # Fails like OcrClient when no service is configured, before any tile is decoded and encoded
+        self.client.get_url()
+        image = screenshot if isinstance(screenshot, Image.Image) else Image.open(BytesIO(screenshot))
+        pixels = np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+        height, width = pixels.shape[:2]
+
+        tiles = []
+        pending = {}
+        for core in tile_grid(width, height, self.tile_width, self.tile_height):
+            left, top, right, bottom = core
+            # Coordinates of the tile with its margin
+            outer = (max(left - self.margin, 0), max(top - self.margin, 0),
+                     min(right + self.margin, width), min(bottom + self.margin, height))
+            tile = pixels[outer[1]:outer[3], outer[0]:outer[2]]
+            # The tile size is part of the key, edge tiles can share contents with inner ones
+            key = fingerprint(tile) + bytes(f"{tile.shape}", "ascii")
+            tiles.append((core, outer, key))
+            self.stats['tiles'] += 1
+            if self.lookup(key) is not None:
+                self.stats['hits'] += 1
+            elif key not in pending:
+                self.stats['misses'] += 1
+                pending[key] = self.client.submit(self.encode(tile), timeout)
+
+        if pending:
+            timeout = timeout if timeout is not None else getattr(self.client, 'timeout', None)
+            _, not_done = wait(pending.values(), timeout=timeout)
+            # Tiles still queued behind the client's workers would run on after the deadline
+            for future in not_done:
+                future.cancel()
+            # Tiles that finished are kept even when others failed, the next call only sends the rest
+            error = None
+            for key, future in pending.items():
+                if future in not_done:
+                    continue
+                if future.exception() is not None:
+                    error = error or future.exception()
+                else:
+                    self.store(key, future.result())
+            if not_done:
+                raise OcrTimeout(f"OCR of {len(not_done)} of {len(pending)} tiles did not finish within {timeout:.1f}s")
+            if error is not None:
+                # The first failure, including OcrTimeout
+                raise error
+
+        results = []
+        for (left, top, right, bottom), (outer_left, outer_top, _, _), key in tiles:
+            for _, content, box in self.cache[key]:
+                box = {'left': box.get('left', 0) + outer_left, 'top': box.get('top', 0) + outer_top,
+                       'right': box.get('right', 0) + outer_left, 'bottom': box.get('bottom', 0) + outer_top}
+                center_x = (box['left'] + box['right']) / 2
+                center_y = (box['top'] + box['bottom']) / 2
+                if left <= center_x < right and top <= center_y < bottom:
+                    results.append([len(results), content, box])
+        return results
+
+    def submit(self, screenshot, timeout=None):
+        '''Start OCR on a worker thread, returns a Future of the results'''
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ocr-tiles")
+        return self.executor.submit(self.recognize, screenshot, timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.client.close()
+
+
+def synthetic_screen(width, height, seed=0):
+    '''Screenshot-like image: flat panels with noisy text-like strips'''
+    rng = np.random.default_rng(seed)
+    pixels = np.full((height, width, 3), 236, dtype=np.uint8)
+    for _ in range(200):
+        x, y = rng.integers(0, width - 200), rng.integers(0, height - 20)
+        pixels[y:y + 14, x:x + rng.integers(40, 200)] = rng.integers(0, 120, (14, 1, 3), dtype=np.uint8)
+    return pixels
+
+
+def main():
+    from agent.OcrClient import OcrClient
+    from agent.OcrServer import StandInOcrServer
+
+    parser = argparse.ArgumentParser(description="Benchmark tiled OCR caching on a mostly static screen")
+    parser.add_argument("--width", type=int, default=2880)
+    parser.add_argument("--height", type=int, default=1800)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--dialog", type=int, nargs=2, default=[600, 300], help="size of the region that changes per turn")
+    parser.add_argument("--seconds-per-megapixel", type=float, default=0.3, help="simulated OCR cost")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    server = StandInOcrServer(("127.0.0.1", 0), seconds_per_megapixel=args.seconds_per_megapixel)
+    server.start_in_thread()
+    base = synthetic_screen(args.width, args.height)
+    rng = np.random.default_rng(1)
+    screens = []
+    for turn in range(args.turns):
+        pixels = base.copy()
+        # A dialog with new contents in the middle of the screen
+        dialog_width, dialog_height = args.dialog
+        x, y = (args.width - dialog_width) // 2, (args.height - dialog_height) // 2
+        pixels[y:y + dialog_height, x:x + dialog_width] = rng.integers(0, 255, 3, dtype=np.uint8)
+        screens.append(TileOcrCache.encode(pixels))
+
+    full = OcrClient(server.url, binary=True)
+    tiled = TileOcrCache(OcrClient(server.url, binary=True, pool_size=args.workers, max_workers=args.workers))
+    for name, client in (("full screen", full), ("tiled", tiled)):
+        requests, received = server.stats['requests'], server.stats['bytes_received']
+        start = time.perf_counter()
+        for screen in screens:
+            client.recognize(screen)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed / args.turns * 1000:.0f} ms per turn, {server.stats['requests'] - requests} OCR requests, "
+              f"{(server.stats['bytes_received'] - received) / args.turns / 1024:.0f} KiB per turn")
+    print(f"tiles: {tiled.stats}")
+    full.close()
+    tiled.close()
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
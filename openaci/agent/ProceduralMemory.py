@@ -1,3 +1,4 @@
+import functools
 import platform 
 import textwrap
 import inspect
@@ -97,10 +98,23 @@ class PROCEDURAL_MEMORY:
     5. If you think the task is already completed, you can return `agent.done()`.
     """
 
+    # Per-task data for the prefix-stable layout, sent right after the task-independent system prompt
+    TASK_CONTEXT = """Your task is to complete the following: TASK_DESCRIPTION.
+    The available applications in the system are: AVAILABLE_APPS"""
+
     @staticmethod
-    def construct_procedural_memory(agent_class):
+    @functools.lru_cache(maxsize=None)
+    def construct_procedural_memory(agent_class, task_in_prompt=True):
+        '''Build the planning system prompt from the agent actions, once per agent class and layout.
+        With task_in_prompt=False the prompt is identical for every task so providers can cache it,
+        and the task is sent separately using TASK_CONTEXT.
+        '''
+        if task_in_prompt:
+            task_line = "Your task is to complete the following: TASK_DESCRIPTION."
+        else:
+            task_line = "Your task and the available applications are given in the next message."
         procedural_memory = textwrap.dedent(f"""\
-        You are an expert in graphical user interfaces and Python code. Your task is to complete the following: TASK_DESCRIPTION. You are working in {current_os}.
+        You are an expert in graphical user interfaces and Python code. {task_line} You are working in {current_os}.
         You are provided with:
         1. A simplified accessibility tree of the UI at the current time step.
         2. The history of your previous interactions with the UI.
@@ -141,6 +155,8 @@ class PROCEDURAL_MEMORY:
         4. Please only use the available methods provided above to interact with the UI. 
         5. If you think the task is already completed, you can return `agent.done()`.
         """)
+        if not task_in_prompt:
+            procedural_memory = procedural_memory.replace("AVAILABLE_APPS", "the list given in the task message")
         return procedural_memory.strip() 
         
 
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows, limits are only shared between threads
+    fcntl = None
+
+# Rough cost of one image in the prompt, used when estimating tokens ahead of a call
+IMAGE_TOKENS = 765
+
+_STATE = struct.Struct('<dd')
+
+
+def estimate_tokens(messages, max_new_tokens=None):
+    '''Upper estimate of the tokens a request will be charged, the way Azure counts them for rate limiting'''
+    chars = 0
+    images = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                images += 1
+    return chars // 4 + images * IMAGE_TOKENS + (max_new_tokens or 0)
+
+
+class RateLimiter:
+    '''Requests-per-minute and tokens-per-minute limiter for one deployment.
+
+    Uses the generic cell rate algorithm: every reservation gets a start time ahead of the call, so
+    callers sleep until their slot instead of hitting 429s. The state is kept in a small file under
+    the temp directory and guarded by flock, which shares the limit between all processes on the host.
+
+    Args:
+        key: identifies the deployment, e.g. endpoint and model
+        requests_per_minute: request limit, None for no limit
+        tokens_per_minute: token limit, None for no limit
+        burst_seconds: how many seconds worth of the limit may be spent at once
+    '''
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, key, requests_per_minute=None, tokens_per_minute=None, burst_seconds=10., state_dir=None):
+        self.key = key
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst_seconds = burst_seconds
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(state_dir or tempfile.gettempdir(), f"openaci-ratelimit-{digest}.bin")
+        self.lock = threading.Lock()
+        self.state = (0., 0.)
+
+    @classmethod
+    def shared(cls, key, requests_per_minute=None, tokens_per_minute=None, **kwargs):
+        '''Return the limiter of this process for the deployment, creating it on first use'''
+        with cls._registry_lock:
+            limiter = cls._registry.get(key)
+            if limiter is None:
+                limiter = cls._registry[key] = cls(key, requests_per_minute, tokens_per_minute, **kwargs)
+        return limiter
+
+    def _update(self, update):
+        '''Apply update(request_tat, token_tat) -> (result, request_tat, token_tat) atomically across processes'''
+        with self.lock:
+            if fcntl is None:
+                result, *self.state = update(*self.state)
+                return result
+            with open(self.path, 'a+b') as state_file:
+                fcntl.flock(state_file, fcntl.LOCK_EX)
+                try:
+                    state_file.seek(0)
+                    data = state_file.read(_STATE.size)
+                    state = _STATE.unpack(data) if len(data) == _STATE.size else (0., 0.)
+                    result, *state = update(*state)
+                    state_file.seek(0)
+                    state_file.truncate()
+                    state_file.write(_STATE.pack(*state))
+                    state_file.flush()
+                finally:
+                    fcntl.flock(state_file, fcntl.LOCK_UN)
+            return result
+
+    @staticmethod
+    def _schedule(tat, now, per_minute, cost, burst_seconds):
+        '''Start time and new theoretical arrival time for spending cost units of a per-minute limit'''
+        if not per_minute:
+            return now, tat
+        interval = 60. / per_minute
+        tolerance = max(per_minute * burst_seconds / 60., 1.) * interval
+        tat = max(tat, now)
+        return max(now, tat + cost * interval - tolerance), tat + cost * interval
+
+    def reserve(self, tokens=0):
+        '''Reserve a request of the given token estimate, returns the seconds to wait before sending it'''
+        def update(request_tat, token_tat):
+            now = time.time()
+            request_start, new_request_tat = self._schedule(
+                request_tat, now, self.requests_per_minute, 1, self.burst_seconds)
+            token_start, new_token_tat = self._schedule(
+                token_tat, now, self.tokens_per_minute, tokens, self.burst_seconds)
+            return max(request_start, token_start) - now, new_request_tat, new_token_tat
+        return self._update(update)
+
+    def acquire(self, tokens=0):
+        '''Reserve and sleep until the request may be sent'''
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def settle(self, estimated_tokens, actual_tokens):
+        '''Give back the tokens that were reserved but not used'''
+        if not self.tokens_per_minute or actual_tokens is None or actual_tokens >= estimated_tokens:
+            return
+
+        def update(request_tat, token_tat):
+            refund = (estimated_tokens - actual_tokens) * 60. / self.tokens_per_minute
+            return None, request_tat, max(token_tat - refund, time.time())
+        self._update(update)
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from agent.MultimodalEngine import LMMEngine
+
+logger = logging.getLogger("openaci.agent")
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "openaci", "responses.sqlite")
+
+# A response served from the cache costs no tokens
+CACHE_HIT_USAGE = {'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0}
+
+
+def make_cache_key(model, messages, temperature=0., max_new_tokens=None, **kwargs):
+    '''Stable content hash of everything that determines a completion'''
+    payload = {
+        'model': model,
+        'messages': messages,
+        'temperature': temperature,
+        'max_new_tokens': max_new_tokens,
+        'kwargs': kwargs,
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    '''Content-addressed store of completions in SQLite with LRU size eviction.
+
+    SQLite in WAL mode handles locking, so several processes can share one cache file.
+    '''
+    def __init__(self, path=None, max_size_bytes=512 * 1024 * 1024):
+        self.path = path or DEFAULT_CACHE_PATH
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads, keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30., isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        '''Return the cached response for key or None'''
+        conn = self._connection()
+        row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, response):
+        '''Store a response and evict least recently used entries beyond max_size_bytes'''
+        size = len(response.encode('utf-8'))
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_size_bytes:
+                evict = []
+                for old_key, old_size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                    if total <= self.max_size_bytes:
+                        break
+                    evict.append((old_key,))
+                    total -= old_size
+                conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def stats(self):
+        entries, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'entries': entries,
+            'size_bytes': size,
+        }
+
+
+class LMMEngineCached(LMMEngine):
+    '''Serve repeated requests to the wrapped engine from a ResponseCache.
+
+    Only deterministic (temperature 0) calls are cached unless deterministic_only is False.
+    '''
+    def __init__(self, engine, cache=None, deterministic_only=True):
+        self.engine = engine
+        self.cache = cache if cache is not None else ResponseCache()
+        self.deterministic_only = deterministic_only
+
+    def __getattr__(self, name):
+        # Expose model, cost, etc. of the wrapped engine
+        if name == 'engine':
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+
+    # Defined on LMMEngine, so they have to be forwarded explicitly
+    @property
+    def tags(self):
+        return self.engine.tags
+
+    @tags.setter
+    def tags(self, tags):
+        self.engine.tags = tags
+
+    @property
+    def cost(self):
+        return self.engine.cost
+
+    def cache_key(self, messages, temperature, max_new_tokens, **kwargs):
+        if self.deterministic_only and temperature != 0:
+            return None
+        return make_cache_key(self.engine.model, messages, temperature, max_new_tokens, **kwargs)
+
+    def generate(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        key = self.cache_key(messages, temperature, max_new_tokens, **kwargs)
+        if key is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                logger.debug("Response cache hit (hit rate %.2f)", self.cache.hit_rate)
+                self.set_usage(CACHE_HIT_USAGE)
+                return response
+        response = self.engine.generate(messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs)
+        self.set_usage(self.engine.last_usage)
+        if key is not None and response is not None:
+            self.cache.put(key, response)
+        return response
+
+    def generate_stream(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        key = self.cache_key(messages, temperature, max_new_tokens, **kwargs)
+        if key is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                self.set_usage(CACHE_HIT_USAGE)
+                yield response
+                return
+        # Only a stream that ran to completion is cached, a cancelled one is partial
+        chunks = []
+        for chunk in self.engine.generate_stream(messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self.set_usage(self.engine.last_usage)
+        if key is not None:
+            self.cache.put(key, ''.join(chunks))
+
+    async def agenerate(self, messages, temperature=0., max_new_tokens=None, **kwargs):
+        key = self.cache_key(messages, temperature, max_new_tokens, **kwargs)
+        if key is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                logger.debug("Response cache hit (hit rate %.2f)", self.cache.hit_rate)
+                self.set_usage(CACHE_HIT_USAGE)
+                return response
+        response = await self.engine.agenerate(messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs)
+        self.set_usage(self.engine.last_usage)
+        if key is not None and response is not None:
+            self.cache.put(key, response)
+        return response
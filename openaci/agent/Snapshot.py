@@ -0,0 +1,344 @@
+"""Binary snapshots of grounded observations, to replay and benchmark grounding offline.
+
+A snapshot file is a header followed by one record per observation, appended as the agent runs:
+
+    file:    b'OACISNAP' | u16 version | u16 flags | u32 reserved
+    record:  b'OBSV' | u32 header length | JSON header | padding | 8-byte aligned blocks
+
+The JSON header lists the roles, the metadata and the offset, dtype and length of every block.
+Blocks hold the NodeTable columns (little-endian), the interned strings as offsets into one UTF-8
+blob, the zlib-compressed linearized tree and optional extra per-node columns such as parent links or state bits.
+The reader memory-maps the file, so the columns of a record are numpy views and strings are only
+decoded when they are read. Screenshots are stored once per content hash next to the snapshot,
+with the extension of their image format.
+
+    cd openaci && python -m agent.Snapshot --observations 50 --nodes 20000
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from agent.NodeTable import NodeTable
+
+MAGIC = b'OACISNAP'
+RECORD_MAGIC = b'OBSV'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sHHI')
+RECORD_HEADER = struct.Struct('<4sI')
+ALIGNMENT = 8
+
+# Leading bytes of the screenshot formats ImageEncoder produces -> file extension
+IMAGE_SIGNATURES = [(b'\x89PNG', 'png'), (b'\xff\xd8\xff', 'jpg'), (b'RIFF', 'webp')]
+
+# Column name -> dtype on disk
+NODE_COLUMNS = {
+    'x': '<f4', 'y': '<f4', 'w': '<f4', 'h': '<f4',
+    'role': '<u2', 'title': '<i4', 'text': '<i4', 'valid': '|b1',
+}
+
+
+class StringTable:
+    '''Read-only list of strings decoded on access from UTF-8 offsets and blob'''
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class Observation:
+    '''One recorded observation.
+
+    Attributes:
+        nodes: NodeTable whose columns are views on the snapshot file
+        linearized_accessibility_tree: the tree as it was given to the planner
+        focused_element_id: index of the focused element in nodes, or None
+        screenshot: file name of the screenshot next to the snapshot, <content hash>.<extension>, or None
+        meta: platform, top_app, timestamp and whatever else the writer was given
+        columns: extra per-node columns by name
+    '''
+    def __init__(self, nodes, linearized_accessibility_tree, focused_element_id, screenshot, meta, columns):
+        self.nodes = nodes
+        self.linearized_accessibility_tree = linearized_accessibility_tree
+        self.focused_element_id = focused_element_id
+        self.screenshot = screenshot
+        self.meta = meta
+        self.columns = columns
+
+
+def pad(length):
+    return -length % ALIGNMENT
+
+
+def image_extension(image):
+    for signature, extension in IMAGE_SIGNATURES:
+        if bytes(image[:len(signature)]) == signature:
+            return extension
+    return 'png'
+
+
+def scan_records(buffer, path):
+    '''(header, offset of the first block) of every complete record and the end of the last one.
+
+    A record cut short by a crash while it was written ends the scan.
+    '''
+    records = []
+    position = FILE_HEADER.size
+    while position + RECORD_HEADER.size <= len(buffer):
+        magic, header_length = RECORD_HEADER.unpack_from(buffer, position)
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"corrupt snapshot record at byte {position} of {path}")
+        start = position + RECORD_HEADER.size
+        if start + header_length > len(buffer):
+            break
+        header = json.loads(bytes(buffer[start:start + header_length]))
+        data = start + header_length
+        if data + header['size'] > len(buffer):
+            break
+        records.append((header, data))
+        position = data + header['size']
+    return records, position
+
+
+def check_file_header(buffer, path):
+    '''Version of the snapshot file, raises ValueError if it is not one this module can read'''
+    magic, version, _, _ = FILE_HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a snapshot file")
+    if version > VERSION:
+        raise ValueError(f"{path} has snapshot version {version}, this reader supports up to {VERSION}")
+    return version
+
+
+class SnapshotWriter:
+    '''Append observations to a snapshot file, one flushed record per write.
+
+    Args:
+        path: snapshot file, created with a header if missing and appended to otherwise, after
+            dropping a last record left incomplete by a crash
+        screenshot_dir: where screenshots are stored by content hash, defaults to <path>.screenshots
+    '''
+    def __init__(self, path, screenshot_dir=None):
+        self.path = path
+        self.screenshot_dir = screenshot_dir or path + '.screenshots'
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        new = size < FILE_HEADER.size
+        if new and size:
+            # Not even the file header made it to disk
+            os.truncate(path, 0)
+        elif not new:
+            with open(path, 'rb') as snapshot_file:
+                with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    check_file_header(buffer, path)
+                    _, end = scan_records(buffer, path)
+            if end < size:
+                os.truncate(path, end)
+        self.file = open(path, 'ab')
+        if new:
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION, 0, 0))
+            self.file.flush()
+
+    def save_screenshot(self, screenshot):
+        '''Store the screenshot bytes once per content hash, returns the file name'''
+        name = hashlib.blake2b(screenshot, digest_size=16).hexdigest() + '.' + image_extension(screenshot)
+        os.makedirs(self.screenshot_dir, exist_ok=True)
+        screenshot_path = os.path.join(self.screenshot_dir, name)
+        if not os.path.exists(screenshot_path):
+            with open(screenshot_path, 'wb') as screenshot_file:
+                screenshot_file.write(screenshot)
+        return name
+
+    def write(self, nodes, linearized_accessibility_tree="", focused_element_id=None, screenshot=None,
+              columns=None, **meta):
+        '''Append one observation.
+
+        Args:
+            nodes: NodeTable of the observation
+            linearized_accessibility_tree: the tree text given to the planner
+            focused_element_id: index of the focused element in nodes
+            screenshot: screenshot bytes (PNG, JPEG or WebP), stored next to the snapshot, or the file name of a stored one
+            columns: extra per-node arrays by name, e.g. parent links or state bits
+            meta: JSON-serializable metadata, e.g. platform and top_app
+        '''
+        if isinstance(screenshot, (bytes, bytearray, memoryview)):
+            screenshot = self.save_screenshot(screenshot)
+        strings = [string.encode('utf-8') for string in nodes.strings]
+        string_offsets = np.zeros(len(strings) + 1, dtype='<i8')
+        np.cumsum([len(string) for string in strings], out=string_offsets[1:])
+
+        blocks = [(name, np.ascontiguousarray(getattr(nodes, name), dtype=dtype)) for name, dtype in NODE_COLUMNS.items()]
+        blocks.append(('string_offsets', string_offsets))
+        blocks.append(('string_blob', np.frombuffer(b''.join(strings), dtype='|u1')))
+        # Only ever read whole, so it is compressed, a fast level keeps writes off the turn latency
+        linearized = zlib.compress(linearized_accessibility_tree.encode('utf-8'), 1)
+        blocks.append(('linearized', np.frombuffer(linearized, dtype='|u1')))
+        for name, column in (columns or {}).items():
+            column = np.ascontiguousarray(column)
+            blocks.append(('column:' + name, column.astype(column.dtype.newbyteorder('<'))))
+
+        layout = {}
+        offset = 0
+        for name, array in blocks:
+            layout[name] = [array.dtype.str, offset, len(array)]
+            offset += array.nbytes + pad(array.nbytes)
+        meta.setdefault('timestamp', time.time())
+        header = json.dumps({
+            'nodes': len(nodes),
+            'roles': list(nodes.roles),
+            'focused_element_id': focused_element_id,
+            'screenshot': screenshot,
+            'meta': meta,
+            'blocks': layout,
+            'size': offset,
+        }, separators=(',', ':')).encode('utf-8')
+        header += b' ' * pad(RECORD_HEADER.size + len(header))
+
+        parts = [RECORD_HEADER.pack(RECORD_MAGIC, len(header)), header]
+        for name, array in blocks:
+            parts.append(array.tobytes())
+            parts.append(b'\0' * pad(array.nbytes))
+        self.file.write(b''.join(parts))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SnapshotReader:
+    '''Memory-mapped view of a snapshot file, indexable by observation.
+
+    Only the record headers are parsed when opening, a record is materialized on access.
+    '''
+    def __init__(self, path, screenshot_dir=None):
+        self.path = path
+        self.screenshot_dir = screenshot_dir or path + '.screenshots'
+        with open(path, 'rb') as snapshot_file:
+            self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.version = check_file_header(self.map, path)
+        # (header, offset of the first block) per record, a truncated last record is ignored
+        self.records, _ = scan_records(self.map, path)
+
+    def __len__(self):
+        return len(self.records)
+
+    def block(self, header, data, name):
+        dtype, offset, count = header['blocks'][name]
+        return np.frombuffer(self.map, dtype=dtype, count=count, offset=data + offset)
+
+    def __getitem__(self, index):
+        header, data = self.records[index]
+        strings = StringTable(self.block(header, data, 'string_offsets'), self.block(header, data, 'string_blob'))
+        nodes = NodeTable(*(self.block(header, data, name) for name in NODE_COLUMNS if name != 'valid'),
+                          header['roles'], strings, self.block(header, data, 'valid'))
+        linearized = zlib.decompress(self.block(header, data, 'linearized')).decode('utf-8')
+        columns = {name[len('column:'):]: self.block(header, data, name)
+                   for name in header['blocks'] if name.startswith('column:')}
+        return Observation(nodes, linearized, header['focused_element_id'], header['screenshot'], header['meta'], columns)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def screenshot(self, observation):
+        '''Stored screenshot bytes of an observation, None if it has none or the file is gone'''
+        if observation.screenshot is None:
+            return None
+        screenshot_path = os.path.join(self.screenshot_dir, observation.screenshot)
+        if not os.path.exists(screenshot_path):
+            return None
+        with open(screenshot_path, 'rb') as screenshot_file:
+            return screenshot_file.read()
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # Observations still hold views on the file, the map is released with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def synthetic_nodes(nodes, seed=0):
+    '''NodeTable of a large page with repeated roles and texts'''
+    rng = np.random.default_rng(seed)
+    roles = ["AXButton", "AXStaticText", "AXLink", "AXTextField", "AXImage", "AXCell"]
+    rows = [(float(rng.integers(0, 1400)), float(rng.integers(0, 20000)), float(rng.integers(1, 300)),
+             float(rng.integers(1, 40)), roles[i % len(roles)], f"title {i % 3000}", f"text {i % 5000}")
+            for i in range(nodes)]
+    return NodeTable.from_rows(rows)
+
+
+def main():
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Benchmark writing and re-reading snapshots")
+    parser.add_argument("--observations", type=int, default=50)
+    parser.add_argument("--nodes", type=int, default=20000)
+    args = parser.parse_args()
+
+    nodes = synthetic_nodes(args.nodes)
+    linearized = "\n".join(["id\trole\ttitle\ttext"] + [f"{i}\t{role}\t{title}\t{text}"
+                                                       for i, (role, title, text) in enumerate(nodes.rows())])
+    parents = np.arange(args.nodes, dtype=np.int32) - 1
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.snap")
+        start = time.perf_counter()
+        with SnapshotWriter(path) as writer:
+            for turn in range(args.observations):
+                writer.write(nodes, linearized, focused_element_id=turn, screenshot=b"\x89PNG %d" % (turn % 5),
+                             columns={'parent': parents}, platform="synthetic", turn=turn)
+        write_time = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        with SnapshotReader(path) as reader:
+            open_time = time.perf_counter() - start
+            start = time.perf_counter()
+            box_sums, last_nodes = [], []
+            for observation in reader:
+                table = observation.nodes
+                box_sums.append(table.boxes().sum())
+                last_nodes.append(table[len(table) - 1])
+            read_time = time.perf_counter() - start
+            assert all(box_sum == nodes.boxes().sum() for box_sum in box_sums), "snapshot boxes differ"
+            assert all(node == nodes[len(nodes) - 1] for node in last_nodes), "snapshot nodes differ"
+            assert list(observation.nodes.rows()) == list(nodes.rows()), "snapshot rows differ"
+            assert observation.linearized_accessibility_tree == linearized
+            assert (observation.columns['parent'] == parents).all()
+            assert reader.screenshot(observation) == b"\x89PNG %d" % ((args.observations - 1) % 5)
+
+        print(f"{args.observations} observations of {args.nodes} nodes: {size / args.observations / 1024:.0f} KiB each "
+              f"(linearized tree {len(linearized.encode()) / 1024:.0f} KiB), write {write_time / args.observations * 1000:.1f} ms, "
+              f"open {open_time * 1000:.1f} ms, read with boxes {read_time / args.observations * 1000:.2f} ms per observation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""Uniform grid over element boxes for hit-testing and overlap queries.
+
+    python openaci/agent/SpatialIndex.py --nodes 20000 --queries 2000
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+# Boxes spanning more cells than this (windows, scroll areas) are kept in a short list checked on every query
+MAX_CELLS_PER_BOX = 64
+
+
+def box_iou_one(box, boxes):
+    '''IoU of one x1, y1, x2, y2 box against (n, 4) boxes'''
+    top_left = np.maximum(boxes[:, :2], box[:2])
+    bottom_right = np.minimum(boxes[:, 2:], box[2:])
+    size = np.clip(bottom_right - top_left, 0, None)
+    intersection = size[:, 0] * size[:, 1]
+    union = (box[2] - box[0]) * (box[3] - box[1]) + (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0), intersection
+
+
+class SpatialIndex:
+    '''Element ids bucketed by the grid cells their boxes cover, built once per observation.
+
+    The cells are stored CSR style: cell_start[c]:cell_start[c + 1] slices cell_ids. The grid
+    has about one cell per element, so a query touches a handful of ids instead of all of them.
+
+    Args:
+        boxes: (n, 4) x1, y1, x2, y2 boxes, the row is the element id
+        valid: optional mask of the ids to index, e.g. NodeTable.valid
+    '''
+    def __init__(self, boxes, valid=None):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        ids = np.arange(len(self.boxes))
+        if valid is not None:
+            ids = ids[np.asarray(valid, dtype=bool)]
+        # Empty and inverted boxes cannot be hit
+        ids = ids[(self.boxes[ids, 2] >= self.boxes[ids, 0]) & (self.boxes[ids, 3] >= self.boxes[ids, 1])]
+
+        if len(ids):
+            self.origin = self.boxes[ids, :2].min(axis=0)
+            extent = np.maximum(self.boxes[ids, 2:].max(axis=0) - self.origin, 1.)
+        else:
+            self.origin = np.zeros(2, dtype=np.float32)
+            extent = np.ones(2, dtype=np.float32)
+        # Square cells, about one per element
+        side = np.sqrt(extent[0] * extent[1] / max(len(ids), 1))
+        self.shape = (int(np.clip(np.ceil(extent[0] / side), 1, 4096)), int(np.clip(np.ceil(extent[1] / side), 1, 4096)))
+        self.cell_size = extent / self.shape
+
+        first, last = self.cell_range(self.boxes[ids])
+        spans = last - first + 1
+        counts = spans[:, 0] * spans[:, 1]
+        large = counts > MAX_CELLS_PER_BOX
+        self.large_ids = ids[large]
+        ids, first, spans, counts = ids[~large], first[~large], spans[~large], counts[~large]
+
+        # Enumerate the covered cells of every box without a Python loop
+        owner = np.repeat(np.arange(len(ids)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        column = first[owner, 0] + offset % spans[owner, 0]
+        row = first[owner, 1] + offset // spans[owner, 0]
+        columns, rows = self.shape
+        cell = row * columns + column
+        order = np.argsort(cell, kind='stable')
+        self.cell_ids = ids[owner[order]]
+        self.cell_start = np.zeros(columns * rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=columns * rows), out=self.cell_start[1:])
+
+    def cell_range(self, boxes):
+        '''First and last (column, row) cell of every box, clipped to the grid'''
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        limit = np.array(self.shape, dtype=np.int64) - 1
+        first = np.clip(np.floor((boxes[:, :2] - self.origin) / self.cell_size), 0, limit).astype(np.int64)
+        last = np.clip(np.floor((boxes[:, 2:] - self.origin) / self.cell_size), 0, limit).astype(np.int64)
+        return first, last
+
+    def cell_bounds(self, box):
+        '''cell_range of a single box as Python ints, numpy call overhead dominates single queries'''
+        origin_x, origin_y = float(self.origin[0]), float(self.origin[1])
+        cell_width, cell_height = float(self.cell_size[0]), float(self.cell_size[1])
+        columns, rows = self.shape
+
+        def clip(value, limit):
+            return min(max(int(math.floor(value)), 0), limit - 1)
+        first = (clip((box[0] - origin_x) / cell_width, columns), clip((box[1] - origin_y) / cell_height, rows))
+        last = (clip((box[2] - origin_x) / cell_width, columns), clip((box[3] - origin_y) / cell_height, rows))
+        return first, last
+
+    def candidates(self, box):
+        '''Ids that may intersect the box, unsorted and without duplicates'''
+        first, last = self.cell_bounds(box)
+        columns = self.shape[0]
+        parts = [self.large_ids]
+        for row in range(first[1], last[1] + 1):
+            start = self.cell_start[row * columns + first[0]]
+            end = self.cell_start[row * columns + last[0] + 1]
+            parts.append(self.cell_ids[start:end])
+        ids = np.concatenate(parts)
+        return np.unique(ids) if last[0] > first[0] or last[1] > first[1] else ids
+
+    def elements_at(self, x, y):
+        '''Ids of the elements containing the point, smallest first so the innermost element leads'''
+        ids = self.candidates((x, y, x, y))
+        boxes = self.boxes[ids]
+        ids = ids[(boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3])]
+        boxes = self.boxes[ids]
+        return ids[np.argsort((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]), kind='stable')]
+
+    def overlapping(self, box, min_iou=0.):
+        '''Ids of the elements intersecting the box with an IoU of at least min_iou, best match first'''
+        box = np.asarray(box, dtype=np.float32)
+        ids = self.candidates(box)
+        iou, intersection = box_iou_one(box, self.boxes[ids])
+        keep = (intersection > 0) & (iou >= min_iou)
+        ids, iou = ids[keep], iou[keep]
+        return ids[np.argsort(-iou, kind='stable')]
+
+    def nearest(self, box):
+        '''Id of the element closest to the box (gap between the boxes, then center distance), None if empty'''
+        box = np.asarray(box, dtype=np.float32)
+        first, last = self.cell_bounds(box)
+        columns, rows = self.shape
+        best_id, best_key = None, None
+
+        def consider(ids):
+            nonlocal best_id, best_key
+            if not len(ids):
+                return
+            boxes = self.boxes[ids]
+            gap_x = np.maximum(np.maximum(boxes[:, 0] - box[2], box[0] - boxes[:, 2]), 0)
+            gap_y = np.maximum(np.maximum(boxes[:, 1] - box[3], box[1] - boxes[:, 3]), 0)
+            gap = np.hypot(gap_x, gap_y)
+            center = np.hypot((boxes[:, 0] + boxes[:, 2] - box[0] - box[2]) / 2,
+                              (boxes[:, 1] + boxes[:, 3] - box[1] - box[3]) / 2)
+            i = np.lexsort((center, gap))[0]
+            key = (gap[i], center[i])
+            if best_key is None or key < best_key:
+                best_id, best_key = int(ids[i]), key
+
+        consider(self.large_ids)
+        # Search rings of cells around the box until no closer element can be outside them
+        for ring in range(max(columns, rows)):
+            x1, y1 = max(first[0] - ring, 0), max(first[1] - ring, 0)
+            x2, y2 = min(last[0] + ring, columns - 1), min(last[1] + ring, rows - 1)
+            parts = []
+            for row in range(y1, y2 + 1):
+                if ring == 0 or row == first[1] - ring or row == last[1] + ring:
+                    spans = [(x1, x2)]
+                else:
+                    # Inside rows only add the left and right cell of the ring
+                    spans = [(x, x) for x in (first[0] - ring, last[0] + ring) if 0 <= x < columns]
+                for x_start, x_end in spans:
+                    start = self.cell_start[row * columns + x_start]
+                    end = self.cell_start[row * columns + x_end + 1]
+                    parts.append(self.cell_ids[start:end])
+            if parts:
+                consider(np.concatenate(parts))
+            # Elements in cells beyond this ring are at least ring cells away from the box
+            if best_key is not None and best_key[0] < ring * self.cell_size.min():
+                break
+            if x1 == 0 and y1 == 0 and x2 == columns - 1 and y2 == rows - 1:
+                break
+        return best_id
+
+
+def synthetic_page(nodes, width=1440, height=20000, seed=0):
+    '''Boxes of a long web page: rows of small text and controls plus a few containers'''
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, width - 50, nodes)
+    y = rng.uniform(0, height - 20, nodes)
+    w = rng.uniform(10, 300, nodes)
+    h = rng.uniform(10, 40, nodes)
+    boxes = np.stack([x, y, np.minimum(x + w, width), y + h], axis=1)
+    # Containers spanning the page
+    boxes[:nodes // 200] = [0, 0, width, height]
+    return boxes.astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark spatial index queries against linear scans")
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    boxes = synthetic_page(args.nodes)
+    start = time.perf_counter()
+    index = SpatialIndex(boxes)
+    print(f"build: {(time.perf_counter() - start) * 1000:.1f} ms for {args.nodes} boxes")
+
+    rng = np.random.default_rng(1)
+    points = np.stack([rng.uniform(0, 1440, args.queries), rng.uniform(0, 20000, args.queries)], axis=1)
+    probes = np.concatenate([points, points + rng.uniform(10, 200, (args.queries, 2))], axis=1).astype(np.float32)
+
+    def scan_at(x, y):
+        hit = (boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3])
+        return set(np.flatnonzero(hit).tolist())
+
+    def scan_overlapping(box, min_iou):
+        iou, intersection = box_iou_one(box, boxes)
+        return set(np.flatnonzero((intersection > 0) & (iou >= min_iou)).tolist())
+
+    def scan_nearest(box):
+        gap_x = np.maximum(np.maximum(boxes[:, 0] - box[2], box[0] - boxes[:, 2]), 0)
+        gap_y = np.maximum(np.maximum(boxes[:, 1] - box[3], box[1] - boxes[:, 3]), 0)
+        return float(np.hypot(gap_x, gap_y).min())
+
+    def gap(i, box):
+        other = boxes[i]
+        return float(np.hypot(max(other[0] - box[2], box[0] - other[2], 0), max(other[1] - box[3], box[1] - other[3], 0)))
+
+    queries = [
+        ("elements_at", lambda q: index.elements_at(q[0], q[1]), lambda q: scan_at(q[0], q[1]),
+         lambda result, expected: set(result.tolist()) == expected),
+        ("overlapping", lambda q: index.overlapping(q, 0.1), lambda q: scan_overlapping(q, 0.1),
+         lambda result, expected: set(result.tolist()) == expected),
+        ("nearest", lambda q: index.nearest(q + [0, 0, 0, 0]), scan_nearest, None),
+    ]
+    for name, query, scan, same in queries:
+        start = time.perf_counter()
+        results = [query(q) for q in probes]
+        indexed = (time.perf_counter() - start) / args.queries
+        start = time.perf_counter()
+        expected = [scan(q) for q in probes]
+        linear = (time.perf_counter() - start) / args.queries
+        if same is not None:
+            assert all(same(r, e) for r, e in zip(results, expected)), f"{name} differs from the linear scan"
+        else:
+            assert all(abs(gap(r, q) - e) < 1e-3 for r, e, q in zip(results, expected, probes)), f"{name} differs"
+        print(f"{name}: {indexed * 1e6:.0f} us per query indexed, {linear * 1e6:.0f} us linear scan")
+
+
+if __name__ == "__main__":
+    main()
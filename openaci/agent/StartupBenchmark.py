@@ -0,0 +1,70 @@
+"""Import-time budget for the entry points, measured with python -X importtime in a fresh interpreter.
+
+    python openaci/agent/StartupBenchmark.py --modules cli_app agent.UIAgent --budget 1.0
+
+Exits with status 1 when any module takes longer than the budget, tests/test_startup.py runs the
+same check in CI.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# import time:       self [us] |   cumulative | imported package
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Top-level names of our own code, as imported from PACKAGE_DIR (agent, macos, cli_app, ...) or as openaci
+PROJECT_MODULES = {'openaci'} | {os.path.splitext(name)[0] for name in os.listdir(PACKAGE_DIR)
+                                 if name.endswith('.py') or os.path.isdir(os.path.join(PACKAGE_DIR, name))}
+
+
+def import_times(module, cwd=PACKAGE_DIR):
+    '''(cumulative us, self us, depth, name) of every import made by a fresh `import module`'''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+    times = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            times.append((int(cumulative), int(own), len(indent) // 2, name))
+    return times
+
+
+def startup_time(module, cwd=PACKAGE_DIR):
+    '''Seconds spent importing module and everything it pulls in, excluding interpreter startup'''
+    return total_time(import_times(module, cwd))
+
+
+def total_time(times):
+    '''Seconds of the top-level imports of our own modules, including what they pull in.
+
+    Other top-level imports (encodings, site, ...) are made by the interpreter before the module is imported.
+    '''
+    return sum(cumulative for cumulative, _, depth, name in times
+               if depth == 0 and name.split('.')[0] in PROJECT_MODULES) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the entry points against a budget")
+    parser.add_argument("--modules", nargs="+", default=["cli_app", "agent.UIAgent"])
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds allowed per module")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to show")
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in args.modules:
+        times = import_times(module)
+        total = total_time(times)
+        print(f"{module}: {total:.3f}s (budget {args.budget:.3f}s)")
+        for cumulative, own, depth, name in sorted(times, reverse=True)[:args.top]:
+            print(f"    {cumulative / 1e6:.3f}s cumulative  {own / 1e6:.3f}s self  {name}")
+        over_budget |= total > args.budget
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("openaci.agent")
+
+# USD per million tokens: (input, cached input, output). Looked up by longest model name prefix.
+PRICING = {
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o-2024-05-13': (5.00, 5.00, 15.00),
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4-turbo': (10.00, 10.00, 30.00),
+    'gpt-4': (30.00, 30.00, 60.00),
+    'gpt-3.5-turbo': (0.50, 0.50, 1.50),
+    'o1-mini': (3.00, 1.50, 12.00),
+    'o1': (15.00, 7.50, 60.00),
+}
+
+LATENCY_BUCKETS = (0.5, 1., 2., 5., 10., 20., 30., 60., float('inf'))
+
+
+def lookup_pricing(model):
+    matches = [name for name in PRICING if model and model.startswith(name)]
+    if not matches:
+        return None
+    return PRICING[max(matches, key=len)]
+
+
+def compute_cost(model, prompt_tokens, completion_tokens, cached_tokens=0, pricing=None):
+    '''Cost of a call in USD, cached prompt tokens are billed at the cached input price'''
+    pricing = pricing or lookup_pricing(model)
+    if pricing is None:
+        return 0.
+    input_price, cached_price, output_price = pricing
+    return ((prompt_tokens - cached_tokens) * input_price
+            + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1e6
+
+
+def _escape(value):
+    # Label values in the exposition format escape backslash, double quote and newline
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+class LLMTelemetry:
+    '''Collect one record per LLM call and export them as JSONL and as a Prometheus textfile.
+
+    Args:
+        jsonl_path: every record is appended to this file as it is made
+        prometheus_path: rewritten after every call with counters per model and role, for the
+            node_exporter textfile collector
+        max_records: number of records kept in memory
+    '''
+    def __init__(self, jsonl_path=None, prometheus_path=None, max_records=10000):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.records = deque(maxlen=max_records)
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def record(self, model, role=None, turn=None, prompt_tokens=0, completion_tokens=0, cached_tokens=0,
+               latency=0., ttft=None, retries=0, cost=0., error=None, stream=False):
+        record = {
+            'timestamp': time.time(),
+            'model': model,
+            'role': role,
+            'turn': turn,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cached_tokens': cached_tokens,
+            'latency': latency,
+            'ttft': ttft,
+            'retries': retries,
+            'cost': cost,
+            'error': error,
+            'stream': stream,
+        }
+        with self.lock:
+            self.records.append(record)
+            totals = self.totals.setdefault((model, role or ""), {
+                'calls': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0,
+                'retries': 0, 'cost': 0., 'latency_sum': 0., 'latency_buckets': [0] * len(LATENCY_BUCKETS),
+            })
+            totals['calls'] += 1
+            totals['errors'] += error is not None
+            totals['prompt_tokens'] += prompt_tokens
+            totals['completion_tokens'] += completion_tokens
+            totals['cached_tokens'] += cached_tokens
+            totals['retries'] += retries
+            totals['cost'] += cost
+            totals['latency_sum'] += latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    totals['latency_buckets'][i] += 1
+
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as jsonl_file:
+                    jsonl_file.write(json.dumps(record) + "\n")
+            if self.prometheus_path:
+                self.write_prometheus(self.prometheus_path)
+        return record
+
+    def prometheus_text(self):
+        counters = [
+            ('calls', 'openaci_llm_calls_total', 'LLM calls'),
+            ('errors', 'openaci_llm_errors_total', 'LLM calls that raised'),
+            ('retries', 'openaci_llm_retries_total', 'Retries before LLM calls succeeded or gave up'),
+            ('prompt_tokens', 'openaci_llm_prompt_tokens_total', 'Prompt tokens'),
+            ('completion_tokens', 'openaci_llm_completion_tokens_total', 'Completion tokens'),
+            ('cached_tokens', 'openaci_llm_cached_tokens_total', 'Prompt tokens served from the provider cache'),
+            ('cost', 'openaci_llm_cost_usd_total', 'Cost in USD'),
+        ]
+        lines = []
+        for key, name, description in counters:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for (model, role), totals in sorted(self.totals.items()):
+                lines.append(f"{name}{{{_labels(model=model, role=role)}}} {totals[key]}")
+
+        name = 'openaci_llm_latency_seconds'
+        lines.append(f"# HELP {name} Wall latency of LLM calls")
+        lines.append(f"# TYPE {name} histogram")
+        for (model, role), totals in sorted(self.totals.items()):
+            for bound, count in zip(LATENCY_BUCKETS, totals['latency_buckets']):
+                le = "+Inf" if bound == float('inf') else bound
+                lines.append(f"{name}_bucket{{{_labels(model=model, role=role, le=le)}}} {count}")
+            lines.append(f"{name}_sum{{{_labels(model=model, role=role)}}} {totals['latency_sum']}")
+            lines.append(f"{name}_count{{{_labels(model=model, role=role)}}} {totals['calls']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        '''Write the textfile atomically so the collector never reads a partial file'''
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, suffix='.tmp') as tmp_file:
+            tmp_file.write(self.prometheus_text())
+        os.replace(tmp_file.name, path)
+
+
+# Used by engines unless they are given their own, configured from the environment
+default_telemetry = LLMTelemetry(
+    jsonl_path=os.environ.get("OPENACI_TELEMETRY_JSONL"),
+    prometheus_path=os.environ.get("OPENACI_TELEMETRY_PROM"),
+)
@@ -0,0 +1,90 @@
+import re
+from collections import Counter, deque
+
+# Sections of a plan, see the planning prompt in ProceduralMemory
+SECTION_PATTERN = re.compile(r"\(([^()\n]+)\)\s*\n(.*?)(?=\n\s*\([^()\n]+\)\s*\n|\Z)", re.DOTALL)
+CODE_PATTERN = re.compile(r"```(?:\w+\s+)?(.*?)```", re.DOTALL)
+FAILURE_PATTERN = re.compile(r"\b(fail\w*|unsuccessful|not (?:been )?(?:successful|executed|completed|open\w*)|did not|didn't|no effect)\b",
+                             re.IGNORECASE)
+
+MAX_FIELD_CHARS = 160
+
+
+def shorten(text, max_chars=MAX_FIELD_CHARS):
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+def first_sentence(text):
+    match = re.match(r"(.+?[.!?])(\s|$)", text.strip(), re.DOTALL)
+    return match.group(1) if match else text
+
+
+def plan_sections(plan):
+    return {name.strip().lower(): body.strip() for name, body in SECTION_PATTERN.findall(plan)}
+
+
+def grounded_action(plan):
+    '''Code of the grounded action, or the last line of the plan if it has none'''
+    codes = CODE_PATTERN.findall(plan)
+    if codes:
+        return codes[-1].strip()
+    lines = plan.strip().split("\n")
+    return lines[-1] if lines else ""
+
+
+class TrajectorySummary:
+    '''Fixed-size records of the steps taken so far, for the reflection agent.
+
+    Every step is reduced to its action, the planner's verdict on it (given in the next plan's
+    verification) and a compact description of the observation. The last max_steps records are
+    shown one per line, older ones are folded into a single line of counts, so the text given to
+    the reflection agent stays the same size however long the task runs.
+    '''
+    def __init__(self, max_steps=8):
+        self.max_steps = max_steps
+        self.reset()
+
+    def reset(self):
+        self.records = deque()
+        self.folded_steps = 0
+        self.folded_failures = 0
+        self.folded_actions = Counter()
+
+    def add_step(self, plan, observation=None):
+        '''Record a plan, its verification section is the verdict on the previous step'''
+        sections = plan_sections(plan)
+        verification = sections.get("previous action verification")
+        if verification and self.records:
+            self.records[-1]['verdict'] = shorten(first_sentence(verification))
+            self.records[-1]['failed'] = bool(FAILURE_PATTERN.search(verification))
+
+        step = self.folded_steps + len(self.records) + 1
+        self.records.append({
+            'step': step,
+            'intent': shorten(sections.get("next action", "")),
+            'action': shorten(grounded_action(plan)),
+            'observation': shorten(observation) if observation else None,
+            'verdict': None,
+            'failed': False,
+        })
+        while len(self.records) > self.max_steps:
+            self.fold(self.records.popleft())
+
+    def fold(self, record):
+        self.folded_steps += 1
+        self.folded_failures += record['failed']
+        self.folded_actions[record['action'].split("(", 1)[0]] += 1
+
+    def text(self):
+        lines = []
+        if self.folded_steps:
+            actions = ", ".join(f"{name} x{count}" for name, count in self.folded_actions.most_common(5))
+            lines.append(f"Steps 1-{self.folded_steps}: {self.folded_failures} failed; actions: {actions}")
+        for record in self.records:
+            line = f"Step {record['step']}: {record['intent']} | action: {record['action']}"
+            if record['observation']:
+                line += f" | observed: {record['observation']}"
+            line += f" | verdict: {record['verdict'] or 'pending'}"
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,105 @@
+"""Fit a linearized accessibility tree into a token budget.
+
+Token counts are estimated at four characters per token by default. With tiktoken installed and
+its encoding files available (tiktoken downloads them on first use), the o200k_base tokenizer is
+used instead. It is optional and not in the requirements, so the estimate is the supported default.
+"""
+import functools
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from agent.TreeDelta import split_rows
+
+logger = logging.getLogger("openaci.agent")
+
+# Roles the agent can act on, for macOS (AX) and Ubuntu (AT-SPI)
+INTERACTABLE_ROLES = {
+    "AXButton", "AXTextField", "AXTextArea", "AXCheckBox", "AXRadioButton", "AXPopUpButton",
+    "AXComboBox", "AXMenuItem", "AXMenuButton", "AXMenuBarItem", "AXLink", "AXSlider",
+    "AXIncrementor", "AXDisclosureTriangle", "AXTabGroup", "AXCell", "AXRow",
+    "push button", "toggle button", "entry", "text", "password text", "check box", "radio button",
+    "combo box", "menu item", "check menu item", "radio menu item", "link", "slider", "spin button",
+    "page tab", "list item", "table cell", "tree item",
+}
+
+# Rows with huge values (documents, web text) are cut before budgeting
+MAX_CELL_CHARS = 256
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name="o200k_base"):
+    '''Load a tiktoken encoding, None if tiktoken or the encoding files are unavailable'''
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning("Could not load tokenizer %s (%s), estimating token counts", encoding_name, e)
+        return None
+
+
+def count_tokens(text, encoding_name="o200k_base"):
+    '''Count tokens with tiktoken, or estimate them at four characters per token'''
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_cells(row, max_chars=MAX_CELL_CHARS):
+    cells = row.split("\t")
+    return "\t".join(cell if len(cell) <= max_chars else cell[:max_chars] + "..." for cell in cells)
+
+
+def row_priority(index, row, focus_index=None):
+    '''Score a linearized row "id\\trole\\ttitle\\ttext", higher scores are kept first'''
+    cells = row.split("\t")
+    role = cells[1] if len(cells) > 1 else ""
+    score = 0.
+    if role in INTERACTABLE_ROLES:
+        score += 3.
+    if any(cell.strip() and cell != "None" for cell in cells[2:]):
+        score += 1.
+    if focus_index is not None:
+        # Rows around the focused element, most of the time in the same window
+        score += 4. / (1. + abs(index - focus_index) / 10.)
+    return score
+
+
+def budget_tree(linearized_accessibility_tree, max_tokens, focus_id=None, encoding_name="o200k_base"):
+    '''Drop the least important rows of a linearized tree until it fits into max_tokens.
+
+    Kept rows stay in their original order and keep their ids, so find_element still resolves them.
+    '''
+    if max_tokens is None:
+        return linearized_accessibility_tree
+    if count_tokens(linearized_accessibility_tree, encoding_name) <= max_tokens:
+        return linearized_accessibility_tree
+    # Rows are split like TreeDelta does, a multi-line value stays with its row
+    header, rows = split_rows(linearized_accessibility_tree)
+
+    # Over budget, huge values are cut before rows are dropped. +1 for the newline joining the rows
+    rows = [truncate_cells(row) for row in rows]
+    remaining = max_tokens - count_tokens(header, encoding_name)
+    costs = [count_tokens(row, encoding_name) + 1 for row in rows]
+
+    focus_index = None
+    if focus_id is not None:
+        ids = [row.split("\t", 1)[0] for row in rows]
+        if str(focus_id) in ids:
+            focus_index = ids.index(str(focus_id))
+
+    order = sorted(range(len(rows)), key=lambda i: row_priority(i, rows[i], focus_index), reverse=True)
+    keep = set()
+    for i in order:
+        if costs[i] > remaining:
+            continue
+        keep.add(i)
+        remaining -= costs[i]
+
+    logger.info("Accessibility tree over budget, kept %d of %d rows within %d tokens", len(keep), len(rows), max_tokens)
+    return "\n".join([header] + [row for i, row in enumerate(rows) if i in keep])
@@ -0,0 +1,173 @@
+"""Accessibility tree kept between turns and patched from change notifications.
+
+Instead of walking the whole app every turn, the cache remembers what each element expanded to
+and only re-reads the elements that an event (AXObserver, AT-SPI) invalidated since the last read.
+"""
+import threading
+
+# How much of the cached tree an event invalidates:
+#   node: re-read the element itself, children already cached are kept
+#   subtree: re-read the element and everything below it, e.g. all positions change when a window moves
+#   parent: re-read the parent of the element, for elements that were created or destroyed
+#   parent_subtree: re-read the parent and everything below it, e.g. a scroll bar moving the contents of its scroll area
+INVALIDATION_MODES = ('node', 'subtree', 'parent', 'parent_subtree')
+
+
+class TreeCache:
+    '''Pre-order values of a tree, re-expanding only invalidated elements.
+
+    Args:
+        expand: expand(element) -> (value, children), the same contract as ParallelTraversal.traverse
+        key: key(element) -> hashable identity, equal for the same element across reads
+        invalidation: event name -> invalidation mode, events not listed are ignored
+        traversal: ParallelTraversal used to read new and invalidated subtrees
+        parent: parent(element) -> parent element or None, to place elements the cache has not seen yet
+        full_read_every: re-read the whole tree after this many patched reads, bounds the damage of missed events
+    '''
+    def __init__(self, expand, key, invalidation, traversal, parent=None, full_read_every=None):
+        self.expand = expand
+        self.key = key
+        self.invalidation = invalidation
+        self.traversal = traversal
+        self.parent = parent
+        self.full_read_every = full_read_every
+        # key -> [element, value, children, child keys, parent key]
+        self.records = {}
+        self.root_key = None
+        self.app_key = None
+        self.dirty = {}
+        # Invalidations of keys without a record, a read in progress may still add them
+        self.pending = {}
+        self.stale = True
+        self.patched_reads = 0
+        self.lock = threading.Lock()
+        self.stats = {'full_reads': 0, 'patched_reads': 0, 'expanded': 0, 'events': 0}
+
+    def invalidation_mode(self, event, element):
+        '''Invalidation mode of an event, None to ignore it, subclasses can refine it by the element'''
+        return self.invalidation.get(event)
+
+    def on_event(self, event, element):
+        '''Event callback for an event source, safe to call from any thread'''
+        mode = self.invalidation_mode(event, element)
+        if mode is None:
+            return
+        key = self.key(element)
+        with self.lock:
+            self.stats['events'] += 1
+            if mode in ('parent', 'parent_subtree'):
+                record = self.records.get(key)
+                if record is not None:
+                    parent_key = record[4]
+                else:
+                    parent_element = self.parent(element) if self.parent is not None else None
+                    parent_key = self.key(parent_element) if parent_element is not None else None
+                if parent_key is None:
+                    # Nowhere to place it, read everything again
+                    self.stale = True
+                else:
+                    self.mark(parent_key, 'node' if mode == 'parent' else 'subtree')
+            else:
+                self.mark(key, mode)
+
+    def mark(self, key, mode):
+        # With the lock held. A key without a record is kept until the end of the next read, a full
+        # read in progress may have read the element before the change.
+        marks = self.dirty if key in self.records else self.pending
+        if marks.get(key) != 'subtree':
+            marks[key] = mode
+
+    def invalidate(self, element=None, mode='subtree'):
+        '''Mark an element, or with None the whole tree, to be read again'''
+        with self.lock:
+            if element is None:
+                self.stale = True
+            else:
+                self.dirty[self.key(element)] = mode
+
+    def read_subtree(self, element, parent_key):
+        '''Expand element and everything below it into records'''
+        def expand(element):
+            value, children = self.expand(element)
+            children = list(children or [])
+            return (element, value, children), children
+
+        nodes = self.traversal.traverse(element, expand, key=self.app_key)
+        self.stats['expanded'] += len(nodes)
+        parents = {}
+        for element, value, children in nodes:
+            key = self.key(element)
+            child_keys = [self.key(child) for child in children]
+            for child_key in child_keys:
+                parents[child_key] = key
+            self.records[key] = [element, value, children, child_keys, parents.get(key, parent_key)]
+
+    def drop_subtree(self, key):
+        stack = [key]
+        while stack:
+            record = self.records.pop(stack.pop(), None)
+            if record is not None:
+                stack.extend(record[3])
+
+    def patch(self, key, mode):
+        record = self.records.get(key)
+        if record is None:
+            # Dropped with an invalidated ancestor or no longer in the tree
+            return
+        element, parent_key = record[0], record[4]
+        if mode == 'subtree':
+            self.drop_subtree(key)
+            self.read_subtree(element, parent_key)
+            return
+
+        value, children = self.expand(element)
+        self.stats['expanded'] += 1
+        children = list(children or [])
+        record[1:4] = [value, children, [self.key(child) for child in children]]
+
+    def read(self, root, app_key=None):
+        '''[(key, value)] of every element below and including root, in pre-order.
+
+        app_key is passed on to the traversal to cap concurrent reads per app.
+        '''
+        root_key = self.key(root)
+        self.app_key = app_key
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            stale, self.stale = self.stale, False
+        due = self.full_read_every is not None and self.patched_reads >= self.full_read_every
+        if stale or due or root_key != self.root_key or root_key not in self.records:
+            self.records = {}
+            self.root_key = root_key
+            self.read_subtree(root, None)
+            self.patched_reads = 0
+            self.stats['full_reads'] += 1
+        else:
+            # Whole subtrees first, node patches below them are then already fresh
+            for key, mode in sorted(dirty.items(), key=lambda item: item[1] != 'subtree'):
+                self.patch(key, mode)
+            self.patched_reads += 1
+            self.stats['patched_reads'] += 1
+
+        # Walk the records, reading children that are new since the last read and
+        # keeping only the records still reachable from the root
+        values = []
+        reachable = {}
+        stack = [(self.root_key, root, None)]
+        while stack:
+            key, element, parent_key = stack.pop()
+            record = self.records.get(key)
+            if record is None:
+                self.read_subtree(element, parent_key)
+                record = self.records[key]
+            record[4] = parent_key
+            reachable[key] = record
+            values.append((key, record[1]))
+            stack.extend(reversed(list(zip(record[3], record[2], [key] * len(record[3])))))
+        with self.lock:
+            self.records = reachable
+            pending, self.pending = self.pending, {}
+        # Elements that changed while they were being read, the others are not in the tree
+        for key, mode in sorted(pending.items(), key=lambda item: item[1] != 'subtree'):
+            self.patch(key, mode)
+        return values
@@ -0,0 +1,140 @@
+import re
+from collections import defaultdict, deque
+
+# Rows start with their id, lines that do not are the rest of a multi-line value
+ROW_START = re.compile(r"^\d+\t", re.MULTILINE)
+
+
+def split_rows(linearized_accessibility_tree):
+    '''Split a linearized tree into its header and one string per row, multi-line values included'''
+    header, _, body = linearized_accessibility_tree.partition("\n")
+    starts = [match.start() for match in ROW_START.finditer(body)]
+    return header, [body[start:end].rstrip("\n") for start, end in zip(starts, starts[1:] + [len(body)])]
+
+
+def parse_rows(linearized_accessibility_tree):
+    '''Split a linearized tree into its header and (role, title, text) per row'''
+    header, lines = split_rows(linearized_accessibility_tree)
+    rows = []
+    for line in lines:
+        cells = line.split("\t")
+        rows.append((cells[1] if len(cells) > 1 else "",
+                     cells[2] if len(cells) > 2 else "",
+                     "\t".join(cells[3:])))
+    return header, rows
+
+
+def format_row(element_id, row, change=None):
+    line = "\t".join((str(element_id),) + row)
+    return line if change is None else f"{line}\t{change}"
+
+
+class TreeDeltaEncoder:
+    '''Send only what changed in the accessibility tree since the previous observation.
+
+    Elements keep their id for as long as they stay on screen, so the model can still act on
+    elements it saw in an earlier tree. A row matching a previous row on role, title and text is
+    unchanged, one matching on role and title only is changed, everything else is added or removed.
+    The whole tree is sent on the first turn, when asked to, and when the diff ratio (changed rows
+    over tree size) is above full_tree_threshold, which also renumbers the elements from 0.
+    '''
+    def __init__(self, full_tree_threshold=0.3):
+        self.full_tree_threshold = full_tree_threshold
+        self.reset()
+
+    def reset(self):
+        self.rows = {}  # id -> (role, title, text) as last sent
+        self.next_id = 0
+        # id -> row the model had before the last encode (None if it had none), for every row listed in it
+        self.listed = {}
+
+    def match(self, rows):
+        '''Stable id per row and the changed ids, unmatched rows get None'''
+        by_row = defaultdict(deque)
+        by_title = defaultdict(deque)
+        for element_id, row in sorted(self.rows.items()):
+            by_row[row].append(element_id)
+            by_title[row[:2]].append(element_id)
+
+        # Identical rows are paired in tree order
+        ids = [by_row[row].popleft() if by_row.get(row) else None for row in rows]
+        matched = set(element_id for element_id in ids if element_id is not None)
+        changed = []
+        for i, row in enumerate(rows):
+            if ids[i] is not None:
+                continue
+            candidates = by_title.get(row[:2])
+            while candidates and candidates[0] in matched:
+                candidates.popleft()
+            if candidates:
+                ids[i] = candidates.popleft()
+                matched.add(ids[i])
+                changed.append(ids[i])
+        return ids, changed
+
+    def encode(self, linearized_accessibility_tree, force_full=False):
+        '''Returns the tree or delta text and an info dict with the diff ratio and the stable id of every row'''
+        header, rows = parse_rows(linearized_accessibility_tree)
+        ids, changed = self.match(rows)
+        added = sum(element_id is None for element_id in ids)
+        removed = sorted(set(self.rows) - set(element_id for element_id in ids if element_id is not None))
+        diff_ratio = (added + len(removed) + len(changed)) / max(len(rows), len(self.rows), 1)
+        full = force_full or not self.rows or diff_ratio > self.full_tree_threshold
+
+        info = {'full': full, 'diff_ratio': diff_ratio, 'added': added, 'removed': len(removed),
+                'changed': len(changed), 'rows': len(rows)}
+        if full:
+            ids = list(range(len(rows)))
+            self.rows = dict(zip(ids, rows))
+            self.next_id = len(rows)
+            self.listed = dict.fromkeys(ids)
+            info['ids'] = ids
+            return "\n".join([header] + [format_row(i, row) for i, row in enumerate(rows)]), info
+
+        lines = [header + "\tchange"]
+        previous = self.rows
+        self.rows = {}
+        self.listed = {}
+        changed = set(changed)
+        for i, row in enumerate(rows):
+            if ids[i] is None:
+                ids[i] = self.next_id
+                self.next_id += 1
+                lines.append(format_row(ids[i], row, "added"))
+                self.listed[ids[i]] = None
+            elif ids[i] in changed:
+                lines.append(format_row(ids[i], row, "changed"))
+                self.listed[ids[i]] = previous[ids[i]]
+            self.rows[ids[i]] = row
+        for element_id in removed:
+            lines.append(format_row(element_id, previous[element_id], "removed"))
+            self.listed[element_id] = previous[element_id]
+        info['ids'] = ids
+        return "\n".join(lines), info
+
+    def sent(self, text):
+        '''Keep only what the model received when the encoded text was cut before sending, e.g. by budget_tree.
+
+        A dropped added row is forgotten, a dropped changed or removed row keeps its previous value,
+        so the next delta lists them again.
+        '''
+        _, lines = split_rows(text)
+        sent_ids = {int(line.split("\t", 1)[0]) for line in lines}
+        for element_id, previous in self.listed.items():
+            if element_id in sent_ids:
+                continue
+            if previous is None:
+                self.rows.pop(element_id, None)
+            else:
+                self.rows[element_id] = previous
+        self.listed = {}
+
+    @staticmethod
+    def remap(nodes, ids):
+        '''Index the grounding agent's nodes by stable id, ids that are no longer on screen map to None'''
+        if hasattr(nodes, 'remap'):  # NodeTable
+            return nodes.remap(ids)
+        remapped = [None] * (max(ids) + 1 if ids else 0)
+        for node, element_id in zip(nodes, ids):
+            remapped[element_id] = node
+        return remapped
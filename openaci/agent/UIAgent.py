@@ -1,30 +1,39 @@
 import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 from agent.ProceduralMemory import PROCEDURAL_MEMORY
 import platform 
 
 if platform.system() == 'Darwin':
-    from macos.Grounding import GroundingAgent
+    from macos.Grounding import GroundingAgent, default_tree_cache
     from macos.UIElement import UIElement
 elif platform.system() == 'Linux':
-    from ubuntu.Grounding import GroundingAgent
+    from ubuntu.Grounding import GroundingAgent, default_tree_cache
     from ubuntu.UIElement import UIElement
 else:
     raise NotImplementedError
 
 from agent.MultimodalAgent import LMMAgent
+from agent.ImageEncoder import ImageEncoder
+from agent.TreeBudget import budget_tree
+from agent.ContextWindow import ContextWindow, TREE_LABEL, TREE_DELTA_LABEL
+from agent.TreeDelta import TreeDeltaEncoder
+from agent.TrajectorySummary import TrajectorySummary
+from agent.Snapshot import SnapshotWriter
 
 import os 
 from typing import Dict, List
 import logging
 import re 
 from typing import Dict, List
-import pyautogui
-import io
 
 logger = logging.getLogger("openaci.agent")
 
+# Actions that move the contents of the screen without a change event per element, e.g. scrolling
+# or paging with keys, the cached tree is read again after them
+TREE_INVALIDATING_ACTION = re.compile(r'\s*agent\.(scroll|hotkey|hold_and_press)\(')
+
 # Get the directory of the current script
 working_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -77,6 +86,53 @@ def parse_single_code_from_string(input_string):
 
     return codes[0]
 
+
+class GroundedActionStream:
+    '''Read a streamed plan and stop as soon as the code block under "(Grounded Action)" is closed'''
+    ACTION_PATTERN = re.compile(r"\(Grounded Action\).*?```(?:\w+\s+)?(.*?)```", re.DOTALL)
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.text = ''
+        self.start = time.perf_counter()
+        self.time_to_first_token = None
+        self.time_to_action = None
+        self.total_time = None
+        self.cancelled = False
+
+    def read_until_action(self):
+        '''Consume the stream until the grounded action is complete, returns False if the stream ended without one'''
+        for chunk in self.chunks:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - self.start
+            self.text += chunk
+            # The closing fence can only have arrived with a chunk containing a backtick
+            if '`' in chunk and self.ACTION_PATTERN.search(self.text):
+                self.time_to_action = time.perf_counter() - self.start
+                return True
+        self.total_time = time.perf_counter() - self.start
+        return False
+
+    def cancel(self):
+        '''Stop generation, the plan ends with the grounded action'''
+        self.chunks.close()
+        self.cancelled = True
+        self.total_time = time.perf_counter() - self.start
+
+    def drain(self):
+        '''Read the rest of the plan'''
+        for chunk in self.chunks:
+            self.text += chunk
+        self.total_time = time.perf_counter() - self.start
+
+    def metrics(self):
+        return {
+            'time_to_first_token': self.time_to_first_token,
+            'time_to_action': self.time_to_action,
+            'total': self.total_time,
+            'cancelled': self.cancelled,
+        }
+
 # TODO: Rename this class and unify with grounding variations and planning variations
 class IDBasedGroundingUIAgent:
     def __init__(self,
@@ -89,11 +145,27 @@ class IDBasedGroundingUIAgent:
                  observation_type="a11y_tree",
                  max_trajectory_length=3,
                  a11y_tree_max_tokens=10000,
-                 enable_reflection=True,):
+                 enable_reflection=True,
+                 reflection_mode="sequential",
+                 late_reflection_policy="wait",
+                 reflection_wait_timeout=None,
+                 stream=False,
+                 cancel_after_action=True,
+                 prompt_layout="inline",
+                 context_max_tokens=None,
+                 keep_full_trees=1,
+                 tree_delta=False,
+                 full_tree_threshold=0.3,
+                 trajectory_summary_steps=None,
+                 incremental_tree=False,
+                 snapshot_path=None,):
 
         # Initialize Agents
         self.planning_agent = LMMAgent(engine_params)
         self.reflection_agent = LMMAgent(engine_params)
+        # Telemetry records of each call are tagged with the agent role and the turn
+        self.planning_agent.engine.tags = {'role': 'planning'}
+        self.reflection_agent.engine.tags = {'role': 'reflection'}
 
         # Set parameters
         self.enable_reflection = enable_reflection
@@ -106,6 +178,53 @@ class IDBasedGroundingUIAgent:
         self.max_trajectory_length = max_trajectory_length
         self.a11y_tree_max_tokens = a11y_tree_max_tokens
 
+        # "sequential" reflects right before planning, "pipelined" starts the reflection for turn t
+        # as soon as the plan for turn t-1 exists so it overlaps action execution and observation.
+        # A late pipelined reflection is awaited ("wait", up to reflection_wait_timeout seconds)
+        # or left for a later turn ("skip").
+        if reflection_mode not in ("sequential", "pipelined"):
+            raise ValueError("reflection_mode must be either 'sequential' or 'pipelined'")
+        if late_reflection_policy not in ("wait", "skip"):
+            raise ValueError("late_reflection_policy must be either 'wait' or 'skip'")
+        self.reflection_mode = reflection_mode
+        self.late_reflection_policy = late_reflection_policy
+        self.reflection_wait_timeout = reflection_wait_timeout
+        self.reflection_executor = ThreadPoolExecutor(max_workers=1) if reflection_mode == "pipelined" else None
+        self.pending_reflection = None
+
+        # Streaming planning hands the grounded action over as soon as its code block closes,
+        # the rest of the plan is then either cancelled or read to the end.
+        self.stream = stream
+        self.cancel_after_action = cancel_after_action
+
+        # "inline" splices the task into the system prompt. "prefix_stable" keeps the system prompt
+        # identical across tasks, pins the task data after it and flushes the history in blocks of
+        # max_trajectory_length turns, so the start of the prompt is byte-stable for provider prompt caching.
+        if prompt_layout not in ("inline", "prefix_stable"):
+            raise ValueError("prompt_layout must be either 'inline' or 'prefix_stable'")
+        self.prompt_layout = prompt_layout
+
+        # With a token budget the planning history is packed by ContextWindow instead of being cut to
+        # max_trajectory_length turns: old trees are summarized and the oldest turns dropped only when needed.
+        self.context_window = ContextWindow(context_max_tokens, keep_full_trees) if context_max_tokens else None
+
+        # Send only the rows that changed since the previous observation, with ids that stay stable across
+        # turns. The whole tree is resent when more than full_tree_threshold of it changed or when the
+        # last full tree has left the planning history.
+        self.tree_delta = TreeDeltaEncoder(full_tree_threshold) if tree_delta else None
+        self.full_tree_message = None
+
+        # Reflect on a bounded summary of the steps instead of every raw plan so far, the reflection
+        # agent then starts from its system prompt on every call and its cost stays flat over long tasks.
+        self.trajectory_summary = TrajectorySummary(trajectory_summary_steps) if trajectory_summary_steps else None
+
+        # Keep the accessibility tree of the app between turns and only re-read the elements that
+        # change notifications invalidated, see TreeCache.
+        self.tree_cache = default_tree_cache if incremental_tree else None
+
+        # Record every grounded observation to replay the session offline with GroundingAgent.from_snapshot
+        self.snapshot_writer = SnapshotWriter(snapshot_path) if snapshot_path else None
+
         # Initialize variables
         self.plans = []
         self.actions = []
@@ -114,109 +233,308 @@ class IDBasedGroundingUIAgent:
         self.feedbacks = []
         self.reflections = []
 
-        self.planning_module_system_prompt = PROCEDURAL_MEMORY.construct_procedural_memory(GroundingAgent)
+        self.planning_module_system_prompt = PROCEDURAL_MEMORY.construct_procedural_memory(
+            GroundingAgent, task_in_prompt=prompt_layout == "inline")
         self.reflection_module_system_prompt = PROCEDURAL_MEMORY.REFLECTION_ON_TRAJECTORY
 
+        # Screenshots only feed OCR, a fast PNG level keeps encoding off the critical path
+        # and an unchanged frame reuses the previous encoding.
+        self.screenshot_encoder = ImageEncoder(format="PNG", png_compress_level=1, cache_size=1)
+
         self.turn_count = None
 
+    def finish_reflection(self):
+        if self.pending_reflection is not None:
+            # Let an in-flight reflection finish before its agent is reset underneath it
+            if not self.pending_reflection.cancel():
+                self.pending_reflection.exception()
+            self.pending_reflection = None
+
     def reset(self):
+        self.finish_reflection()
         self.turn_count = 0
         self.planner_history = []
         self.feedback_history = []
         self.action_history = []
         self.planning_agent.reset()
         self.reflection_agent.reset()
-
-    def flush_messages(self):
-        for agent in [self.planning_agent, self.reflection_agent]:
+        if self.tree_delta is not None:
+            self.tree_delta.reset()
+        self.full_tree_message = None
+        if self.trajectory_summary is not None:
+            self.trajectory_summary.reset()
+
+    def close(self):
+        '''Stop the reflection thread and close the snapshot file, the agent cannot predict afterwards'''
+        self.finish_reflection()
+        if self.reflection_executor is not None:
+            self.reflection_executor.shutdown(wait=True)
+            self.reflection_executor = None
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.close()
+            self.snapshot_writer = None
+
+    def flush_messages(self, agents=None):
+        if agents is None:
+            agents = [self.planning_agent, self.reflection_agent]
+        for agent in agents:
+            # Pairs dropped at once, dropping a block lets the history prefix stay unchanged for several turns
+            drop = self.max_trajectory_length if self.prompt_layout == "prefix_stable" and agent is self.planning_agent else 1
+            first = agent.num_pinned_messages
             # After every max_trajectory_length trajectories, remove messages from the start except the system prompt
-            if len(agent.messages) > 2*self.max_trajectory_length + 1:
-                # Remove the user message and assistant message, both are 1 because the elements will move back after 1 pop
-                agent.remove_message_at(1)
-                agent.remove_message_at(1)
-
-    def call_llm(self, agent):
-        # Retry if fails
-        max_retries = 3  # Set the maximum number of retries
-        attempt = 0
-        while attempt < max_retries:
+            if len(agent.messages) - first > 2*(self.max_trajectory_length + drop - 1):
+                # Remove the user message and assistant message, all at first because the elements will move back after each pop
+                for _ in range(2*drop):
+                    agent.remove_message_at(first)
+
+    def retry_llm(self, call, max_retries=3):
+        '''Run an LLM call, retrying failed attempts'''
+        for attempt in range(1, max_retries + 1):
             try:
-                response = agent.get_response()
-                break  # If successful, break out of the loop
+                return call()
             except Exception as e:
-                attempt += 1
                 print(f"Attempt {attempt} failed: {e}")
                 if attempt == max_retries:
                     print("Max retries reached. Handling failure.")
+                    raise
             time.sleep(1.)
-        return response
 
-    def predict(self, instruction: str, obs: Dict) -> List:
+    def call_llm(self, agent):
+        return self.retry_llm(agent.get_response)
+
+    def stream_llm(self, agent):
+        '''Stream a plan until its grounded action, retried like call_llm. Nothing is dispatched
+        before the action is complete, so a failed attempt is simply started again.'''
+        def attempt():
+            stream = GroundedActionStream(agent.get_response_stream())
+            return stream, stream.read_until_action()
+        return self.retry_llm(attempt)
+
+    def reflect(self, instruction, trajectory, turn):
+        '''Run the reflection agent over the trajectory text, returns the reflection and the seconds it took'''
+        start = time.perf_counter()
+        self.reflection_agent.engine.tags['turn'] = turn
+        if self.trajectory_summary is not None:
+            # The summary already covers the earlier steps
+            self.reflection_agent.reset()
+        else:
+            self.flush_messages([self.reflection_agent])
+        self.reflection_agent.add_system_prompt(
+            self.reflection_module_system_prompt)
+        self.reflection_agent.add_message(
+            'Task Description: ' + instruction + '\n' + 'Current Trajectory: ' + trajectory + '\n')
+        reflection = self.call_llm(self.reflection_agent)
+        self.reflection_agent.add_message(reflection)
+        return reflection, time.perf_counter() - start
+
+    def reflection_trajectory(self):
+        if self.trajectory_summary is not None:
+            return self.trajectory_summary.text()
+        return '\n\n'.join(self.planner_history)
+
+    @staticmethod
+    def describe_observation(agent, tree_delta=None):
+        '''One line about the observation a plan was made on'''
+        if tree_delta and not tree_delta['full']:
+            description = (f"{tree_delta['rows']} elements, {tree_delta['added']} added, "
+                           f"{tree_delta['removed']} removed, {tree_delta['changed']} changed")
+        else:
+            description = f"{int(agent.nodes.valid.sum())} elements"
+        if agent.execution_feedback:
+            description += f", feedback: {agent.execution_feedback}"
+        return description
+
+    def collect_reflection(self):
+        '''Take the result of the pipelined reflection, waiting for it if the policy allows'''
+        future = self.pending_reflection
+        if future is None:
+            return None, 0., 0.
+        start = time.perf_counter()
+        if not future.done() and self.late_reflection_policy == "skip":
+            logger.info("REFLECTION: not ready, planning without it")
+            return None, 0., 0.
+        try:
+            reflection, reflection_time = future.result(timeout=self.reflection_wait_timeout)
+        except FutureTimeoutError:
+            logger.info("REFLECTION: timed out after %.2fs, planning without it", time.perf_counter() - start)
+            return None, 0., time.perf_counter() - start
+        except Exception as e:
+            logger.warning("REFLECTION: failed with %s", e)
+            reflection, reflection_time = None, 0.
+        self.pending_reflection = None
+        return reflection, reflection_time, time.perf_counter() - start
+
+    def ground_plan(self, agent, plan):
+        '''Turn the grounded action of a plan into code using the grounding agent'''
+        plan_code = parse_single_code_from_string(plan)
+        plan_code = sanitize_code(plan_code)
+        exec_code = eval(plan_code)
+
+        # If agent selects an element that was out of range, it should not be executed just send a WAIT command. 
+        if agent.index_out_of_range_flag:
+            plan_code = 'WAIT'
+            exec_code = eval('agent.wait(0.5)')
+        elif self.tree_cache is not None and TREE_INVALIDATING_ACTION.match(plan_code):
+            self.tree_cache.invalidate()
+        return plan_code, exec_code
+
+    def predict(self, instruction: str, obs: Dict, on_action=None) -> List:
         """
         Predict the next action(s) based on the current observation.
+        When streaming, on_action is called with the action code as soon as it is available.
         """
         # Provide the top_app to the Grounding Agent to remove all other applications from the tree. At t=0, top_app is None
         agent = GroundingAgent(
-            obs
+            obs,
+            tree_cache=self.tree_cache,
         )
+        if self.snapshot_writer is not None:
+            # Before tree deltas remap the ids
+            self.snapshot_writer.write(agent.nodes, agent.linearized_accessibility_tree, agent.focused_element_id,
+                                       screenshot=obs.get('screenshot'), platform=self.platform,
+                                       top_app=agent.top_app, turn=self.turn_count)
 
         if self.turn_count == 0:
-            self.planning_agent.add_system_prompt(
-            self.planning_module_system_prompt
-            .replace("TASK_DESCRIPTION", instruction)
-            .replace("AVAILABLE_APPS", str(agent.all_apps))
-            )
+            if self.prompt_layout == "prefix_stable":
+                self.planning_agent.add_system_prompt(self.planning_module_system_prompt)
+                self.planning_agent.add_task_context(
+                PROCEDURAL_MEMORY.TASK_CONTEXT
+                .replace("TASK_DESCRIPTION", instruction)
+                .replace("AVAILABLE_APPS", str(agent.all_apps))
+                )
+            else:
+                self.planning_agent.add_system_prompt(
+                self.planning_module_system_prompt
+                .replace("TASK_DESCRIPTION", instruction)
+                .replace("AVAILABLE_APPS", str(agent.all_apps))
+                )
         
-        # Clear older messages 
-        self.flush_messages()
+        # Clear older messages, the reflection agent is flushed whenever it reflects
+        if self.context_window is None:
+            self.flush_messages([self.planning_agent])
         
         # Reflection generation
         reflection = None
+        reflection_time = reflection_wait = 0.
         if self.enable_reflection and self.turn_count > 0:
-            self.reflection_agent.add_system_prompt(
-                self.reflection_module_system_prompt)
-            self.reflection_agent.add_message(
-                'Task Description: ' + instruction + '\n' + 'Current Trajectory: ' + '\n\n'.join(self.planner_history) + '\n')
-            reflection = self.call_llm(self.reflection_agent)
-            self.reflections.append(reflection)
-            self.reflection_agent.add_message(reflection)
-
-            logger.info("REFLECTION: %s", reflection)
+            if self.reflection_mode == "pipelined":
+                reflection, reflection_time, reflection_wait = self.collect_reflection()
+            else:
+                reflection, reflection_time = self.reflect(
+                    instruction, self.reflection_trajectory(), len(self.planner_history))
+                reflection_wait = reflection_time
+            if reflection:
+                self.reflections.append(reflection)
+                logger.info("REFLECTION: %s", reflection)
+
+        linearized_accessibility_tree = agent.linearized_accessibility_tree
+        focus_id = agent.focused_element_id
+        tree_delta = None
+        if self.tree_delta is not None:
+            full_tree_in_history = any(message is self.full_tree_message for message in self.planning_agent.messages)
+            linearized_accessibility_tree, tree_delta = self.tree_delta.encode(
+                linearized_accessibility_tree, force_full=not full_tree_in_history)
+            # Actions refer to the stable ids from now on
+            ids = tree_delta.pop('ids')
+            agent.nodes = self.tree_delta.remap(agent.nodes, ids)
+            focus_id = ids[focus_id] if focus_id is not None and focus_id < len(ids) else None
+            logger.info("TREE DELTA: full %s, diff ratio %.3f, %d added, %d removed, %d changed",
+                        tree_delta['full'], tree_delta['diff_ratio'], tree_delta['added'],
+                        tree_delta['removed'], tree_delta['changed'])
+        tree_label = TREE_DELTA_LABEL if tree_delta and not tree_delta['full'] else TREE_LABEL
+
+        # Keep the most important rows of the tree within a11y_tree_max_tokens, ids are left untouched
+        linearized_accessibility_tree = budget_tree(
+            linearized_accessibility_tree, self.a11y_tree_max_tokens, focus_id=focus_id)
+        if self.tree_delta is not None:
+            # Rows the budget dropped were never seen by the planner
+            self.tree_delta.sent(linearized_accessibility_tree)
 
         # Plan Generation
         if reflection:
             self.planning_agent.add_message('\nYou may use the reflection on the previous trajectory: ' + reflection +
-                                            f"\nAccessibility Tree: {agent.linearized_accessibility_tree}.")
+                                            f"\n{tree_label}: {linearized_accessibility_tree}.")
         else:
             self.planning_agent.add_message(
-                f"Accessibility Tree: {agent.linearized_accessibility_tree}")
+                f"{tree_label}: {linearized_accessibility_tree}")
+        if tree_delta and tree_delta['full']:
+            self.full_tree_message = self.planning_agent.messages[-1]
 
         # Incorporate the feedback from the previous action at the execution level
         if agent.execution_feedback:
             self.planning_agent.add_message('\n The execution level feedback of the previous action is: ' + agent.execution_feedback)
 
-        plan = self.call_llm(self.planning_agent)
+        if self.context_window is not None:
+            self.context_window.pack(self.planning_agent.messages, self.planning_agent.num_pinned_messages)
+
+        self.planning_agent.engine.tags['turn'] = self.turn_count
+        planning_start = time.perf_counter()
+        grounded = None
+        stream_metrics = None
+        dispatched = False
+        if self.stream:
+            stream, found = self.stream_llm(self.planning_agent)
+            if found:
+                grounded = self.ground_plan(agent, stream.text)
+                if on_action is not None:
+                    on_action(grounded[1])
+                    dispatched = True
+                if self.cancel_after_action:
+                    stream.cancel()
+                else:
+                    stream.drain()
+            plan = stream.text
+            stream_metrics = stream.metrics()
+            logger.info("STREAM: first token %s, action %s, total %.2fs, cancelled %s",
+                        stream_metrics['time_to_first_token'], stream_metrics['time_to_action'],
+                        stream_metrics['total'], stream_metrics['cancelled'])
+        else:
+            plan = self.call_llm(self.planning_agent)
+        planning_time = time.perf_counter() - planning_start
         self.planner_history.append(plan)
+        if self.trajectory_summary is not None:
+            self.trajectory_summary.add_step(plan, self.describe_observation(agent, tree_delta))
+
+        # How much of the prompt the provider served from its prompt cache
+        usage = self.planning_agent.engine.last_usage
+        if usage:
+            logger.info("PROMPT CACHE: %d of %d prompt tokens cached, planning took %.2fs",
+                        usage['cached_tokens'], usage['prompt_tokens'], planning_time)
         logger.info("PLAN: %s", plan)
         print("PLAN: ", plan)
 
         self.planning_agent.add_message(plan)
 
-        # Extract code block from the plan
-        plan_code = parse_single_code_from_string(plan)
-        plan_code = sanitize_code(plan_code)
-        exec_code = eval(plan_code)
+        # Start reflecting on this plan while the action executes and the next observation is captured.
+        # At most one reflection is in flight, a late one is picked up on a later turn.
+        if self.enable_reflection and self.reflection_mode == "pipelined" and self.pending_reflection is None:
+            self.pending_reflection = self.reflection_executor.submit(
+                self.reflect, instruction, self.reflection_trajectory(), len(self.planner_history))
+
+        timing = {
+            'reflection': reflection_time,
+            'reflection_wait': reflection_wait,
+            'planning': planning_time,
+            'saved': reflection_time - reflection_wait,
+        }
+        logger.info("TIMING: reflection %.2fs (waited %.2fs), planning %.2fs, saved %.2fs",
+                    timing['reflection'], timing['reflection_wait'], timing['planning'], timing['saved'])
 
-        # If agent selects an element that was out of range, it should not be executed just send a WAIT command. 
-        if agent.index_out_of_range_flag:
-            plan_code = 'WAIT'
-            exec_code = eval('agent.wait(0.5)')
+        # Extract code block from the plan, unless it was already grounded while streaming
+        if grounded is None:
+            grounded = self.ground_plan(agent, plan)
+        plan_code, exec_code = grounded
 
         info = {
             'plan': plan,
-            'linearized_accessibility_tree': agent.linearized_accessibility_tree,
+            'linearized_accessibility_tree': linearized_accessibility_tree,
             'plan_code': plan_code,
             'reflection': reflection,
+            'timing': timing,
+            'stream': stream_metrics,
+            'usage': usage,
+            'action_dispatched': dispatched,
+            'tree_delta': tree_delta,
         }
 
         self.turn_count+=1
@@ -224,6 +542,9 @@ class IDBasedGroundingUIAgent:
         return info, [exec_code]
     
     def run(self, instruction: str):
+        # Loaded here, importing pyautogui takes a while and needs a display
+        import pyautogui
+
         obs = {}
         for _ in range(15):
             obs['accessibility_tree'] = UIElement.systemWideElement()
@@ -232,16 +553,15 @@ class IDBasedGroundingUIAgent:
             # Take a screenshot
             screenshot = pyautogui.screenshot()
 
-            # Save the screenshot to a BytesIO object
-            buffered = io.BytesIO()
-            screenshot.save(buffered, format="PNG")
+            # PNG bytes of the screenshot, reused if the screen did not change
+            obs['screenshot'] = self.screenshot_encoder.encode_bytes(screenshot)[1]
 
-            # Get the byte value of the screenshot
-            screenshot_bytes = buffered.getvalue()
-            # Convert to base64 string.
-            obs['screenshot'] = screenshot_bytes 
+            # While streaming, plain actions start executing as soon as they are grounded
+            def dispatch(code):
+                if not any(command in code.lower() for command in ['done', 'fail', 'next', 'wait']):
+                    exec(code)
 
-            info, code = self.predict(instruction=instruction, obs=obs)
+            info, code = self.predict(instruction=instruction, obs=obs, on_action=dispatch if self.stream else None)
 
             if 'done' in code[0].lower() or 'fail' in code[0].lower():
                 if platform.system() == 'Darwin':
@@ -259,6 +579,7 @@ class IDBasedGroundingUIAgent:
                 continue
 
             else:
-                exec(code[0])
+                if not info['action_dispatched']:
+                    exec(code[0])
                 import time 
                 time.sleep(1.)
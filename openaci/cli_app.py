@@ -1,79 +1,69 @@
 import os 
 import datetime 
-import base64
-import io
-import pyautogui
+import importlib
 import platform 
 import logging
 import sys
-import time 
+import threading
 
-if platform.system() == 'Darwin':
-    from macos.UIElement import UIElement
-    from Foundation import *
-    from AppKit import *
-    from ApplicationServices import (
-        AXIsProcessTrusted,
-        AXUIElementCreateApplication,
-        AXUIElementCreateSystemWide,
-        CFEqual,
-    )
 
-    from ApplicationServices import (
-        AXUIElementCopyAttributeNames,
-        AXUIElementCopyAttributeValue,
-    )
-elif platform.system() == 'Linux':
-    from ubuntu.UIElement import UIElement
+def setup_logging():
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
 
-from agent.UIAgent import IDBasedGroundingUIAgent
+    datetime_str: str = datetime.datetime.now().strftime("%Y%m%d@%H%M%S")
 
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+    log_dir = "logs"
+    os.makedirs(log_dir, exist_ok=True)
 
-datetime_str: str = datetime.datetime.now().strftime("%Y%m%d@%H%M%S")
+    file_handler = logging.FileHandler(
+        os.path.join("logs", "normal-{:}.log".format(datetime_str)), encoding="utf-8"
+    )
+    debug_handler = logging.FileHandler(
+        os.path.join("logs", "debug-{:}.log".format(datetime_str)), encoding="utf-8"
+    )
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    sdebug_handler = logging.FileHandler(
+        os.path.join("logs", "sdebug-{:}.log".format(datetime_str)), encoding="utf-8"
+    )
 
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
+    file_handler.setLevel(logging.INFO)
+    debug_handler.setLevel(logging.DEBUG)
+    stdout_handler.setLevel(logging.INFO)
+    sdebug_handler.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler(
-    os.path.join("logs", "normal-{:}.log".format(datetime_str)), encoding="utf-8"
-)
-debug_handler = logging.FileHandler(
-    os.path.join("logs", "debug-{:}.log".format(datetime_str)), encoding="utf-8"
-)
-stdout_handler = logging.StreamHandler(sys.stdout)
-sdebug_handler = logging.FileHandler(
-    os.path.join("logs", "sdebug-{:}.log".format(datetime_str)), encoding="utf-8"
-)
+    formatter = logging.Formatter(
+        fmt="\x1b[1;33m[%(asctime)s \x1b[31m%(levelname)s \x1b[32m%(module)s/%(lineno)d-%(processName)s\x1b[1;33m] \x1b[0m%(message)s"
+    )
+    file_handler.setFormatter(formatter)
+    debug_handler.setFormatter(formatter)
+    stdout_handler.setFormatter(formatter)
+    sdebug_handler.setFormatter(formatter)
 
-file_handler.setLevel(logging.INFO)
-debug_handler.setLevel(logging.DEBUG)
-stdout_handler.setLevel(logging.INFO)
-sdebug_handler.setLevel(logging.DEBUG)
+    stdout_handler.addFilter(logging.Filter("desktopenv"))
+    sdebug_handler.addFilter(logging.Filter("desktopenv"))
 
-formatter = logging.Formatter(
-    fmt="\x1b[1;33m[%(asctime)s \x1b[31m%(levelname)s \x1b[32m%(module)s/%(lineno)d-%(processName)s\x1b[1;33m] \x1b[0m%(message)s"
-)
-file_handler.setFormatter(formatter)
-debug_handler.setFormatter(formatter)
-stdout_handler.setFormatter(formatter)
-sdebug_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    logger.addHandler(debug_handler)
+    logger.addHandler(stdout_handler)
+    logger.addHandler(sdebug_handler)
 
-stdout_handler.addFilter(logging.Filter("desktopenv"))
-sdebug_handler.addFilter(logging.Filter("desktopenv"))
 
-logger.addHandler(file_handler)
-logger.addHandler(debug_handler)
-logger.addHandler(stdout_handler)
-logger.addHandler(sdebug_handler)
+def preload_agent():
+    '''Import the agent (OpenAI client, grounding, PyObjC or AT-SPI) in the background while the user types the query'''
+    thread = threading.Thread(target=importlib.import_module, args=("agent.UIAgent",), daemon=True)
+    thread.start()
+    return thread
 
 platform_os = platform.system() 
 
 def main():
+    setup_logging()
+    preload_agent()
     # Examples.
     while True:
         query = input("Query: ")
+        from agent.UIAgent import IDBasedGroundingUIAgent
         engine_params = {
             "engine_type": "openai",
             "model": "gpt-4o",
@@ -91,7 +81,10 @@ def main():
             enable_reflection=True,
         )
         agent.reset()
-        agent.run(instruction=query)
+        try:
+            agent.run(instruction=query)
+        finally:
+            agent.close()
         
         # Ask user if they want to provide another query
         response = input("Would you like to provide another query? (y/n): ")
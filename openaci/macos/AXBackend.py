@@ -0,0 +1,121 @@
+import threading
+
+from ApplicationServices import (
+    AXObserverAddNotification,
+    AXObserverCreate,
+    AXObserverGetRunLoopSource,
+    AXUIElementCopyAttributeNames,
+    AXUIElementCopyAttributeValue,
+    AXUIElementCopyMultipleAttributeValues,
+    AXUIElementCreateApplication,
+    AXUIElementCreateSystemWide,
+    AXUIElementGetPid,
+    AXUIElementPerformAction,
+    AXValueGetType,
+    AXValueGetValue,
+    CFEqual,
+    kAXValueAXErrorType,
+    kAXValueCGPointType,
+    kAXValueCGRectType,
+    kAXValueCGSizeType,
+)
+from CoreFoundation import (
+    CFRunLoopAddSource,
+    CFRunLoopGetCurrent,
+    CFRunLoopRun,
+    CFRunLoopStop,
+    kCFRunLoopDefaultMode,
+)
+
+
+class AXObserverThread(threading.Thread):
+    '''AXObserver of one app, delivering notifications from its own run loop thread.
+    failed is set when the observer could not be created, e.g. without accessibility permission.'''
+    def __init__(self, pid, ref, notifications, callback):
+        super().__init__(daemon=True, name=f"ax-observer-{pid}")
+        self.pid = pid
+        self.ref = ref
+        self.notifications = notifications
+        self.callback = callback
+        self.run_loop = None
+        self.failed = False
+        self.ready = threading.Event()
+        self.start()
+        self.ready.wait(1.)
+
+    def on_notification(self, observer, element, notification, refcon):
+        self.callback(str(notification), element)
+
+    def run(self):
+        error, self.observer = AXObserverCreate(self.pid, self.on_notification, None)
+        if error:
+            self.failed = True
+            self.ready.set()
+            return
+        for notification in self.notifications:
+            AXObserverAddNotification(self.observer, self.ref, notification, None)
+        self.run_loop = CFRunLoopGetCurrent()
+        CFRunLoopAddSource(self.run_loop, AXObserverGetRunLoopSource(self.observer), kCFRunLoopDefaultMode)
+        self.ready.set()
+        CFRunLoopRun()
+
+    def close(self):
+        if self.run_loop is not None:
+            CFRunLoopStop(self.run_loop)
+
+
+class NativeAXBackend:
+    '''Accessibility API of macOS through pyobjc, every call is one IPC round trip to the target app'''
+
+    def copy_attribute_names(self, ref):
+        error, names = AXUIElementCopyAttributeNames(ref, None)
+        return list(names) if names else []
+
+    def copy_attribute_value(self, ref, key):
+        error, value = AXUIElementCopyAttributeValue(ref, key, None)
+        return value
+
+    def copy_multiple_attribute_values(self, ref, keys):
+        '''Values of several attributes in one round trip, None for the ones the element lacks'''
+        error, values = AXUIElementCopyMultipleAttributeValues(ref, keys, 0, None)
+        if error or values is None:
+            return [None] * len(keys)
+        return [self.decode(value) for value in values]
+
+    def decode(self, value):
+        '''Unpack AXValue points, sizes and rects into tuples, missing attributes come back as AXError values'''
+        if type(value).__name__ != 'AXValueRef':
+            return value
+        value_type = AXValueGetType(value)
+        if value_type == kAXValueAXErrorType:
+            return None
+        if value_type == kAXValueCGPointType:
+            ok, point = AXValueGetValue(value, value_type, None)
+            return (point.x, point.y) if ok else None
+        if value_type == kAXValueCGSizeType:
+            ok, size = AXValueGetValue(value, value_type, None)
+            return (size.width, size.height) if ok else None
+        if value_type == kAXValueCGRectType:
+            ok, rect = AXValueGetValue(value, value_type, None)
+            return (rect.origin.x, rect.origin.y, rect.size.width, rect.size.height) if ok else None
+        return value
+
+    def perform_action(self, ref, action):
+        AXUIElementPerformAction(ref, action)
+
+    def equal(self, ref, other):
+        return CFEqual(ref, other)
+
+    def pid(self, ref):
+        error, pid = AXUIElementGetPid(ref, None)
+        return pid
+
+    def observe(self, pid, ref, notifications, callback):
+        '''Call callback(notification, element ref) for the notifications of the app below ref, returns a handle with close()'''
+        return AXObserverThread(pid, ref, notifications, callback)
+
+    def system_wide(self):
+        return AXUIElementCreateSystemWide()
+
+    def application(self, pid):
+        return AXUIElementCreateApplication(pid)
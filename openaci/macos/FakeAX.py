@@ -0,0 +1,275 @@
+"""In-memory stand-in for the macOS accessibility API, to run and benchmark tree traversal anywhere.
+
+    python -m openaci.macos.FakeAX --depth 6 --branching 4 --latency 0.00005 --workers 8 --cache-turns 20
+"""
+import argparse
+import itertools
+import random
+import threading
+import time
+
+ROLES = ["AXButton", "AXStaticText", "AXGroup", "AXTextField", "AXImage", "AXCell", "AXRow", "AXLink", "AXScrollArea"]
+
+
+class FakeAXElement:
+    '''An element with a dict of attribute values, AXChildren holds the child elements'''
+    def __init__(self, attributes=None):
+        self.attributes = dict(attributes or {})
+
+    def __repr__(self):
+        return "FakeAXElement(%s)" % self.attributes.get('AXRole')
+
+
+# Notification posted when an attribute is changed through FakeAXBackend.set_attribute
+CHANGE_NOTIFICATIONS = {'AXValue': 'AXValueChanged', 'AXTitle': 'AXTitleChanged', 'AXPosition': 'AXMoved', 'AXSize': 'AXResized'}
+
+
+class FakeAXObserver:
+    '''Registration of FakeAXBackend.observe, notifications are delivered synchronously by the changing call'''
+    failed = False
+
+    def __init__(self, backend, pid, notifications, callback):
+        self.backend = backend
+        self.pid = pid
+        self.notifications = set(notifications)
+        self.callback = callback
+
+    def close(self):
+        if self in self.backend.observers:
+            self.backend.observers.remove(self)
+
+
+class FakeAXBackend:
+    '''Serves attributes of FakeAXElements and counts the simulated IPC round trips.
+
+    Args:
+        latency: seconds each round trip takes, the real API costs tens of microseconds to milliseconds
+        batch: if False, multiple attribute fetches fall back to one round trip per attribute
+        root: element returned for the system-wide element
+    '''
+    def __init__(self, latency=0., batch=True, root=None):
+        self.latency = latency
+        self.batch = batch
+        self.root = root
+        self.applications = {}
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.observers = []
+
+    def round_trip(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def copy_attribute_names(self, ref):
+        self.round_trip()
+        return list(ref.attributes)
+
+    def copy_attribute_value(self, ref, key):
+        self.round_trip()
+        return ref.attributes.get(key)
+
+    def copy_multiple_attribute_values(self, ref, keys):
+        if not self.batch:
+            return [self.copy_attribute_value(ref, key) for key in keys]
+        self.round_trip()
+        return [ref.attributes.get(key) for key in keys]
+
+    def decode(self, value):
+        return value
+
+    def perform_action(self, ref, action):
+        self.round_trip()
+        ref.attributes.setdefault('performed_actions', []).append(action)
+
+    def equal(self, ref, other):
+        return ref is other
+
+    def pid(self, ref):
+        return ref.attributes.get('pid', 0)
+
+    def observe(self, pid, ref, notifications, callback):
+        observer = FakeAXObserver(self, pid, notifications, callback)
+        self.observers.append(observer)
+        return observer
+
+    def notify(self, element, notification):
+        for observer in list(self.observers):
+            if notification in observer.notifications:
+                observer.callback(notification, element)
+
+    # Changes made by the app, posting the notifications macOS would
+
+    def set_attribute(self, element, key, value):
+        element.attributes[key] = value
+        if key in CHANGE_NOTIFICATIONS:
+            self.notify(element, CHANGE_NOTIFICATIONS[key])
+
+    def move(self, element, dx, dy):
+        '''Move an element with everything inside it, only the element posts AXMoved'''
+        stack = [element]
+        while stack:
+            current = stack.pop()
+            x, y = current.attributes['AXPosition']
+            current.attributes['AXPosition'] = (x + dx, y + dy)
+            stack.extend(current.attributes['AXChildren'])
+        self.notify(element, 'AXMoved')
+
+    def scroll(self, area, dy):
+        '''Scroll the contents of a scroll area, only its scroll bar posts AXValueChanged, as on macOS'''
+        bars = [child for child in area.attributes['AXChildren'] if child.attributes['AXRole'] == "AXScrollBar"]
+        stack = [child for child in area.attributes['AXChildren'] if child not in bars]
+        while stack:
+            current = stack.pop()
+            x, y = current.attributes['AXPosition']
+            current.attributes['AXPosition'] = (x, y + dy)
+            stack.extend(current.attributes['AXChildren'])
+        for bar in bars:
+            self.set_attribute(bar, 'AXValue', bar.attributes['AXValue'] - dy)
+
+    def add_child(self, parent, child):
+        child.attributes['AXParent'] = parent
+        parent.attributes['AXChildren'] = parent.attributes['AXChildren'] + [child]
+        self.notify(child, 'AXCreated')
+
+    def remove_child(self, parent, child):
+        parent.attributes['AXChildren'] = [other for other in parent.attributes['AXChildren'] if other is not child]
+        self.notify(child, 'AXUIElementDestroyed')
+
+    def system_wide(self):
+        return self.root
+
+    def application(self, pid):
+        return self.applications.get(pid)
+
+
+def build_fake_tree(depth=5, branching=4, seed=0):
+    '''Random application tree of branching**depth leaves, returns (system-wide element, application)'''
+    rng = random.Random(seed)
+    counter = itertools.count()
+
+    def build(level):
+        index = next(counter)
+        role = "AXWindow" if level == 1 else rng.choice(ROLES)
+        element = FakeAXElement({
+            'AXRole': role,
+            'AXTitle': f"{role[2:]} {index}" if rng.random() < 0.5 else None,
+            'AXDescription': f"description {index}" if rng.random() < 0.3 else "",
+            'AXValue': f"value {index}" if role == "AXTextField" else None,
+            'AXPosition': (float(rng.randrange(0, 1400)), float(rng.randrange(0, 850))),
+            'AXSize': (float(rng.randrange(1, 300)), float(rng.randrange(1, 60))),
+        })
+        element.attributes['AXChildren'] = [build(level + 1) for _ in range(branching)] if level < depth else []
+        if role == "AXScrollArea":
+            x, y = element.attributes['AXPosition']
+            element.attributes['AXChildren'].append(FakeAXElement({
+                'AXRole': "AXScrollBar", 'AXTitle': None, 'AXDescription': "", 'AXValue': 0.,
+                'AXPosition': (x, y), 'AXSize': (15., 300.), 'AXChildren': []}))
+        for child in element.attributes['AXChildren']:
+            child.attributes['AXParent'] = element
+        return element
+
+    application = build(0)
+    application.attributes['AXRole'] = "AXApplication"
+    system_wide = FakeAXElement({'AXRole': "AXSystemWide", 'AXFocusedApplication': application})
+    return system_wide, application
+
+
+def random_change(backend, application, rng):
+    '''Apply one change an app might make between two turns'''
+    elements = []
+    stack = [application]
+    while stack:
+        element = stack.pop()
+        elements.append(element)
+        stack.extend(element.attributes['AXChildren'])
+    # Scroll bars only change by scrolling, their value is a number
+    element = rng.choice([element for element in elements[1:] if element.attributes['AXRole'] != "AXScrollBar"])
+    # Added scroll areas have no scroll bar, nothing would tell that their contents scrolled
+    areas = [element for element in elements if element.attributes['AXRole'] == "AXScrollArea" and
+             any(child.attributes['AXRole'] == "AXScrollBar" for child in element.attributes['AXChildren'])]
+    kind = rng.choice(['value', 'title', 'move', 'add', 'remove'] + (['scroll'] if areas else []))
+    if kind == 'value':
+        backend.set_attribute(element, 'AXValue', f"value {rng.random():.6f}")
+    elif kind == 'title':
+        backend.set_attribute(element, 'AXTitle', f"title {rng.random():.6f}")
+    elif kind == 'move':
+        backend.move(element, rng.randrange(-20, 20), rng.randrange(-20, 20))
+    elif kind == 'add':
+        child = FakeAXElement({'AXRole': rng.choice(ROLES), 'AXTitle': "new", 'AXDescription': "", 'AXValue': None,
+                               'AXPosition': (float(rng.randrange(0, 1400)), float(rng.randrange(0, 850))),
+                               'AXSize': (float(rng.randrange(1, 300)), float(rng.randrange(1, 60))), 'AXChildren': []})
+        backend.add_child(element, child)
+    elif kind == 'remove':
+        backend.remove_child(element.attributes['AXParent'], element)
+    else:
+        backend.scroll(rng.choice(areas), rng.randrange(-200, 200))
+
+
+def benchmark_cache(args, system_wide, application, exclude_roles):
+    '''Full reads against an EventTreeCache while the app changes, checking both see the same tree'''
+    from openaci.agent.TreeTraversal import ParallelTraversal
+    from openaci.macos.UIElement import EventTreeCache, UIElement, collect_nodes, use_backend
+
+    backend = FakeAXBackend(latency=args.latency, root=system_wide)
+    use_backend(backend)
+    traversal = ParallelTraversal(args.workers, args.per_app_limit)
+    cache = EventTreeCache(exclude_roles, traversal=traversal, full_read_every=None)
+    rng = random.Random(1)
+    full_time = cached_time = 0.
+    full_calls = cached_calls = 0
+    for turn in range(args.cache_turns):
+        if turn:
+            for _ in range(args.changes):
+                random_change(backend, application, rng)
+        calls, start = backend.calls, time.perf_counter()
+        full, _ = collect_nodes(UIElement(application), exclude_roles, traversal=traversal)
+        full_time += time.perf_counter() - start
+        full_calls += backend.calls - calls
+
+        calls, start = backend.calls, time.perf_counter()
+        cached, _ = collect_nodes(UIElement(application), exclude_roles, traversal=traversal, cache=cache)
+        cached_time += time.perf_counter() - start
+        cached_calls += backend.calls - calls
+        assert list(full.rows()) == list(cached.rows()) and (full.boxes() == cached.boxes()).all(), \
+            f"cached tree differs from a full read at turn {turn}"
+    cache.close()
+    turns = args.cache_turns
+    print(f"tree cache, {args.changes} changes per turn: full read {full_time / turns * 1000:.1f} ms and "
+          f"{full_calls // turns} round trips per turn, cached {cached_time / turns * 1000:.1f} ms and "
+          f"{cached_calls // turns} round trips per turn ({cache.stats['full_reads']} full reads), same tree every turn")
+
+
+def main():
+    from openaci.agent.TreeTraversal import ParallelTraversal
+    from openaci.macos.UIElement import UIElement, collect_nodes, use_backend
+
+    parser = argparse.ArgumentParser(description="Benchmark accessibility tree traversal on a fake tree")
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--branching", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.00005, help="seconds per simulated IPC round trip")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--per-app-limit", type=int, default=4)
+    parser.add_argument("--cache-turns", type=int, default=0, help="turns of the tree cache benchmark, 0 skips it")
+    parser.add_argument("--changes", type=int, default=5, help="app changes between two turns")
+    args = parser.parse_args()
+
+    system_wide, application = build_fake_tree(args.depth, args.branching)
+    exclude_roles = ["AXGroup", "AXLayoutArea", "AXLayoutItem", "AXUnknown"]
+    runs = [("per attribute", False, 1), ("batched", True, 1), (f"batched, {args.workers} workers", True, args.workers)]
+    for name, batch, workers in runs:
+        backend = FakeAXBackend(latency=args.latency, batch=batch, root=system_wide)
+        use_backend(backend)
+        traversal = ParallelTraversal(workers, args.per_app_limit)
+        start = time.perf_counter()
+        nodes, _ = collect_nodes(UIElement(application), exclude_roles, traversal=traversal)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {len(nodes)} nodes, {backend.calls} round trips, {elapsed:.3f}s")
+
+    if args.cache_turns:
+        benchmark_cache(args, system_wide, application, exclude_roles)
+
+
+if __name__ == "__main__":
+    main()
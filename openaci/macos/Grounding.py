@@ -1,27 +1,34 @@
 from typing import Dict, List, Tuple
-import os 
 import subprocess
 import logging
 logger = logging.getLogger("openaci.agent")
-import difflib
-from Foundation import *
-from AppKit import *
-import torchvision 
-import torch 
-import base64 
-import requests
 import xml.etree.ElementTree as ET
 from xml.etree.ElementTree import Element
 from typing import Dict, List, Tuple
-import os
 import subprocess
 import logging
 logger = logging.getLogger("openaci.agent")
-import difflib
 
 
-from openaci.macos.UIElement import UIElement
-from openaci.macos.system import open_running_app
+from openaci.macos.UIElement import UIElement, EventTreeCache, collect_nodes
+from openaci.agent.BoxMerge import new_ocr_boxes
+from openaci.agent.SpatialIndex import SpatialIndex
+from openaci.agent.OcrClient import default_client
+from openaci.agent.OcrTileCache import TileOcrCache
+from openaci.agent.AppCatalog import AppCatalog, parse_info_plist
+
+# OCR results of unchanged screen tiles are reused across turns
+default_ocr_client = TileOcrCache(default_client)
+
+# Roles left out of the linearized tree
+EXCLUDE_ROLES = ["AXGroup", "AXLayoutArea", "AXLayoutItem", "AXUnknown"]
+
+# Tree of the focused app kept across turns, for agents created with tree_cache=default_tree_cache
+default_tree_cache = EventTreeCache(EXCLUDE_ROLES)
+
+# Directories to search for applications in MacOS, listed again only when they change
+default_app_catalog = AppCatalog(["/System/Applications", "/Applications"], ".app", parse_info_plist)
+
 
 from AppKit import NSWorkspace, NSRunningApplication
 
@@ -31,34 +38,28 @@ def agent_action(func):
     func.is_agent_action = True
     return func
 
-def list_apps_in_directories(directories):
-    apps = []
-    for directory in directories:
-        if os.path.exists(directory):
-            directory_apps = [app for app in os.listdir(directory) if app.endswith(".app")]
-            apps.extend(directory_apps)
-    return apps
-
 class GroundingAgent:
-    def __init__(self, top_app=None, top_app_only=True, ocr=True):
+    def __init__(self, top_app=None, top_app_only=True, ocr=True, ocr_client=None, tree_cache=None, app_catalog=None):
         self.active_apps = set()
         self.top_app = top_app
         self.top_app_only = (
             top_app_only  # Only include top app in the accessibility tree
         )
         self.ocr = ocr
+        self.ocr_client = ocr_client or default_ocr_client
+        # EventTreeCache kept by the caller across turns, None reads the whole tree every time
+        self.tree_cache = tree_cache
         self.index_out_of_range_flag = False
         self.clipboard = ""
         self.top_active_app = None
         self.notes = []
         self.clipboard = ""
+        # Index of the focused element (or the first node after it) in self.nodes
+        self.focused_element_id = None
+        self.index = None
 
-        # Directories to search for applications in MacOS
-        directories_to_search = [
-            "/System/Applications",
-            "/Applications"
-        ]
-        self.all_apps = list_apps_in_directories(directories_to_search)
+        self.app_catalog = app_catalog or default_app_catalog
+        self.all_apps = self.app_catalog.names
 
         # self.nodes, self.linearized_accessibility_tree = self.linearize_and_annotate_tree(
         #     self.input_tree, self.screenshot)
@@ -80,100 +81,32 @@ class GroundingAgent:
         
         return current_apps
                 
-    def preserve_nodes(self, tree, exclude_roles=None):
+    def preserve_nodes(self, tree, exclude_roles=None, focused_ref=None):
         if exclude_roles is None:
             exclude_roles = set()
-        
-        preserved_nodes = []
-
-        # Inner function to recursively traverse the accessibility tree
-        def traverse_and_preserve(element):
-            role = element.attribute('AXRole')
-
-            if role not in exclude_roles:
-                # TODO: get coordinate values directly from interface
-                position = element.attribute('AXPosition')
-                size = element.attribute('AXSize')
-                if position and size:
-                        pos_parts = position.__repr__().split().copy()
-                        # Find the parts containing 'x:' and 'y:'
-                        x_part = next(part for part in pos_parts if part.startswith('x:'))
-                        y_part = next(part for part in pos_parts if part.startswith('y:'))
-                        
-                        # Extract the numerical values after 'x:' and 'y:'
-                        x = float(x_part.split(':')[1])
-                        y = float(y_part.split(':')[1])
-
-                        size_parts = size.__repr__().split().copy()
-                        # Find the parts containing 'Width:' and 'Height:'
-                        width_part = next(part for part in size_parts if part.startswith('w:'))
-                        height_part = next(part for part in size_parts if part.startswith('h:'))
-
-                        # Extract the numerical values after 'Width:' and 'Height:'
-                        w = float(width_part.split(':')[1])
-                        h = float(height_part.split(':')[1])
-        
-                        if x >= 0 and y >= 0 and w > 0 and h > 0:
-                            preserved_nodes.append({'position': (x, y), 
-                                                    'size' : (w, h), 
-                                                    'title': str(element.attribute('AXTitle')), 
-                                                    'text': str(element.attribute('AXDescription')) or str(element.attribute('AXValue')),
-                                                    'role': str(element.attribute('AXRole'))})
-            
-            children = element.children()
-            if children:
-                for child_ref in children:
-                    child_element = UIElement(child_ref)
-                    traverse_and_preserve(child_element)
-
-        # Start traversing from the given element
-        traverse_and_preserve(tree)
 
+        # One round trip per node for all the attributes it needs, see collect_nodes
+        preserved_nodes, focus_index = collect_nodes(tree, exclude_roles, focused_ref, cache=self.tree_cache)
+        if self.focused_element_id is None:
+            self.focused_element_id = focus_index
         return preserved_nodes
-    
+
     def extract_elements_from_screenshot(self, screenshot) -> Dict:
         """Uses paddle-ocr to extract elements with text from the screenshot. The elements will be added to the linearized accessibility tree downstream"""
-
-        # Convert screenshot to PIL image
-        def send_image_to_ocr(screenshot) -> Dict:
-
-            url = os.environ.get("OCR_SERVER_ADDRESS", "")
-            if url == "":
-                raise Exception("OCR SERVER ADDRESS NOT SET")
-            encoded_screenshot = base64.b64encode(screenshot).decode("utf-8")
-            data = {"img_bytes": encoded_screenshot}
-            response = requests.post(url, json=data)
-
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {
-                    "error": f"Request failed with status code {response.status_code}",
-                    "results": [],
-                }
-
-        return send_image_to_ocr(screenshot)["results"]
+        return self.ocr_client.recognize(screenshot)
 
     def add_ocr_elements(
-        self, screenshot, linearized_accessibility_tree, preserved_nodes
+        self, screenshot, linearized_accessibility_tree, preserved_nodes, ocr_future=None
     ):
         # Get the bounding boxes of the elements in the linearized accessibility tree
-        tree_bboxes = []
-        for node in preserved_nodes:
-            coordinates: Tuple[int, int] = node['position']
-            sizes: Tuple[int, int] = node['size']
-            tree_bboxes.append(
-                [
-                    coordinates[0],
-                    coordinates[1],
-                    coordinates[0] + sizes[0],
-                    coordinates[1] + sizes[1],
-                ]
-            )
+        tree_bboxes = preserved_nodes.boxes()
 
         # Use OCR to found boxes that might be missing from the accessibility tree
         try:
-            ocr_bboxes = self.extract_elements_from_screenshot(screenshot)
+            if ocr_future is not None:
+                ocr_bboxes = ocr_future.result()
+            else:
+                ocr_bboxes = self.extract_elements_from_screenshot(screenshot)
         except Exception as e:
             print(f"Error: {e}")
             ocr_bboxes = []
@@ -183,28 +116,21 @@ class GroundingAgent:
                 len(ocr_bboxes) > 0
             ):  # Only check IOUs and add if there are any bounding boxes returned by the ocr module
                 preserved_nodes_index = len(preserved_nodes)
-                for ind, (i, content, box) in enumerate(ocr_bboxes):
-                    # x1, y1, x2, y2 = int(box.get('left', 0)), int(box['top']), int(), int(box['bottom'])
+                ocr_nodes = []
+                boxes = [
                     (
-                        x1,
-                        y1,
-                        x2,
-                        y2,
-                    ) = (
                         int(box.get("left", 0)),
                         int(box.get("top", 0)),
                         int(box.get("right", 0)),
                         int(box.get("bottom", 0)),
                     )
-                    iou = (
-                        torchvision.ops.box_iou(
-                            torch.tensor(tree_bboxes), torch.tensor([[x1, y1, x2, y2]])
-                        )
-                        .numpy()
-                        .flatten()
-                    )
-
-                    if max(iou) < 0.1:
+                    for _, _, box in ocr_bboxes
+                ]
+                # IoU of every OCR box against the tree boxes around it
+                is_new = new_ocr_boxes(tree_bboxes, boxes, iou_threshold=0.1,
+                                       index=self.spatial_index(preserved_nodes))
+                for (i, content, _), (x1, y1, x2, y2), new in zip(ocr_bboxes, boxes, is_new):
+                    if new:
                         # Add the element to the linearized accessibility tree
                         # TODO: ocr detected elements should be classified for their tag, currently set to push button for the agent to think they are interactable
                         linearized_accessibility_tree.append(
@@ -212,34 +138,30 @@ class GroundingAgent:
                         )
 
                         # add to preserved node with the component_ns prefix node.get("{{{:}}}screencoord".format(component_ns), "(-1, -1)"
-                        node = {'position': (x1, y1), 
-                                'size' : (x2 - x1, y2 - y1), 
-                                'title': "", 
-                                'text': content,
-                                'role': "AXButton"}
-                        
-                        preserved_nodes.append(node)
+                        ocr_nodes.append((x1, y1, x2 - x1, y2 - y1, "AXButton", "", content))
                         preserved_nodes_index += 1
 
+                preserved_nodes = preserved_nodes.extend(ocr_nodes)
+
         return linearized_accessibility_tree, preserved_nodes
 
     # TODO: chunk and shorten this function
     def linearize_and_annotate_tree(self, obs, show_all=False):
         accessibility_tree = obs['accessibility_tree']
         screenshot = obs['screenshot']  
+        # OCR runs on the service while the accessibility tree is read
+        ocr_future = self.ocr_client.submit(screenshot) if self.ocr else None
         self.top_app = NSWorkspace.sharedWorkspace().frontmostApplication().localizedName()
         tree = (UIElement(accessibility_tree.attribute('AXFocusedApplication')))
-        exclude_roles = ["AXGroup", "AXLayoutArea", "AXLayoutItem", "AXUnknown"]
-        preserved_nodes = self.preserve_nodes(tree, exclude_roles).copy()
+        exclude_roles = EXCLUDE_ROLES
+        focused_ref = accessibility_tree.attribute('AXFocusedUIElement')
+        preserved_nodes = self.preserve_nodes(tree, exclude_roles, focused_ref)
         
         
         linearized_accessibility_tree = [
             "id\trole\ttitle\ttext"]
 
-        for idx, node in enumerate(preserved_nodes):
-            title = node['title']
-            text = node['text']
-            role = node['role']
+        for idx, (role, title, text) in enumerate(preserved_nodes.rows()):
             linearized_accessibility_tree.append(
                 "{:}\t{:}\t{:}\t{:}".format(
                     idx,
@@ -252,9 +174,10 @@ class GroundingAgent:
          # Add OCR elements to the linearized accessibility tree to account for elements that are not in the accessibility tree
         if self.ocr:
             linearized_accessibility_tree, preserved_nodes = self.add_ocr_elements(
-                screenshot, linearized_accessibility_tree, preserved_nodes
+                screenshot, linearized_accessibility_tree, preserved_nodes, ocr_future
             )
-        self.nodes = preserved_nodes.copy()
+        # One NodeTable shared by linearization, OCR merging and the actions
+        self.nodes = preserved_nodes
             
         # Convert to string
         linearized_accessibility_tree = "\n".join(
@@ -262,12 +185,32 @@ class GroundingAgent:
         
         return linearized_accessibility_tree
 
+    @classmethod
+    def from_snapshot(cls, observation, **kwargs):
+        '''Grounding agent over a recorded observation (see agent.Snapshot), the accessibility tree is not read'''
+        agent = cls(top_app=observation.meta.get('top_app'), ocr=False, **kwargs)
+        agent.nodes = observation.nodes
+        agent.linearized_accessibility_tree = observation.linearized_accessibility_tree
+        agent.focused_element_id = observation.focused_element_id
+        return agent
+
+    def spatial_index(self, nodes=None):
+        '''SpatialIndex over the boxes of nodes (default self.nodes), rebuilt when the nodes change'''
+        nodes = self.nodes if nodes is None else nodes
+        if self.index is None or self.index_nodes is not nodes:
+            self.index = SpatialIndex(nodes.boxes(), nodes.valid)
+            self.index_nodes = nodes
+        return self.index
+
     def find_element(self, element_id):
         try:
             selected_element = self.nodes[int(element_id)]
+            # With tree deltas, ids of elements that left the screen are empty
+            if selected_element is None:
+                raise IndexError(element_id)
         except:
             print("The index of the selected element was out of range.")
-            selected_element = self.nodes[0]
+            selected_element = next(node for node in self.nodes if node is not None)
             self.index_out_of_range_flag = True 
         return selected_element
 
@@ -285,9 +228,12 @@ class GroundingAgent:
             Args:
                 app_name:str, the name of the application to open from the list of available applications in the system: AVAILABLE_APPS
         '''
+        from openaci.macos.system import open_running_app
+
         # fuzzy match the app name
-        closest_matches = difflib.get_close_matches(app_name + ".app", self.all_apps, n=1, cutoff=0.6) 
-        if app_name in self.all_apps:
+        closest_match = self.app_catalog.match(app_name)
+        if closest_match is not None:
+            app_name = closest_match.name[:-len(".app")]
             print(f"{app_name} has been opened successfully.")
             return f"""import subprocess; subprocess.run(["open", "-a", "{app_name}"], check=True)"""
         elif open_running_app(app_name):
@@ -1,50 +1,174 @@
 import json
-from Foundation import *
-from AppKit import *
-
-from ApplicationServices import (
-    AXIsProcessTrusted,
-    AXUIElementCreateApplication,
-    AXUIElementCreateSystemWide,
-    AXUIElementPerformAction,
-    CFEqual,
-)
-
-from ApplicationServices import (
-    AXUIElementCopyAttributeNames,
-    AXUIElementCopyAttributeValue,
-)
+
+try:
+    from openaci.macos.AXBackend import NativeAXBackend
+except ImportError:  # no pyobjc, install another backend with use_backend, e.g. FakeAXBackend
+    NativeAXBackend = None
+
+from openaci.agent.NodeTable import NodeTable
+from openaci.agent.TreeTraversal import ParallelTraversal
+from openaci.agent.TreeCache import TreeCache
 
 import logging
 logger = logging.getLogger("openaci.agent")
 
+# Attributes read for every node when linearizing the tree, fetched in one round trip
+NODE_ATTRIBUTES = ['AXRole', 'AXPosition', 'AXSize', 'AXTitle', 'AXDescription', 'AXValue', 'AXChildren']
+
+
 class UIElement(object):
+    # Where attribute values come from, see AXBackend and FakeAX
+    backend = NativeAXBackend() if NativeAXBackend is not None else None
 
     def __init__(self, ref=None):
         self.ref = ref
 
     def getAttributeNames(self):
-        error_code, attributeNames = AXUIElementCopyAttributeNames(
-            self.ref, None)
-        return list(attributeNames)
+        return self.backend.copy_attribute_names(self.ref)
 
     def attribute(self, key: str):
-        error, value = AXUIElementCopyAttributeValue(self.ref, key, None)
-        return value
+        return self.backend.copy_attribute_value(self.ref, key)
+
+    def attributes(self, keys):
+        '''Values of several attributes in one round trip, as a dict.
+        Points, sizes and rects are tuples, attributes the element lacks are None.'''
+        keys = list(keys)
+        return dict(zip(keys, self.backend.copy_multiple_attribute_values(self.ref, keys)))
 
     def children(self):
         return self.attribute('AXChildren')
 
     def performAction(self, action):
-        AXUIElementPerformAction(self.ref, action)
+        self.backend.perform_action(self.ref, action)
+
+    def equals(self, ref):
+        return self.backend.equal(self.ref, ref)
+
+    def pid(self):
+        return self.backend.pid(self.ref)
 
     def systemWideElement():
-        ref = AXUIElementCreateSystemWide()
+        ref = UIElement.backend.system_wide()
         return UIElement(ref)
 
     def __repr__(self):
         return "UIElement%s" % (self.ref)
 
+
+def use_backend(backend):
+    '''Serve every UIElement from backend'''
+    UIElement.backend = backend
+
+
+# AX requests are answered by the target app, a few concurrent readers per app keep it responsive
+default_traversal = ParallelTraversal(max_workers=8, per_app_limit=4)
+
+
+def read_node(element, exclude_roles=()):
+    '''(x, y, w, h, role, title, text) of a visible element or None, and its children, in one round trip'''
+    values = element.attributes(NODE_ATTRIBUTES)
+    node = None
+    role = values['AXRole']
+    if role not in exclude_roles:
+        position = values['AXPosition']
+        size = values['AXSize']
+        if position and size:
+            x, y = position
+            w, h = size
+            if x >= 0 and y >= 0 and w > 0 and h > 0:
+                node = (x, y, w, h, str(role), str(values['AXTitle']),
+                        str(values['AXDescription']) or str(values['AXValue']))
+    return node, [UIElement(child_ref) for child_ref in values['AXChildren'] or []]
+
+
+def collect_nodes(element, exclude_roles=(), focused_ref=None, traversal=None, cache=None):
+    '''NodeTable of the visible nodes below element in pre-order, and the index of the focused one (or the first node after it).
+    Subtrees are read in parallel by traversal, default_traversal if None. With an EventTreeCache only the
+    parts of the tree changed since the last call are read, with the exclude_roles of the cache.'''
+    traversal = traversal or default_traversal
+
+    if cache is not None:
+        cache.watch(element)
+        nodes = ((node, focused_ref is not None and element.backend.equal(ref, focused_ref))
+                 for ref, node in cache.read(element, app_key=element.pid()))
+    else:
+        def expand(element):
+            focused = focused_ref is not None and element.equals(focused_ref)
+            node, children = read_node(element, exclude_roles)
+            return (node, focused), children
+        nodes = traversal.traverse(element, expand, key=element.pid())
+
+    rows = []
+    focus_index = None
+    for node, focused in nodes:
+        if focused and focus_index is None:
+            focus_index = len(rows)
+        if node is not None:
+            rows.append(node)
+    return NodeTable.from_rows(rows), focus_index
+
+
+# AX notifications that change what read_node returns, and how much of the cached tree they invalidate
+AX_INVALIDATION = {
+    'AXCreated': 'parent',
+    'AXUIElementDestroyed': 'parent',
+    'AXValueChanged': 'node',
+    'AXTitleChanged': 'node',
+    'AXRowCountChanged': 'node',
+    'AXMoved': 'subtree',
+    'AXResized': 'subtree',
+    'AXLayoutChanged': 'subtree',
+}
+
+# Scrolling moves every element of a scroll area, but only its scroll bar posts a notification
+SCROLL_BAR_ROLES = {'AXScrollBar'}
+
+
+class EventTreeCache(TreeCache):
+    '''Tree of the focused app kept between turns, patched from the AXObserver notifications of that app.
+
+    Args:
+        exclude_roles: roles left out of the rows, as for collect_nodes
+        traversal: ParallelTraversal for new and invalidated subtrees, default_traversal if None
+        full_read_every: re-read the whole app after this many patched reads
+    '''
+    def __init__(self, exclude_roles=(), traversal=None, full_read_every=50):
+        super().__init__(lambda element: read_node(element, exclude_roles), lambda element: element.ref,
+                         AX_INVALIDATION, traversal or default_traversal, parent=self.parent_element,
+                         full_read_every=full_read_every)
+        self.observer = None
+        self.observed_pid = None
+
+    def invalidation_mode(self, event, element):
+        if event == 'AXValueChanged' and element.attribute('AXRole') in SCROLL_BAR_ROLES:
+            return 'parent_subtree'
+        return super().invalidation_mode(event, element)
+
+    @staticmethod
+    def parent_element(element):
+        parent_ref = element.attribute('AXParent')
+        return UIElement(parent_ref) if parent_ref is not None else None
+
+    def watch(self, element):
+        '''Follow the notifications of the app of element, switching apps starts from a full read'''
+        pid = element.pid()
+        if pid != self.observed_pid:
+            self.close()
+            self.observer = element.backend.observe(
+                pid, element.ref, list(AX_INVALIDATION), lambda notification, ref: self.on_event(notification, UIElement(ref)))
+            self.observed_pid = pid
+            self.invalidate()
+        elif self.observer is None or self.observer.failed:
+            # Without notifications the cache cannot know what changed
+            self.invalidate()
+
+    def close(self):
+        if self.observer is not None:
+            self.observer.close()
+        self.observer = None
+        self.observed_pid = None
+
+
 def traverse_tree(element, level=0, max_depth=10):
     """Traverse and print detailed information for each node in the accessibility tree
     Args:
@@ -65,9 +189,10 @@ def traverse_tree(element, level=0, max_depth=10):
         print(f"{indent}{'='*20}")
         
         # Print each available attribute and its value
+        values = element.attributes(attribute_names)
         for attr_name in attribute_names:
             try:
-                value = element.attribute(attr_name)
+                value = values[attr_name]
                 # Handle different types of values
                 if value is None:
                     continue
@@ -83,7 +208,7 @@ def traverse_tree(element, level=0, max_depth=10):
                 print(f"{indent}{attr_name}: Error getting value - {str(e)}")
         
         # Recursively process children
-        children = element.children()
+        children = values.get('AXChildren')
         if children:
             print(f"\n{indent}Children ({len(children)}):")
             for child_ref in children:
@@ -93,9 +218,11 @@ def traverse_tree(element, level=0, max_depth=10):
     except Exception as e:
         print(f"{indent}Error processing node at level {level}: {e}")
 
-from bs4 import BeautifulSoup
 import html
 
+# Attributes read for every element of a web area
+SOUP_ATTRIBUTES = ['AXRole', 'AXTitle', 'AXValue', 'AXDescription', 'AXURL', 'AXFrame', 'AXChildren']
+
 def accessibility_to_soup(element, level=0, max_depth=20):
     """Convert accessibility tree to HTML-like structure for BeautifulSoup parsing
     Args:
@@ -110,14 +237,14 @@ def accessibility_to_soup(element, level=0, max_depth=20):
         
     try:
         # Get element properties
-        role = element.attribute('AXRole') or 'unknown'
-        title = element.attribute('AXTitle')
-        value = element.attribute('AXValue')
-        description = element.attribute('AXDescription')
-        value = element.attribute('AXValue')
-        url_obj = element.attribute('AXURL')
+        values = element.attributes(SOUP_ATTRIBUTES)
+        role = values['AXRole'] or 'unknown'
+        title = values['AXTitle']
+        value = values['AXValue']
+        description = values['AXDescription']
+        url_obj = values['AXURL']
         url = url_obj.absoluteString() if url_obj else str(url_obj)
-        frame = element.attribute('AXFrame')
+        frame = values['AXFrame']
 
         # Convert role to HTML-friendly tag
         match role:
@@ -150,21 +277,12 @@ def accessibility_to_soup(element, level=0, max_depth=20):
             html_parts.append(f' description="{html.escape(str(description))}"')
 
         if frame:
-            # Convert AXValueRef (CGRect) to string and parse dimensions
-            frame_str = str(frame)
-            # Parse the frame string which looks like:
-            # {x:19.000000 y:168.000000 w:1441.000000 h:737.000000}
-            try:
-                import re
-                dimensions = re.findall(r'[xywh]:(\d+\.?\d*)', frame_str)
-                if len(dimensions) == 4:
-                    x, y, w, h = map(float, dimensions)
-                    html_parts.append(f' width="{w}"')
-                    html_parts.append(f' height="{h}"')
-                    # html_parts.append(f' x="{x}"')
-                    # html_parts.append(f' y="{y}"')
-            except:
-                pass
+            # (x, y, w, h)
+            x, y, w, h = frame
+            html_parts.append(f' width="{w}"')
+            html_parts.append(f' height="{h}"')
+            # html_parts.append(f' x="{x}"')
+            # html_parts.append(f' y="{y}"')
         if value:
             html_parts.append(f' value="{html.escape(str(value))}"')
             
@@ -175,7 +293,7 @@ def accessibility_to_soup(element, level=0, max_depth=20):
             html_parts.append(html.escape(value))
             
         # Process children
-        children = element.children()
+        children = values['AXChildren']
         if children:
             for child_ref in children:
                 if child_ref is not None:
@@ -242,7 +360,8 @@ def extract_page_content(web_area):
         url_obj = web_area.attribute('AXURL')
         url = url_obj.absoluteString() if url_obj else str(url_obj)
         
-        # Convert to soup for easier parsing
+        # Convert to soup for easier parsing, bs4 is only loaded when a page is read
+        from bs4 import BeautifulSoup
         html_structure = accessibility_to_soup(web_area)
         soup = BeautifulSoup(html_structure, 'html.parser')
         
@@ -362,7 +481,7 @@ def get_menu_items_from_app(app):
     """Get menu items from the accessibility tree of an app"""
     # Get the AXUIElement for Chrome
     pid = app.processIdentifier()
-    ax_app = AXUIElementCreateApplication(pid)
+    ax_app = UIElement.backend.application(pid)
     element = UIElement(ax_app)
     # traverse element to get menu items
     children = element.children()
@@ -386,7 +505,7 @@ def press_menu_item(app, name):
     """Press a menu item"""
     # Get the AXUIElement for Chrome
     pid = app.processIdentifier()
-    ax_app = AXUIElementCreateApplication(pid)
+    ax_app = UIElement.backend.application(pid)
     element = UIElement(ax_app)
     # traverse element to get menu items
     children = element.children()
@@ -438,7 +557,7 @@ def get_content_from_app(app):
     try:
         # Get the AXUIElement for Chrome
         pid = app.processIdentifier()
-        ax_app = AXUIElementCreateApplication(pid)
+        ax_app = UIElement.backend.application(pid)
         element = UIElement(ax_app)
         
         # Get the main window
@@ -1,2 +1,15 @@
-from .system import *
-from .web import *
\ No newline at end of file
+import importlib
+import platform
+
+# system loads the PyObjC frameworks, so the helpers of system and web are only imported on first use
+_LAZY_MODULES = ('system', 'web') if platform.system() == 'Darwin' else ('web',)
+
+
+def __getattr__(name):
+    if name in ('system', 'web') or name.startswith('__'):
+        raise AttributeError(name)
+    for module_name in _LAZY_MODULES:
+        module = importlib.import_module(f"{__name__}.{module_name}")
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
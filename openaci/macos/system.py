@@ -48,9 +48,10 @@ def open_running_app(app_name):
                 return "WAIT"
 
     # If not running, try to launch from installed apps
-    closest_installed = difflib.get_close_matches(app_name + ".app", self.all_apps, n=1, cutoff=0.6)
-    if closest_installed:
-        matched_app = closest_installed[0].replace(".app", "")
+    from openaci.macos.Grounding import default_app_catalog
+    closest_installed = default_app_catalog.match(app_name)
+    if closest_installed is not None:
+        matched_app = closest_installed.name[:-len(".app")]
         print(f"Opening application: {matched_app}")
         return f"""import subprocess; subprocess.run(["open", "-a", "{matched_app}"], check=True)"""
     
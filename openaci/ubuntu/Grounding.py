@@ -1,11 +1,9 @@
 import ctypes
-import os
 import platform
 import shlex
 import subprocess, signal
 from lxml.etree import _Element
 
-import pyatspi
 from typing import Any, Optional
 from typing import List, Dict, Tuple
 from pyatspi import Accessible, StateType, STATE_SHOWING
@@ -18,88 +16,84 @@ platform_name: str = platform.system()
 import logging
 logger = logging.getLogger("openaci.agent")
 
-from ubuntu.UIElement import UIElement
+from ubuntu.UIElement import EventTreeCache, read_node
+from agent.TreeTraversal import ParallelTraversal
+from agent.NodeTable import NodeTable
+from agent.SpatialIndex import SpatialIndex
+from agent.AppCatalog import AppCatalog, parse_desktop_file
 
 
-def list_apps_in_directories(directories):
-    apps = []
-    for directory in directories:
-        if os.path.exists(directory):
-            directory_apps = [app.replace('.desktop', '') for app in os.listdir(directory) if app.endswith(".desktop")]
-            apps.extend(directory_apps)
-    return apps
+# libatspi is not guaranteed to be thread safe, so trees are read sequentially unless a
+# GroundingAgent is given a ParallelTraversal with more workers
+default_traversal = ParallelTraversal(max_workers=1)
+
+# Roles left out of the linearized tree
+EXCLUDE_ROLES = ['panel', 'window', 'filler', 'separator']
+
+# Tree of the active app kept across turns, for agents created with tree_cache=default_tree_cache
+default_tree_cache = EventTreeCache(EXCLUDE_ROLES, traversal=default_traversal)
+
+# Desktop entries of the installed applications, listed again only when the directory changes
+default_app_catalog = AppCatalog(["/usr/share/applications/"], ".desktop", parse_desktop_file, strip_suffix=True)
+
 
 class GroundingAgent:
-    def __init__(self, obs, top_app=None):
-        self.input_tree = obs['accessibility_tree']
-        self.screenshot = obs['screenshot']
+    def __init__(self, obs, top_app=None, traversal=None, tree_cache=None, app_catalog=None):
+        self.input_tree = obs['accessibility_tree'] if obs is not None else None
+        self.screenshot = obs['screenshot'] if obs is not None else None
         self.active_apps = []
         self.top_app = top_app
 
         self.index_out_of_range_flag = False
         self.top_active_app = None
         self.execution_feedback = None
-
-        # Directories to search for applications in MacOS
-        directories_to_search = [
-            "/usr/share/applications/",
-        ]
-        self.all_apps = list_apps_in_directories(directories_to_search)
-
-        self.nodes, self.linearized_accessibility_tree = self.linearize_and_annotate_tree(
-            self.input_tree, self.screenshot)
+        # AT-SPI has no cheap system-wide focus query, rows are budgeted by role only
+        self.focused_element_id = None
+        self.traversal = traversal or default_traversal
+        # EventTreeCache kept by the caller across turns, None reads the whole tree every time
+        self.tree_cache = tree_cache
+        self.index = None
+
+        self.app_catalog = app_catalog or default_app_catalog
+        self.all_apps = self.app_catalog.names
+
+        # Without an observation the nodes are filled in by from_snapshot
+        if obs is not None:
+            self.nodes, self.linearized_accessibility_tree = self.linearize_and_annotate_tree(
+                self.input_tree, self.screenshot)
+
+    @classmethod
+    def from_snapshot(cls, observation, **kwargs):
+        '''Grounding agent over a recorded observation (see agent.Snapshot), the accessibility tree is not read'''
+        agent = cls(None, top_app=observation.meta.get('top_app'), **kwargs)
+        agent.nodes = observation.nodes
+        agent.linearized_accessibility_tree = observation.linearized_accessibility_tree
+        agent.focused_element_id = observation.focused_element_id
+        return agent
 
 
     def preserve_nodes(self, tree, exclude_roles=None):
         if exclude_roles is None:
             exclude_roles = set()
-        
-        preserved_nodes = []
-
-        # Inner function to recursively traverse the accessibility tree
-        def traverse_and_preserve(element):
-            role = element.node.getRoleName()
-
-            if role not in exclude_roles:
-                # TODO: get coordinate values directly from interface
-                if element.component:
-                    position = element.component.getPosition(pyatspi.XY_SCREEN)
-                    size = element.component.getSize()
-                    if position and size:                        
-                            # Extract the numerical values after 'x:' and 'y:'
-                            x = position[0]
-                            y = position[1]
-
-                            # Extract the numerical values after 'Width:' and 'Height:'
-                            w = size[0]
-                            h = size[1]
-            
-                            if x >= 0 and y >= 0 and w > 0 and h > 0:
-                                preserved_nodes.append(element)
-            
-            children = element.children()
-            if children:
-                for child_ref in children:
-                    child_element = UIElement(child_ref)
-                    traverse_and_preserve(child_element)
-
-        # Start traversing from the given element
-        traverse_and_preserve(tree)
-
-        return preserved_nodes
+
+        # Subtrees may be read in parallel, the nodes keep the order of a depth-first walk
+        key = tree.node.get_process_id() if self.traversal.per_app_limit else None
+        if self.tree_cache is not None:
+            # Only the parts changed since the last turn are read, with the exclude_roles of the cache
+            rows = (row for _, row in self.tree_cache.read(tree, key))
+        else:
+            rows = self.traversal.traverse(tree, lambda element: read_node(element, exclude_roles), key=key)
+        return NodeTable.from_rows(row for row in rows if row is not None)
 
     # TODO: chunk and shorten this function
     def linearize_and_annotate_tree(self, accessibility_tree, screenshot, platform="macos", tag=False):
         tree = accessibility_tree
-        preserved_nodes = self.preserve_nodes(tree, exclude_roles=['panel', 'window', 'filler', 'separator']).copy()
+        preserved_nodes = self.preserve_nodes(tree, exclude_roles=EXCLUDE_ROLES)
         
         linearized_accessibility_tree = [
             "id\trole\tname\ttext"]
 
-        for idx, node in enumerate(preserved_nodes):
-            name = node.attributes.get('name', '')
-            text = node.text
-            role = node.role
+        for idx, (role, name, text) in enumerate(preserved_nodes.rows()):
             linearized_accessibility_tree.append(
                 "{:}\t{:}\t{:}\t{:}".format(
                     idx,
@@ -115,12 +109,23 @@ class GroundingAgent:
         print(linearized_accessibility_tree)
         return preserved_nodes, linearized_accessibility_tree
 
+    def spatial_index(self, nodes=None):
+        '''SpatialIndex over the boxes of nodes (default self.nodes), rebuilt when the nodes change'''
+        nodes = self.nodes if nodes is None else nodes
+        if self.index is None or self.index_nodes is not nodes:
+            self.index = SpatialIndex(nodes.boxes(), nodes.valid)
+            self.index_nodes = nodes
+        return self.index
+
     def find_element(self, element_id):
         try:
             selected_element = self.nodes[int(element_id)]
+            # With tree deltas, ids of elements that left the screen are empty
+            if selected_element is None:
+                raise IndexError(element_id)
         except:
             print("The index of the selected element was out of range.")
-            selected_element = self.nodes[0]
+            selected_element = next(node for node in self.nodes if node is not None)
             self.index_out_of_range_flag = True 
         return selected_element
 
@@ -131,10 +136,12 @@ class GroundingAgent:
                 app_name:str, the name of the application to open from the following list of available applications in the system: AVAILABLE_APPS
         '''
         # fuzzy match the app name
-        # closest_matches = difflib.get_close_matches(app_name + ".app", self.all_apps, n=1, cutoff=0.6) 
-        if app_name in self.all_apps:
-            print(f"{app_name} has been opened successfully.")
-            return f"""import subprocess; subprocess.Popen(["{app_name}"])"""
+        closest_match = self.app_catalog.match(app_name)
+        if closest_match is not None:
+            # The Exec line of the desktop entry, the entry name is not always a command
+            command = closest_match.command or [closest_match.name]
+            print(f"{closest_match.name} has been opened successfully.")
+            return f"""import subprocess; subprocess.Popen({command!r})"""
         else:
             self.execution_feedback = "There is no application " + app_name + " installed on the system. Please replan and avoid this action."
             print(self.execution_feedback)
@@ -148,8 +155,8 @@ class GroundingAgent:
             click_type: the type of click to perform (left, right)
         '''
         node = self.find_element(element_id)
-        coordinates: Tuple[int, int] = node.component.getPosition(pyatspi.XY_SCREEN)
-        sizes: Tuple[int, int] = node.component.getSize()
+        coordinates: Tuple[int, int] = node['position']
+        sizes: Tuple[int, int] = node['size']
 
         # Calculate the center of the element
         x = coordinates[0] + sizes[0] // 2
@@ -164,8 +171,8 @@ class GroundingAgent:
             element: a short description of the element to click on
         '''
         node = self.find_element(element_id)
-        coordinates: Tuple[int, int] = node.component.getPosition(pyatspi.XY_SCREEN)
-        sizes: Tuple[int, int] = node.component.getSize()
+        coordinates: Tuple[int, int] = node['position']
+        sizes: Tuple[int, int] = node['size']
 
         # Calculate the center of the element
         x = coordinates[0] + sizes[0] // 2
@@ -180,8 +187,8 @@ class GroundingAgent:
             element: a short description of the element to click on
         '''
         node = self.find_element(element_id)
-        coordinates: Tuple[int, int] = node.component.getPosition(pyatspi.XY_SCREEN)
-        sizes: Tuple[int, int] = node.component.getSize()
+        coordinates: Tuple[int, int] = node['position']
+        sizes: Tuple[int, int] = node['size']
 
         # Calculate the center of the element
         x = coordinates[0] + sizes[0] // 2
@@ -198,6 +205,12 @@ class GroundingAgent:
             num_clicks: the number of clicks to perform
             click_type: the type of click to perform (left, right)
         '''
+        hits = self.spatial_index().elements_at(x, y)
+        if len(hits):
+            node = self.nodes[int(hits[0])]
+            logger.info("Clicking at (%s, %s) lands on element %d (%s %s)", x, y, hits[0], node['role'], node['title'])
+        else:
+            logger.info("Clicking at (%s, %s) lands on no element of the accessibility tree", x, y)
         return f"""import pyautogui; pyautogui.click({x}, {y}, clicks={num_clicks}, button="{click_type}")"""
 
     def switch_applications(self, app_name):
@@ -225,8 +238,8 @@ class GroundingAgent:
         except:
             node = self.find_element(0)
         # print(node.attrib)
-        coordinates: Tuple[int, int] = node.component.getPosition(pyatspi.XY_SCREEN)
-        sizes: Tuple[int, int] = node.component.getSize()
+        coordinates: Tuple[int, int] = node['position']
+        sizes: Tuple[int, int] = node['size']
 
         # Calculate the center of the element
         x = coordinates[0] + sizes[0] // 2
@@ -249,8 +262,8 @@ class GroundingAgent:
         except:
             node = self.find_element(0)
         # print(node.attrib)
-        coordinates: Tuple[int, int] = node.component.getPosition(pyatspi.XY_SCREEN)
-        sizes: Tuple[int, int] = node.component.getSize()
+        coordinates: Tuple[int, int] = node['position']
+        sizes: Tuple[int, int] = node['size']
 
         # Calculate the center of the element
         x = coordinates[0] + sizes[0] // 2
@@ -270,11 +283,11 @@ class GroundingAgent:
         '''
         node1 = self.find_element(element1_id)
         node2 = self.find_element(element2_id)
-        coordinates1: Tuple[int, int] = node1.component.getPosition(pyatspi.XY_SCREEN)
-        sizes1: Tuple[int, int] = node1.component.getSize()
+        coordinates1: Tuple[int, int] = node1['position']
+        sizes1: Tuple[int, int] = node1['size']
 
-        coordinates2: Tuple[int, int] = node2.component.getPosition(pyatspi.XY_SCREEN)
-        sizes2: Tuple[int, int] = node2.component.getSize()
+        coordinates2: Tuple[int, int] = node2['position']
+        sizes2: Tuple[int, int] = node2['size']
         
         # Calculate the center of the element
         x1 = coordinates1[0] + sizes1[0] // 2
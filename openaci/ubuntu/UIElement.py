@@ -18,6 +18,9 @@ platform_name: str = platform.system()
 import logging
 logger = logging.getLogger("openaci.agent")
 
+from agent.TreeCache import TreeCache
+from agent.TreeTraversal import ParallelTraversal
+
 
 class UIElement(object):
     def __init__(self, node:Accessible):
@@ -97,6 +100,97 @@ class UIElement(object):
     def __repr__(self):
         return "UIElement%s" % (self.node)
 
+def read_node(element, exclude_roles=()):
+    '''(x, y, w, h, role, name, text) of a visible element or None, and its children'''
+    role = element.node.getRoleName()
+    preserved = None
+
+    if role not in exclude_roles:
+        # TODO: get coordinate values directly from interface
+        if element.component:
+            position = element.component.getPosition(pyatspi.XY_SCREEN)
+            size = element.component.getSize()
+            if position and size:
+                x, y = position[0], position[1]
+                w, h = size[0], size[1]
+                if x >= 0 and y >= 0 and w > 0 and h > 0:
+                    # Read everything the agent needs now, no proxy is kept past the traversal
+                    preserved = (x, y, w, h, role, element.attributes.get('name', ''), element.text)
+
+    children = element.children()
+    return preserved, [UIElement(child_ref) for child_ref in children or []]
+
+
+# AT-SPI events that change what read_node returns, and how much of the cached tree they invalidate.
+# Event types are matched on their longest listed prefix, e.g. object:children-changed:add.
+ATSPI_INVALIDATION = {
+    'object:children-changed': 'node',
+    'object:property-change:accessible-name': 'node',
+    'object:property-change:accessible-role': 'node',
+    'object:text-changed': 'node',
+    'object:state-changed': 'node',
+    'object:bounds-changed': 'subtree',
+    'object:property-change:accessible-value': 'node',
+}
+
+# Scrolling moves every element of a scroll pane, but no child sends bounds-changed, only the scroll bar changes value
+SCROLL_BAR_ROLES = {'scroll bar'}
+
+
+class EventTreeCache(TreeCache):
+    '''Tree of the active app kept between turns, patched from AT-SPI events.
+
+    Events are queued by D-Bus and dispatched on the reading thread right before each read, so
+    libatspi is never used from two threads.
+
+    Args:
+        exclude_roles: roles left out of the rows, as for GroundingAgent.preserve_nodes
+        traversal: ParallelTraversal for new and invalidated subtrees, sequential if None
+        full_read_every: re-read the whole app after this many patched reads
+    '''
+    def __init__(self, exclude_roles=(), traversal=None, full_read_every=50):
+        super().__init__(lambda element: read_node(element, exclude_roles), lambda element: element.node,
+                         ATSPI_INVALIDATION, traversal or ParallelTraversal(max_workers=1),
+                         full_read_every=full_read_every)
+        self.listening = False
+
+    def invalidation_mode(self, event, element):
+        if event == 'object:property-change:accessible-value' and element.node.getRoleName() in SCROLL_BAR_ROLES:
+            return 'parent_subtree'
+        return super().invalidation_mode(event, element)
+
+    def on_atspi_event(self, event):
+        event_type = str(event.type)
+        while event_type and event_type not in self.invalidation:
+            event_type = event_type.rpartition(':')[0]
+        if event_type:
+            self.on_event(event_type, UIElement(event.source))
+
+    def watch(self, element):
+        if not self.listening:
+            pyatspi.Registry.registerEventListener(self.on_atspi_event, *ATSPI_INVALIDATION)
+            self.listening = True
+            self.invalidate()
+
+    def dispatch_events(self):
+        '''Deliver the events queued since the last read'''
+        from gi.repository import GLib
+
+        context = GLib.MainContext.default()
+        while context.pending():
+            context.iteration(False)
+
+    def read(self, root, app_key=None):
+        self.watch(root)
+        self.dispatch_events()
+        return super().read(root, app_key)
+
+    def close(self):
+        if self.listening:
+            pyatspi.Registry.deregisterEventListener(self.on_atspi_event, *ATSPI_INVALIDATION)
+            self.listening = False
+
+
 def traverse_and_print(node):
     print(node.attributes)
     print(node.node.getRoleName())
@@ -15,7 +15,7 @@ setup(
         'pyautogui==0.9.54',
         'Pillow==10.1.0',
         'backoff==2.1.2',
-	'torchvision',
+        'numpy',
     ],
     classifiers=[
         'Programming Language :: Python :: 3',
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The macOS modules import openaci.*, the agent modules import agent.* from inside openaci/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'openaci')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
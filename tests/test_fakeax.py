@@ -0,0 +1,34 @@
+from openaci.macos.FakeAX import FakeAXBackend, build_fake_tree
+from openaci.macos.UIElement import NODE_ATTRIBUTES, UIElement, collect_nodes, use_backend
+from openaci.agent.TreeTraversal import ParallelTraversal
+
+
+def read_tree(batch):
+    system_wide, application = build_fake_tree(depth=4, branching=3, seed=0)
+    backend = FakeAXBackend(batch=batch, root=system_wide)
+    use_backend(backend)
+    nodes, _ = collect_nodes(UIElement(application), traversal=ParallelTraversal(max_workers=1))
+    return nodes, backend.calls
+
+
+def count_elements(element):
+    return 1 + sum(count_elements(child) for child in element.attributes['AXChildren'])
+
+
+def test_batched_reads_see_the_same_tree():
+    batched, batched_calls = read_tree(batch=True)
+    single, single_calls = read_tree(batch=False)
+    assert list(batched.rows()) == list(single.rows())
+    assert (batched.boxes() == single.boxes()).all()
+
+    _, application = build_fake_tree(depth=4, branching=3, seed=0)
+    elements = count_elements(application)
+    assert batched_calls == elements
+    assert single_calls == elements * len(NODE_ATTRIBUTES)
+
+
+def test_system_wide_element_is_the_backend_root():
+    system_wide, application = build_fake_tree(depth=2, branching=2)
+    use_backend(FakeAXBackend(root=system_wide))
+    focused = UIElement.systemWideElement().attribute('AXFocusedApplication')
+    assert focused is application
@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("requests")
+
+from agent.OcrClient import OcrClient, OcrTimeout
+from agent.OcrServer import StandInOcrServer
+
+# Any bytes do, the stand-in server answers unreadable images as a full HD screen
+SCREENSHOT = b"not really a png" * 64
+
+
+@pytest.fixture
+def server():
+    server = StandInOcrServer(("127.0.0.1", 0), boxes=5, seed=0)
+    server.start_in_thread()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_requests_share_connections(server, binary):
+    client = OcrClient(server.url, binary=binary, pool_size=2)
+    try:
+        for _ in range(20):
+            results = client.recognize(SCREENSHOT)
+            assert [text for _, text, _ in results] == [f"text {i}" for i in range(5)]
+    finally:
+        client.close()
+    assert server.stats['requests'] == 20
+    assert server.stats['connections'] == 1
+
+
+def test_deadline_raises_ocr_timeout(server):
+    server.latency = 0.5
+    client = OcrClient(server.url, timeout=0.1)
+    try:
+        with pytest.raises(OcrTimeout):
+            client.recognize(SCREENSHOT)
+        with pytest.raises(OcrTimeout):
+            client.submit(SCREENSHOT).result()
+    finally:
+        client.close()
+
+
+def test_server_errors_are_retried(server):
+    server.error_rate_5xx = 0.5
+    client = OcrClient(server.url, retries=20)
+    try:
+        for _ in range(10):
+            assert len(client.recognize(SCREENSHOT)) == 5
+    finally:
+        client.close()
+    assert server.stats['errors_5xx'] > 0
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from agent.SpatialIndex import SpatialIndex, box_iou_one, synthetic_page
+
+
+def gaps(boxes, box):
+    gap_x = np.maximum(np.maximum(boxes[:, 0] - box[2], box[0] - boxes[:, 2]), 0)
+    gap_y = np.maximum(np.maximum(boxes[:, 1] - box[3], box[1] - boxes[:, 3]), 0)
+    return np.hypot(gap_x, gap_y)
+
+
+@pytest.fixture(scope="module", params=[(2000, 0), (300, 1)])
+def page(request):
+    nodes, seed = request.param
+    boxes = synthetic_page(nodes, seed=seed)
+    rng = np.random.default_rng(seed + 10)
+    points = np.stack([rng.uniform(-50, 1500, 200), rng.uniform(-50, 20050, 200)], axis=1)
+    probes = np.concatenate([points, points + rng.uniform(0, 300, (200, 2))], axis=1).astype(np.float32)
+    return boxes, SpatialIndex(boxes), probes
+
+
+def test_elements_at_matches_scan(page):
+    boxes, index, probes = page
+    for x, y, _, _ in probes:
+        hit = (boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3])
+        ids = index.elements_at(x, y)
+        assert set(ids.tolist()) == set(np.flatnonzero(hit).tolist())
+        areas = (boxes[ids, 2] - boxes[ids, 0]) * (boxes[ids, 3] - boxes[ids, 1])
+        assert (np.diff(areas) >= 0).all()
+
+
+@pytest.mark.parametrize("min_iou", [0., 0.1, 0.5])
+def test_overlapping_matches_scan(page, min_iou):
+    boxes, index, probes = page
+    for probe in probes:
+        iou, intersection = box_iou_one(probe, boxes)
+        expected = np.flatnonzero((intersection > 0) & (iou >= min_iou))
+        assert set(index.overlapping(probe, min_iou).tolist()) == set(expected.tolist())
+
+
+def test_nearest_matches_scan(page):
+    boxes, index, probes = page
+    for probe in probes:
+        nearest = index.nearest(probe)
+        assert gaps(boxes[nearest:nearest + 1], probe)[0] == pytest.approx(gaps(boxes, probe).min(), abs=1e-3)
+
+
+def test_valid_mask_and_empty_index():
+    boxes = synthetic_page(100)
+    valid = np.arange(100) % 2 == 0
+    index = SpatialIndex(boxes, valid)
+    assert all(i % 2 == 0 for i in index.overlapping([0, 0, 1440, 20000]).tolist())
+    empty = SpatialIndex(np.zeros((0, 4)))
+    assert empty.nearest([0, 0, 10, 10]) is None
+    assert len(empty.elements_at(5, 5)) == 0
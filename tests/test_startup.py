@@ -0,0 +1,25 @@
+import pytest
+
+from agent.StartupBenchmark import startup_time, total_time
+
+# Seconds an entry point may spend in imports, as the default --budget of StartupBenchmark
+BUDGET = 1.0
+
+
+def test_only_project_imports_are_counted():
+    times = [(3000, 3000, 0, 'encodings'), (9000, 800, 0, 'site'), (250000, 1000, 0, 'agent.UIAgent'),
+             (200000, 2000, 1, 'numpy'), (40000, 500, 0, 'openaci')]
+    assert total_time(times) == pytest.approx(0.29)
+
+
+def test_cli_app_within_budget():
+    assert startup_time('cli_app') <= BUDGET
+
+
+def test_agent_within_budget():
+    try:
+        seconds = startup_time('agent.UIAgent')
+    except RuntimeError as e:
+        # The platform modules need pyatspi or pyobjc, which the CI image does not install
+        pytest.skip(str(e).splitlines()[0])
+    assert seconds <= BUDGET
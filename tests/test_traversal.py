@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from agent.TreeTraversal import ParallelTraversal, build_synthetic_tree
+
+
+def expand_of(tree, latency=0.):
+    def expand(element):
+        if latency:
+            time.sleep(latency)
+        return element, tree[element]
+    return expand
+
+
+@pytest.mark.parametrize("nodes, branching", [(1, 6), (500, 6), (2000, 2), (300, 50)])
+def test_parallel_order_is_sequential_pre_order(nodes, branching):
+    tree = build_synthetic_tree(nodes, branching)
+    expand = expand_of(tree, latency=0.00001)
+    sequential = ParallelTraversal.traverse_sequential(0, expand)
+    assert sorted(sequential) == list(range(nodes))
+    assert ParallelTraversal(max_workers=8).traverse(0, expand) == sequential
+    assert ParallelTraversal(max_workers=1).traverse(0, expand) == sequential
+
+
+def test_per_app_limit_caps_concurrent_expansions():
+    tree = build_synthetic_tree(200, 4)
+    running = [0, 0]
+    lock = threading.Lock()
+
+    def expand(element):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.0005)
+        with lock:
+            running[0] -= 1
+        return element, tree[element]
+
+    ParallelTraversal(max_workers=8, per_app_limit=2).traverse(0, expand, key='app')
+    assert running[1] <= 2
+
+
+def test_errors_are_raised_to_the_caller():
+    tree = build_synthetic_tree(100, 3)
+
+    def expand(element):
+        if element == 42:
+            raise RuntimeError("element went away")
+        return element, tree[element]
+
+    with pytest.raises(RuntimeError):
+        ParallelTraversal(max_workers=4).traverse(0, expand)
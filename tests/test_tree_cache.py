@@ -0,0 +1,101 @@
+import random
+
+import pytest
+
+from openaci.agent.TreeTraversal import ParallelTraversal
+from openaci.macos.FakeAX import FakeAXBackend, build_fake_tree, random_change
+from openaci.macos.UIElement import EventTreeCache, UIElement, collect_nodes, use_backend
+
+
+def same_tree(full, cached):
+    return list(full.rows()) == list(cached.rows()) and (full.boxes() == cached.boxes()).all()
+
+
+def all_elements(application):
+    elements = []
+    stack = [application]
+    while stack:
+        element = stack.pop()
+        elements.append(element)
+        stack.extend(element.attributes['AXChildren'])
+    return elements
+
+
+@pytest.mark.parametrize("seed, workers", [(0, 1), (1, 8), (2, 8)])
+def test_cached_reads_match_full_reads(seed, workers):
+    system_wide, application = build_fake_tree(depth=4, branching=4, seed=seed)
+    backend = FakeAXBackend(root=system_wide)
+    use_backend(backend)
+    traversal = ParallelTraversal(workers)
+    cache = EventTreeCache(traversal=traversal, full_read_every=None)
+    rng = random.Random(seed)
+    try:
+        for turn in range(30):
+            if turn:
+                for _ in range(3):
+                    random_change(backend, application, rng)
+            full, _ = collect_nodes(UIElement(application), traversal=traversal)
+            cached, _ = collect_nodes(UIElement(application), traversal=traversal, cache=cache)
+            assert same_tree(full, cached), f"cached tree differs from a full read at turn {turn}"
+        assert cache.stats['full_reads'] == 1
+    finally:
+        cache.close()
+
+
+def test_scrolling_moves_the_cached_contents():
+    system_wide, application = build_fake_tree(depth=4, branching=4, seed=0)
+    areas = [element for element in all_elements(application) if element.attributes['AXRole'] == "AXScrollArea"]
+    assert areas
+    backend = FakeAXBackend(root=system_wide)
+    use_backend(backend)
+    traversal = ParallelTraversal(1)
+    cache = EventTreeCache(traversal=traversal, full_read_every=None)
+    try:
+        collect_nodes(UIElement(application), traversal=traversal, cache=cache)
+        for area in areas:
+            backend.scroll(area, -40)
+        full, _ = collect_nodes(UIElement(application), traversal=traversal)
+        cached, _ = collect_nodes(UIElement(application), traversal=traversal, cache=cache)
+        assert same_tree(full, cached)
+    finally:
+        cache.close()
+
+
+class ChangingBackend(FakeAXBackend):
+    '''Changes an element right after it was read, as an app updating during a traversal'''
+    def __init__(self, root, changes):
+        super().__init__(root=root)
+        self.changes = changes
+
+    def copy_multiple_attribute_values(self, ref, keys):
+        values = super().copy_multiple_attribute_values(ref, keys)
+        change = self.changes.pop(id(ref), None)
+        if change is not None:
+            change()
+        return values
+
+
+def test_events_during_a_full_read_are_applied():
+    system_wide, application = build_fake_tree(depth=3, branching=4, seed=3)
+    elements = all_elements(application)
+    changed, parent = elements[5], elements[9]
+    changes = {}
+    backend = ChangingBackend(system_wide, changes)
+    new_child = {'AXRole': "AXButton", 'AXTitle': "added while reading", 'AXDescription': "", 'AXValue': None,
+                 'AXPosition': (10., 10.), 'AXSize': (20., 20.), 'AXChildren': []}
+    changes[id(changed)] = lambda: backend.set_attribute(changed, 'AXTitle', "changed while reading")
+    changes[id(parent)] = lambda: backend.add_child(parent, type(parent)(new_child))
+    use_backend(backend)
+    traversal = ParallelTraversal(1)
+    cache = EventTreeCache(traversal=traversal, full_read_every=None)
+    try:
+        collect_nodes(UIElement(application), traversal=traversal, cache=cache)
+        assert not changes
+        full, _ = collect_nodes(UIElement(application), traversal=traversal)
+        cached, _ = collect_nodes(UIElement(application), traversal=traversal, cache=cache)
+        assert same_tree(full, cached)
+        assert cache.stats['full_reads'] == 1
+        titles = [title for _, title, _ in cached.rows()]
+        assert "changed while reading" in titles and "added while reading" in titles
+    finally:
+        cache.close()